@@ -0,0 +1,101 @@
+"""Compare encoder backends on the same frames: encode fps and output size.
+
+The frames are decoded once into memory, from an SVO file (requires the ZED SDK) or from any video that OpenCV can
+read, so that only encoding is measured. Usage:
+
+    python -m rgb_recorder.benchmarks.encoders (--svo FILE | --video FILE) [--frames 300] [--output-dir DIR]
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from rgb_recorder.recording.encoders import EncoderBackend, EncoderSettings, create_encoder
+
+CONFIGURATIONS = {
+    "opencv-m4s2": EncoderSettings(EncoderBackend.OPENCV, fourcc="M4S2"),
+    "opencv-mp4v": EncoderSettings(EncoderBackend.OPENCV, fourcc="mp4v"),
+    "ffmpeg-h264-ultrafast": EncoderSettings(EncoderBackend.FFMPEG, codec="libx264", preset="ultrafast", crf=23),
+    "ffmpeg-h264-veryfast": EncoderSettings(EncoderBackend.FFMPEG, codec="libx264", preset="veryfast", crf=23),
+    "ffmpeg-h265-veryfast": EncoderSettings(EncoderBackend.FFMPEG, codec="libx265", preset="veryfast", crf=28),
+}
+
+
+def read_svo_frames(svo_file: str, n_frames: int) -> Tuple[List[np.ndarray], float]:
+    import pyzed.sl as sl
+
+    from rgb_recorder.recording.zed_sdk.export import close_camera, get_video_properties, initialize_sdk, \
+        open_camera
+
+    cam = open_camera(initialize_sdk(svo_file, compute_depth=False))
+    _, _, fps = get_video_properties(cam)
+    image = sl.Mat()
+    rt_param = sl.RuntimeParameters()
+    frames = []
+    while len(frames) < n_frames and cam.grab(rt_param) == sl.ERROR_CODE.SUCCESS:
+        cam.retrieve_image(image, sl.VIEW.LEFT)
+        frames.append(cv2.cvtColor(image.get_data(), cv2.COLOR_BGRA2BGR))
+    close_camera(cam)
+    return frames, fps
+
+
+def read_video_frames(video_file: str, n_frames: int) -> Tuple[List[np.ndarray], float]:
+    capture = cv2.VideoCapture(video_file)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    frames = []
+    while len(frames) < n_frames:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames, fps
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--svo", type=str)
+    source.add_argument("--video", type=str)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--output-dir", type=str, default=None,
+                        help="Where to write the encoded videos. Defaults to a temporary directory.")
+    args = parser.parse_args()
+
+    if args.svo is not None:
+        frames, fps = read_svo_frames(args.svo, args.frames)
+    else:
+        frames, fps = read_video_frames(args.video, args.frames)
+    if not frames:
+        raise RuntimeError("Could not read any frames.")
+    height, width, _ = frames[0].shape
+    print(f"Encoding {len(frames)} frames of {width}x{height} at {fps} fps.")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = args.output_dir or tmp_dir
+        os.makedirs(output_dir, exist_ok=True)
+        for name, settings in CONFIGURATIONS.items():
+            output_file = os.path.join(output_dir, f"{name}.mp4")
+            if os.path.isfile(output_file):
+                os.remove(output_file)
+            try:
+                start_time = time.perf_counter()
+                encoder = create_encoder(output_file, fps, width, height, settings)
+                for frame in frames:
+                    encoder.write(frame)
+                encoder.release()
+                duration = time.perf_counter() - start_time
+            except IOError as e:
+                print(f"{name:>24}: failed ({e})")
+                continue
+            size = os.path.getsize(output_file)
+            print(f"{name:>24}: {len(frames) / duration:7.1f} fps, {size / 1e6:8.2f} MB "
+                  f"({size * 8 / (len(frames) / fps) / 1e6:6.2f} Mbit/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Microbenchmark of the per-frame memory traffic of export.export_all(), with and without zero_copy.
+
+The ZED SDK is not needed: a numpy array stands in for the data of the sl.Mat, which is what image.get_data() returns
+a view of. Usage:
+
+    python -m rgb_recorder.benchmarks.export_copies [--resolution 2208 1242] [--frames 200]
+"""
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+
+def legacy_frame(sdk_image: np.ndarray, svo_image_sbs_rgba: np.ndarray) -> np.ndarray:
+    svo_image_sbs_rgba[:] = sdk_image
+    return cv2.cvtColor(svo_image_sbs_rgba, cv2.COLOR_RGBA2RGB)
+
+
+def zero_copy_frame(sdk_image: np.ndarray, bgr_buffer: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(sdk_image, cv2.COLOR_BGRA2BGR, dst=bgr_buffer)
+
+
+def measure(name: str, frame_fn, sdk_image: np.ndarray, buffer: np.ndarray, n_frames: int,
+            bytes_copied_per_frame: int):
+    frame_fn(sdk_image, buffer)  # Warm up.
+
+    # numpy reports its allocations to tracemalloc, so this counts the bytes of the arrays allocated per frame.
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_snapshot = tracemalloc.take_snapshot()
+    frame_fn(sdk_image, buffer)
+    end_snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated_bytes = max(peak, sum(stat.size_diff for stat in end_snapshot.compare_to(start_snapshot, "lineno")))
+
+    start_time = time.perf_counter()
+    for _ in range(n_frames):
+        frame_fn(sdk_image, buffer)
+    duration = (time.perf_counter() - start_time) / n_frames
+
+    print(f"{name:>10}: {bytes_copied_per_frame / 1e6:6.1f} MB copied, {allocated_bytes / 1e6:6.1f} MB allocated, "
+          f"{duration * 1e3:6.2f} ms per frame")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolution", nargs=2, type=int, default=[2208, 1242])
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    width, height = args.resolution
+    sdk_image = np.random.randint(0, 256, (height, width, 4), dtype=np.uint8)
+    bgra_bytes = height * width * 4
+    bgr_bytes = height * width * 3
+
+    print(f"Per frame at {width}x{height}, for a single output:")
+    # Copy into the side by side buffer, then the conversion writes a newly allocated image.
+    measure("legacy", legacy_frame, sdk_image, np.zeros((height, width, 4), dtype=np.uint8), args.frames,
+            bgra_bytes + bgr_bytes)
+    # The conversion reads the SDK buffer directly and writes into the reused buffer.
+    measure("zero-copy", zero_copy_frame, sdk_image, np.empty((height, width, 3), dtype=np.uint8), args.frames,
+            bgr_bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Compares the CPU time and wake-up latency of consumers that wait for new frames by polling the ring buffer in a
+sleep loop (as the receivers used to do) with consumers that block on frame notifications (frame_notifier.py).
+
+A publisher process writes small frames to a camera segment at a fixed rate, with time.time() as their timestamp. Every
+consumer waits for each new frame, measures how long after its publication it woke up, and measures its own CPU time.
+No camera is needed. Usage:
+
+    python -m rgb_recorder.benchmarks.frame_notification [--consumers 6] [--fps 30] [--duration 10]
+"""
+import argparse
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from rgb_recorder.recording.camera_segment import CameraSegment
+from rgb_recorder.recording.frame_notifier import NOTIFICATIONS_SUPPORTED, FrameNotifier, FrameSubscription
+
+_SHAPE = (120, 160, 3)
+
+
+def _publish(segment_name: str, fps: float, ready_event, stop_event):
+    segment = CameraSegment.create(segment_name, {"rgb": (_SHAPE, np.uint8)}, 4, fps, np.eye(3))
+    notifier = FrameNotifier(segment_name)
+    frame = np.zeros(_SHAPE, dtype=np.uint8)
+    ready_event.set()
+    next_frame_time = time.time()
+    while not stop_event.is_set():
+        next_frame_time += 1 / fps
+        time.sleep(max(next_frame_time - time.time(), 0))
+        segment.frame_ring.write(time.time(), {"rgb": frame})
+        notifier.notify()
+    notifier.close()
+    segment.close()
+    segment.unlink()
+
+
+def _consume(segment_name: str, use_notifications: bool, start_event, stop_event, results):
+    # Not CameraSegment.attach(): the publisher is started from the same process tree, so it shares our resource
+    # tracker and unregistering here would make its unlink fail.
+    segment = CameraSegment(shared_memory.SharedMemory(name=segment_name))
+    subscription = FrameSubscription(segment_name) if use_notifications else None
+    out = {"rgb": np.empty(_SHAPE, dtype=np.uint8)}
+    previous_timestamp = time.time()
+    latencies = []
+
+    start_event.wait()
+    cpu_start, wall_start = time.process_time(), time.time()
+    while not stop_event.is_set():
+        if segment.frame_ring.latest_timestamp() <= previous_timestamp:
+            if subscription is not None:
+                subscription.wait(0.1)
+            else:
+                time.sleep(0.0001)
+            continue
+        wake_time = time.time()
+        previous_timestamp = segment.frame_ring.read_latest(out)
+        latencies.append(wake_time - previous_timestamp)
+    cpu_time, wall_time = time.process_time() - cpu_start, time.time() - wall_start
+
+    results.put((cpu_time / wall_time, latencies))
+    if subscription is not None:
+        subscription.close()
+    segment.close()
+
+
+def _run(use_notifications: bool, args) -> None:
+    context = multiprocessing.get_context("spawn")
+    segment_name = f"frame_notification_{time.time_ns()}"
+    ready_event, start_event, stop_event = context.Event(), context.Event(), context.Event()
+    results = context.Queue()
+
+    publisher = context.Process(target=_publish, args=(segment_name, args.fps, ready_event, stop_event))
+    publisher.start()
+    ready_event.wait()
+    consumers = [context.Process(target=_consume, args=(segment_name, use_notifications, start_event, stop_event,
+                                                        results)) for _ in range(args.consumers)]
+    for consumer in consumers:
+        consumer.start()
+    time.sleep(1.0)  # Let the consumers subscribe.
+    start_event.set()
+    time.sleep(args.duration)
+    stop_event.set()
+    consumer_results = [results.get() for _ in consumers]
+    for process in [*consumers, publisher]:
+        process.join()
+
+    cpu_usage = np.array([result[0] for result in consumer_results])
+    latencies = np.concatenate([result[1] for result in consumer_results]) * 1000
+    name = "notification" if use_notifications else "polling"
+    print(f"{name:>12}: CPU per consumer {100 * cpu_usage.mean():5.1f}% (max {100 * cpu_usage.max():5.1f}%), "
+          f"wake-up latency mean {latencies.mean():.3f} ms, p99 {np.percentile(latencies, 99):.3f} ms, "
+          f"max {latencies.max():.3f} ms ({len(latencies)} frames)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--consumers", type=int, default=6)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--duration", type=float, default=10.0, help="Duration of each run in seconds.")
+    args = parser.parse_args()
+
+    if not NOTIFICATIONS_SUPPORTED:
+        raise SystemExit("Frame notifications are not supported on this platform.")
+    _run(False, args)
+    _run(True, args)
+
+
+if __name__ == "__main__":
+    main()
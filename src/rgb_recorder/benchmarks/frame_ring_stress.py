@@ -0,0 +1,174 @@
+"""Stress test of the shared memory ring buffer (frame_ring.py) with one writer and many readers.
+
+The writer fills every frame with a value derived from its frame number and uses the frame number as its timestamp,
+so that every reader can verify that the images and timestamp it copied belong to the same frame. Any mismatch is a
+torn frame. With --no-seqlock, readers copy the latest slot without checking its sequence counter, which shows that
+the test does detect torn frames. With --borrow, readers pin the latest slot and verify the views into shared memory
+instead of copying; this needs more slots than readers, e.g. --slots 10 for 8 readers. No camera is needed. Usage:
+
+    python -m rgb_recorder.benchmarks.frame_ring_stress [--readers 8] [--duration 10] [--slots 4] [--no-seqlock|--borrow]
+"""
+import argparse
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from rgb_recorder.recording.frame_ring import (FrameRing, HEAD_DTYPE, PIN_DTYPE, SEQUENCE_DTYPE, TIMESTAMP_DTYPE,
+                                               TornReadError)
+
+_CHANNELS = ("left", "right")
+
+
+def _block_specs(num_slots: int, num_readers: int,
+                 shape: Tuple[int, ...]) -> Dict[str, Tuple[Tuple[int, ...], type]]:
+    specs = {"head": ((2,), HEAD_DTYPE), "sequences": ((num_slots,), SEQUENCE_DTYPE),
+             "timestamps": ((num_slots,), TIMESTAMP_DTYPE), "pins": ((num_readers,), PIN_DTYPE)}
+    for channel in _CHANNELS:
+        specs[channel] = ((num_slots, *shape), np.uint8)
+    return specs
+
+
+def _attach(namespace: str, num_slots: int, num_readers: int,
+            shape: Tuple[int, ...]) -> Tuple[List[shared_memory.SharedMemory], FrameRing]:
+    blocks, arrays = [], {}
+    for name, (block_shape, dtype) in _block_specs(num_slots, num_readers, shape).items():
+        # The processes share the resource tracker of the main process, which unlinks the blocks at the end.
+        block = shared_memory.SharedMemory(name=f"{namespace}_{name}")
+        blocks.append(block)
+        arrays[name] = np.ndarray(block_shape, dtype=dtype, buffer=block.buf)
+    ring = FrameRing(arrays["head"], arrays["sequences"], arrays["timestamps"],
+                     {channel: arrays[channel] for channel in _CHANNELS}, arrays["pins"])
+    return blocks, ring
+
+
+def _expected_value(frame_number: int, channel_index: int) -> int:
+    return (frame_number * 7 + channel_index * 101) % 251
+
+
+def _write(namespace: str, num_slots: int, num_readers: int, shape: Tuple[int, ...], stop_event, frames_written):
+    blocks, ring = _attach(namespace, num_slots, num_readers, shape)
+    frame_number = 0
+    while not stop_event.is_set():
+        frame_number += 1
+        slot = ring.begin_write()
+        for channel_index, channel in enumerate(_CHANNELS):
+            ring.channels[channel][slot].fill(_expected_value(frame_number, channel_index))
+        ring.end_write(slot, float(frame_number))
+    frames_written.value = frame_number
+    for block in blocks:
+        block.close()
+
+
+def _read(namespace: str, num_slots: int, num_readers: int, reader_index: int, shape: Tuple[int, ...], mode: str,
+          stop_event, results):
+    blocks, ring = _attach(namespace, num_slots, num_readers, shape)
+    out = {channel: np.empty(shape, dtype=np.uint8) for channel in _CHANNELS}
+    frames_read, torn_frames, failed_reads = 0, 0, 0
+    while not stop_event.is_set():
+        if mode == "borrow":
+            try:
+                frame = ring.borrow_latest(reader_index, _CHANNELS)
+            except TornReadError:
+                failed_reads += 1
+                continue
+            if frame is None:
+                continue
+            # Verify the views themselves, while the slot is pinned.
+            frame_number = int(frame.timestamp)
+            frames_read += 1
+            for channel_index, channel in enumerate(_CHANNELS):
+                if not np.all(frame.channels[channel] == _expected_value(frame_number, channel_index)):
+                    torn_frames += 1
+                    break
+            ring.release(reader_index)
+            continue
+        elif mode == "seqlock":
+            try:
+                timestamp = ring.read_latest(out)
+            except TornReadError:
+                failed_reads += 1
+                continue
+            if timestamp is None:
+                continue
+        else:
+            slot = ring.latest_slot()
+            if slot is None:
+                continue
+            for channel in _CHANNELS:
+                out[channel][:] = ring.channels[channel][slot]
+            timestamp = float(ring.timestamps[slot])
+
+        frames_read += 1
+        frame_number = int(timestamp)
+        for channel_index, channel in enumerate(_CHANNELS):
+            image = out[channel]
+            expected = _expected_value(frame_number, channel_index)
+            # Frames are written from start to end, so a torn frame differs in its first or last pixels.
+            if image.flat[0] != expected or image.flat[-1] != expected or not np.all(image == expected):
+                torn_frames += 1
+                break
+    results.put((frames_read, torn_frames, failed_reads))
+    for block in blocks:
+        block.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="Duration of the test in seconds.")
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--resolution", nargs=2, type=int, default=[1280, 720])
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument("--no-seqlock", action="store_true", help="Read without checking the sequence counters.")
+    mode_group.add_argument("--borrow", action="store_true", help="Borrow pinned frames instead of copying them.")
+    args = parser.parse_args()
+    mode = "borrow" if args.borrow else "unsynchronized" if args.no_seqlock else "seqlock"
+
+    width, height = args.resolution
+    shape = (height, width, 3)
+    namespace = f"frame_ring_stress_{time.time_ns()}"
+
+    blocks = []
+    for name, (block_shape, dtype) in _block_specs(args.slots, args.readers, shape).items():
+        size = int(np.prod(block_shape)) * np.dtype(dtype).itemsize
+        block = shared_memory.SharedMemory(name=f"{namespace}_{name}", create=True, size=size)
+        np.ndarray(block_shape, dtype=dtype, buffer=block.buf).fill(0)
+        blocks.append(block)
+
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    results = context.Queue()
+    frames_written = context.Value("q", 0)
+    readers = [context.Process(target=_read, args=(namespace, args.slots, args.readers, reader_index, shape, mode,
+                                                   stop_event, results)) for reader_index in range(args.readers)]
+    writer = context.Process(target=_write, args=(namespace, args.slots, args.readers, shape, stop_event,
+                                                  frames_written))
+
+    try:
+        for process in [*readers, writer]:
+            process.start()
+        time.sleep(args.duration)
+        stop_event.set()
+        reader_results = [results.get() for _ in readers]
+        for process in [*readers, writer]:
+            process.join()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    frames_read = sum(result[0] for result in reader_results)
+    torn_frames = sum(result[1] for result in reader_results)
+    failed_reads = sum(result[2] for result in reader_results)
+    print(f"Writer: {frames_written.value} frames ({frames_written.value / args.duration:.0f} fps), "
+          f"{args.readers} readers: {frames_read} frames read, {torn_frames} torn, "
+          f"{failed_reads} reads gave up after retrying.")
+    if torn_frames > 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
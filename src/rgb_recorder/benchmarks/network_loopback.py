@@ -0,0 +1,113 @@
+"""Measures the frame rate, latency and bandwidth of streaming a camera over TCP (network.py) on localhost, for every
+compression.
+
+A publisher process writes synthetic stereo RGB images and a depth map to a camera segment at a fixed rate, with
+time.time() as their timestamp. A FrameStreamServer serves the segment on 127.0.0.1 and a RemoteZedReceiver in this
+process retrieves every frame it can, measuring how long after its publication each frame was decoded. No camera is
+needed. Usage:
+
+    python -m rgb_recorder.benchmarks.network_loopback [--fps 30] [--resolution 1280 720] [--duration 10]
+        [--compression none jpeg lossless] [--batch-size 1] [--max-queued-frames 2]
+"""
+import argparse
+import multiprocessing
+import time
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from rgb_recorder.recording.camera_segment import CameraSegment, segment_name
+from rgb_recorder.recording.channels import CHANNEL_LAYOUTS, ZedChannel, channel_shape
+from rgb_recorder.recording.frame_notifier import FrameNotifier
+from rgb_recorder.recording.network import FrameCompression, FrameStreamServer, RemoteZedReceiver
+
+_CHANNELS = (ZedChannel.RGB_LEFT, ZedChannel.RGB_RIGHT, ZedChannel.DEPTH_MM)
+
+
+def _synthetic_frame(channel: ZedChannel, width: int, height: int, frame_number: int) -> np.ndarray:
+    # A moving gradient with some noise, so that the images compress about as well as camera images.
+    rows, columns = np.indices((height, width))
+    base = (rows + columns + 4 * frame_number).astype(np.float32)
+    noise = np.random.default_rng(frame_number).normal(0, 2, (height, width)).astype(np.float32)
+    if channel == ZedChannel.DEPTH_MM:
+        return (500 + 2 * base + noise).astype(np.uint16)
+    offset = 0 if channel == ZedChannel.RGB_LEFT else 16
+    image = np.stack([base + offset, base / 2, 255 - base / 3], axis=-1) + noise[..., None]
+    return (image % 256).astype(np.uint8)
+
+
+def _publish(namespace: str, fps: float, width: int, height: int, ready_event, stop_event):
+    name = segment_name(namespace)
+    segment = CameraSegment.create(name, {channel.value: (channel_shape(channel, width, height),
+                                                          CHANNEL_LAYOUTS[channel][1]) for channel in _CHANNELS},
+                                   4, fps, np.eye(3))
+    notifier = FrameNotifier(name)
+    # Prepare a second of frames up front, so that publishing stays cheap.
+    frames = [{channel.value: _synthetic_frame(channel, width, height, frame_number) for channel in _CHANNELS}
+              for frame_number in range(int(fps))]
+    ready_event.set()
+    next_frame_time = time.time()
+    frame_number = 0
+    while not stop_event.is_set():
+        next_frame_time += 1 / fps
+        time.sleep(max(next_frame_time - time.time(), 0))
+        segment.frame_ring.write(time.time(), frames[frame_number % len(frames)])
+        notifier.notify()
+        frame_number += 1
+    notifier.close()
+    segment.close()
+    # The server's ZedReceiver shares our resource tracker and unregistered the segment when it attached.
+    resource_tracker.register(segment.shm._name, "shared_memory")  # type: ignore[attr-defined]
+    segment.unlink()
+
+
+def _run(compression: FrameCompression, args) -> None:
+    context = multiprocessing.get_context("spawn")
+    namespace = f"network_loopback_{time.time_ns()}"
+    width, height = args.resolution
+    ready_event, stop_event = context.Event(), context.Event()
+    publisher = context.Process(target=_publish, args=(namespace, args.fps, width, height, ready_event, stop_event))
+    publisher.start()
+    ready_event.wait()
+
+    server = FrameStreamServer(namespace, "127.0.0.1", 0, compression=compression, batch_size=args.batch_size,
+                               max_queued_frames=args.max_queued_frames)
+    server.start()
+    receiver = RemoteZedReceiver("127.0.0.1", server.port)
+    latencies = []
+    start_time = time.time()
+    while time.time() - start_time < args.duration:
+        if not receiver.wait_for_frame(receiver.retrieved_timestamp, timeout=0.5):
+            continue
+        receiver.retrieve_channels(receiver.channels)
+        latencies.append(time.time() - receiver.retrieved_timestamp)
+    elapsed = time.time() - start_time
+    frames_dropped, bytes_received = server.frames_dropped, receiver.bytes_received
+
+    receiver.close()
+    server.stop()
+    stop_event.set()
+    publisher.join()
+
+    latencies = np.array(latencies) * 1000
+    print(f"{compression.value:>9}: {len(latencies) / elapsed:5.1f} fps, latency mean {latencies.mean():6.2f} ms, "
+          f"p99 {np.percentile(latencies, 99):6.2f} ms, {bytes_received / elapsed / 1e6:7.1f} MB/s, "
+          f"{receiver.frames_missed} frames missed ({frames_dropped} dropped by the server)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--resolution", nargs=2, type=int, default=[1280, 720])
+    parser.add_argument("--duration", type=float, default=10.0, help="Duration of each run in seconds.")
+    parser.add_argument("--compression", nargs="+", type=FrameCompression, default=list(FrameCompression))
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--max-queued-frames", type=int, default=2)
+    args = parser.parse_args()
+
+    for compression in args.compression:
+        _run(compression, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""End-to-end benchmark of the capture pipeline with simulated cameras, for every combination of camera count,
+resolution and fps. Results are written to a JSON file, so that runs on different rigs or commits can be compared.
+
+For every configuration, one SyntheticCamera publisher, one MultiprocessVideoRecorder and one probe receiver are
+started per camera. After a warm-up, the following is measured over --duration seconds:
+* the frame rate of every publisher;
+* the copy latency of the probe (how long retrieving a frame takes) and its delivery latency (how long after
+  publication it had the frame);
+* the sustained frame rate of every recorder and the number of frames that were overwritten before it could record
+  them (from the subscription statistics, see monitor.py);
+* the CPU use of every process, as a percentage of one core.
+
+With --svo, the frame rate of export() is measured as well (this requires the ZED SDK). Usage:
+
+    python -m rgb_recorder.benchmarks.suite [--cameras 1 2 4] [--resolutions 1280x720 1920x1080] [--fps 30 60]
+        [--duration 10] [--pixel-format bgr] [--svo FILE] [--output FILE]
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rgb_recorder.recording.camera_segment import CameraSegment, segment_name
+from rgb_recorder.recording.frame_index import FrameIndex, index_filename
+from rgb_recorder.recording.pixel_formats import PixelFormat
+from rgb_recorder.recording.record import create_publishers
+from rgb_recorder.recording.simulated_cameras import SyntheticCamera
+from rgb_recorder.recording.video_recorder import MultiprocessVideoRecorder
+from rgb_recorder.recording.zed_multiprocessing import ZedReceiver
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_WARMUP = 3.0  # Seconds. Gives the recorders time to open their encoders.
+_PROBE_NAME = "benchmark_probe"
+_RECORDER_NAME = "video_recorder"
+
+
+def _cpu_seconds(pid: int) -> Optional[float]:
+    """The CPU time (user and system) of a process, or None if it cannot be measured on this platform."""
+    if psutil is not None:
+        try:
+            times = psutil.Process(pid).cpu_times()
+        except psutil.Error:
+            return None
+        return times.user + times.system
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces, so the fields are counted from its closing parenthesis.
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _summarize(values_ms: List[float]) -> Dict[str, Optional[float]]:
+    if not values_ms:
+        return {"mean_ms": None, "p50_ms": None, "p99_ms": None, "max_ms": None}
+    values = np.array(values_ms)
+    return {"mean_ms": float(values.mean()), "p50_ms": float(np.percentile(values, 50)),
+            "p99_ms": float(np.percentile(values, 99)), "max_ms": float(values.max())}
+
+
+def _probe(namespace: str, start_event, stop_event, results) -> None:
+    receiver = ZedReceiver(namespace, name=_PROBE_NAME, pixel_format=None)
+    copy_latencies, delivery_latencies = [], []
+    start_event.wait()
+    while not stop_event.is_set():
+        if not receiver.wait_for_frame(receiver.retrieved_timestamp, timeout=0.1):
+            continue
+        wake_time = time.time()
+        receiver.retrieve_channels(receiver.channels)
+        copy_latencies.append((time.time() - wake_time) * 1000)
+        delivery_latencies.append((wake_time - receiver.retrieved_timestamp) * 1000)
+    results.put((namespace, copy_latencies, delivery_latencies))
+    receiver._close_shared_memory()
+
+
+def _readers_by_name(segment: CameraSegment) -> Dict[str, np.void]:
+    readers = segment.readers.copy()
+    return {reader["name"].decode(): reader for reader in readers if reader["pid"] != 0}
+
+
+def _snapshot(segments: Dict[str, CameraSegment], pids: Dict[Tuple[str, str], int]):
+    return (time.time(),
+            {namespace: segment.frame_ring.frames_published for namespace, segment in segments.items()},
+            {namespace: _readers_by_name(segment) for namespace, segment in segments.items()},
+            {key: _cpu_seconds(pid) for key, pid in pids.items()})
+
+
+def run_configuration(num_cameras: int, resolution: Tuple[int, int], fps: int, duration: float,
+                      output_dir: str, pixel_format: PixelFormat = PixelFormat.BGR) -> dict:
+    """Run the pipeline with num_cameras synthetic cameras, which publish in pixel_format, and return the
+    measurements."""
+    prefix = f"bench{time.time_ns()}"
+    namespaces = [f"{prefix}_{i}" for i in range(num_cameras)]
+    context = multiprocessing.get_context("spawn")
+    start_event, stop_event = context.Event(), context.Event()
+    results = context.Queue()
+
+    publishers = create_publishers(fps, resolution, namespaces, camera_cls=SyntheticCamera, pixel_format=pixel_format)
+    for publisher in publishers:
+        publisher.start()
+    # Not CameraSegment.attach(): the publishers share our resource tracker, see frame_notification.py.
+    segments = {namespace: CameraSegment(shared_memory.SharedMemory(name=segment_name(namespace)))
+                for namespace in namespaces}
+
+    video_paths = {namespace: os.path.join(output_dir, namespace, "color.mp4") for namespace in namespaces}
+    # At a fixed quality, so that the frame rate of the encoders is measured, not that of a raw spill.
+    recorders = [MultiprocessVideoRecorder(namespace, video_paths[namespace], adaptive_quality=False)
+                 for namespace in namespaces]
+    probes = [context.Process(target=_probe, args=(namespace, start_event, stop_event, results))
+              for namespace in namespaces]
+    for process in [*recorders, *probes]:
+        process.start()
+
+    pids = {}
+    for namespace, publisher, recorder, probe in zip(namespaces, publishers, recorders, probes):
+        pids[(namespace, "publisher")] = publisher.pid
+        pids[(namespace, "recorder")] = recorder.pid
+        pids[(namespace, "probe")] = probe.pid
+
+    time.sleep(_WARMUP)
+    start_event.set()
+    start = _snapshot(segments, pids)
+    time.sleep(duration)
+    end = _snapshot(segments, pids)
+    stop_event.set()
+
+    probe_results = {}
+    for _ in probes:
+        namespace, copy_latencies, delivery_latencies = results.get()
+        probe_results[namespace] = (copy_latencies, delivery_latencies)
+    for recorder in recorders:
+        recorder.shutdown_event.set()
+    for process in [*probes, *recorders]:
+        process.join()
+    for segment in segments.values():
+        segment.close()
+    for publisher in publishers:
+        publisher.stop()
+    for publisher in publishers:
+        publisher.join()
+
+    window = end[0] - start[0]
+    cameras = []
+    for namespace in namespaces:
+        readers_start, readers_end = start[2][namespace], end[2][namespace]
+        recorder = {"fps": None, "overwritten_frames": None}
+        if _RECORDER_NAME in readers_start and _RECORDER_NAME in readers_end:
+            recorder_start, recorder_end = readers_start[_RECORDER_NAME], readers_end[_RECORDER_NAME]
+            recorder = {"fps": (int(recorder_end["delivered"]) - int(recorder_start["delivered"])) / window,
+                        "overwritten_frames": int(recorder_end["overwritten"]) - int(recorder_start["overwritten"])}
+        index_file = index_filename(video_paths[namespace])
+        recorder["frames_written"] = len(FrameIndex(index_file)) if os.path.exists(index_file) else None
+
+        copy_latencies, delivery_latencies = probe_results[namespace]
+        cpu_percent = {}
+        for role in ("publisher", "recorder", "probe"):
+            cpu_start, cpu_end = start[3][(namespace, role)], end[3][(namespace, role)]
+            cpu_percent[role] = None if cpu_start is None or cpu_end is None else \
+                100 * (cpu_end - cpu_start) / window
+        cameras.append({
+            "namespace": namespace,
+            "publisher_fps": (end[1][namespace] - start[1][namespace]) / window,
+            "receiver_copy_latency": _summarize(copy_latencies),
+            "receiver_delivery_latency": _summarize(delivery_latencies),
+            "recorder": recorder,
+            "cpu_percent": cpu_percent,
+        })
+    return {"cameras": num_cameras, "resolution": list(resolution), "fps": fps, "pixel_format": pixel_format.value,
+            "duration": window, "per_camera": cameras}
+
+
+def run_export(svo_file: str, output_dir: str) -> dict:
+    """Export the left view of an SVO file and return the export frame rate."""
+    from rgb_recorder.recording.zed_sdk.export import OutputMode, export
+
+    output_file = os.path.join(output_dir, "export_left.mp4")
+    start_time = time.time()
+    export(svo_file, output_file, OutputMode.RGB_LEFT, show_progress=False)
+    elapsed = time.time() - start_time
+    frames = len(FrameIndex.for_output(output_file))
+    return {"svo_file": os.path.abspath(svo_file), "frames": frames, "seconds": elapsed, "fps": frames / elapsed}
+
+
+def _metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"date": datetime.datetime.now().isoformat(timespec="seconds"), "host": platform.node(),
+            "platform": platform.platform(), "python": platform.python_version(), "cpu_count": os.cpu_count(),
+            "commit": commit}
+
+
+def _print_configuration(result: dict) -> None:
+    width, height = result["resolution"]
+    print(f"{result['cameras']} camera(s) at {width}x{height}@{result['fps']} ({result['pixel_format']}):")
+    for camera in result["per_camera"]:
+        copy_latency, recorder = camera["receiver_copy_latency"], camera["recorder"]
+        cpu = ", ".join(f"{role} {'n/a' if value is None else f'{value:.0f}%'}"
+                        for role, value in camera["cpu_percent"].items())
+        copy = "n/a" if copy_latency["mean_ms"] is None else \
+            f"{copy_latency['mean_ms']:.2f} ms (p99 {copy_latency['p99_ms']:.2f} ms)"
+        recorder_fps = "n/a" if recorder["fps"] is None else f"{recorder['fps']:.1f} fps"
+        print(f"  {camera['namespace']}: publisher {camera['publisher_fps']:.1f} fps, copy {copy}, "
+              f"recorder {recorder_fps} ({recorder['overwritten_frames']} overwritten), CPU {cpu}")
+
+
+def _resolution(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cameras", nargs="+", type=int, default=[1, 2])
+    parser.add_argument("--resolutions", nargs="+", type=_resolution, default=[(1280, 720)],
+                        help="Resolutions as WIDTHxHEIGHT, e.g. 1280x720.")
+    parser.add_argument("--fps", nargs="+", type=int, default=[30])
+    parser.add_argument("--duration", type=float, default=10.0, help="Measurement time per configuration, in seconds.")
+    parser.add_argument("--pixel-format", choices=[pixel_format.value for pixel_format in PixelFormat],
+                        default=PixelFormat.BGR.value, help="The pixel format of the views in shared memory.")
+    parser.add_argument("--svo", type=str, default=None, help="Also measure export() on this SVO file.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="The JSON file to write. Defaults to benchmark_<date>_<time>.json.")
+    args = parser.parse_args()
+
+    multiprocessing.set_start_method("spawn")
+    output = args.output or datetime.datetime.now().strftime("benchmark_%Y-%m-%d_%H-%M-%S.json")
+    report = {"metadata": _metadata(), "configurations": [], "export": None}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for num_cameras in args.cameras:
+            for resolution in args.resolutions:
+                for fps in args.fps:
+                    result = run_configuration(num_cameras, resolution, fps, args.duration,
+                                               os.path.join(output_dir, f"{num_cameras}_{resolution[0]}_{fps}"),
+                                               PixelFormat(args.pixel_format))
+                    _print_configuration(result)
+                    report["configurations"].append(result)
+        if args.svo is not None:
+            report["export"] = run_export(args.svo, output_dir)
+            print(f"export: {report['export']['fps']:.1f} fps ({report['export']['frames']} frames)")
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""A single shared memory segment per camera, holding a versioned header followed by the frame slots of a ring buffer.
+
+Layout of the segment (all offsets are in bytes, from the start of the segment):
+* The header (HEADER_DTYPE), padded to a whole number of pages. It contains a magic string and layout version, the
+  camera fps and intrinsics, the ring buffer state (see frame_ring.py), a table of readers and a table that describes
+  every channel: its name, dtype, shape, pixel format (for images, see pixel_formats.py), and the offset and size of
+  its slots.
+* For every channel, num_slots frame slots. Every slot starts on a page boundary, so that a frame never shares a page
+  with the frame of another slot or channel.
+
+Receivers only need the name of the segment: everything else is read from the header, so new channels can be added
+without new shared memory names or changes to the receivers that do not use them.
+
+Every reader claims an entry of the reader table by locking the corresponding byte of a lock file next to the segment.
+The operating system releases the lock when the reader exits, even if it crashes, so entries are never lost. An entry
+(READER_DTYPE) holds the slot that the reader has pinned, if any (see frame_ring.py), and its subscription: its name,
+target rate, cursor (the number of the last frame it consumed) and statistics. Each entry is only written by the reader
+that owns it, so monitoring tools can read the table at any time without disturbing the publisher or the readers. The
+pin of a reader that crashed is cleared by the next reader that claims an entry, while it holds the lock of that entry.
+"""
+import mmap
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: readers cannot claim entries, so frames are borrowed without pinning.
+    fcntl = None
+
+import numpy as np
+
+from rgb_recorder.recording.frame_ring import (FrameRing, FRAME_NUMBER_DTYPE, HEAD_DTYPE, PIN_DTYPE, SEQUENCE_DTYPE,
+                                               TIMESTAMP_DTYPE)
+
+SEGMENT_MAGIC = b"RGBSHM01"
+LAYOUT_VERSION = 4
+MAX_SLOTS = 64
+MAX_READERS = 64
+MAX_CHANNELS = 16
+MAX_DIMENSIONS = 4
+PAGE_SIZE = mmap.PAGESIZE
+
+CHANNEL_DTYPE = np.dtype([
+    ("name", "S32"),
+    ("dtype", "S8"),  # numpy dtype string, e.g. "|u1" or "<f4".
+    ("ndim", np.uint32),
+    ("shape", np.int64, (MAX_DIMENSIONS,)),
+    ("pixel_format", "S8"),  # e.g. "rgb" or "yuv420", empty for channels that are not images.
+    ("offset", np.uint64),  # Offset of the first slot.
+    ("slot_size", np.uint64),  # Distance between two slots, a multiple of the page size.
+], align=True)
+
+READER_DTYPE = np.dtype([
+    ("pin", PIN_DTYPE),  # The pinned slot plus one, 0 if none.
+    ("pid", np.int64),  # 0 if the entry is free.
+    ("name", "S32"),
+    ("target_fps", np.float64),  # 0 to receive every frame.
+    ("attached_at", np.float64),
+    ("cursor", FRAME_NUMBER_DTYPE),  # The number of the last frame that was delivered to the reader.
+    ("last_timestamp", TIMESTAMP_DTYPE),  # The timestamp of that frame.
+    ("delivered", np.uint64),  # Frames that the reader has consumed.
+    ("skipped", np.uint64),  # Frames that the reader left out on purpose, to stay at its target rate.
+    ("overwritten", np.uint64),  # Frames that were overwritten before the reader got to them.
+], align=True)
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", np.uint32),
+    ("num_slots", np.uint32),
+    ("num_channels", np.uint32),
+    ("fps", np.float64),
+    ("intrinsics", np.float64, (3, 3)),
+    ("head", HEAD_DTYPE, (2,)),
+    ("readers", READER_DTYPE, (MAX_READERS,)),
+    ("sequences", SEQUENCE_DTYPE, (MAX_SLOTS,)),
+    ("timestamps", TIMESTAMP_DTYPE, (MAX_SLOTS,)),
+    ("frame_numbers", FRAME_NUMBER_DTYPE, (MAX_SLOTS,)),
+    ("channels", CHANNEL_DTYPE, (MAX_CHANNELS,)),
+], align=True)
+
+
+@dataclass
+class _ReaderLockFile:
+    fd: int
+    # The entries that are claimed by this process.
+    claimed: Set[int] = field(default_factory=set)
+
+
+# POSIX locks belong to the process, not to the file descriptor: they do not conflict within a process, and closing any
+# descriptor of the lock file releases all of them. So a process opens the lock file of a segment once, for all its
+# readers, tracks the entries they claimed, and only closes it when the last one is released.
+_reader_lock_files: Dict[str, _ReaderLockFile] = {}
+
+
+def segment_name(namespace: str) -> str:
+    """The name of the segment of the camera that is published under namespace."""
+    return f"{namespace}_segment"
+
+
+def _round_up_to_page(size: int) -> int:
+    return (size + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+
+def _reader_lock_filename(segment_name: str) -> str:
+    return os.path.join(tempfile.gettempdir(), f"rgb_recorder_{segment_name}.readers")
+
+
+class CameraSegment:
+    """The shared memory segment of one camera. Use create() in the publisher and attach() in the receivers."""
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.reader_index: Optional[int] = None
+        self.header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)
+        if bytes(self.header["magic"][0]) != SEGMENT_MAGIC:
+            raise ValueError(f"Shared memory block {shm.name} is not a camera segment.")
+        if int(self.header["version"][0]) != LAYOUT_VERSION:
+            raise ValueError(f"Shared memory block {shm.name} has layout version {int(self.header['version'][0])}, "
+                             f"but version {LAYOUT_VERSION} is expected. Are publisher and receiver up to date?")
+
+        self.num_slots = int(self.header["num_slots"][0])
+        self.fps = float(self.header["fps"][0])
+        self.intrinsics = self.header["intrinsics"][0]
+
+        self.channels: Dict[str, np.ndarray] = {}
+        self.pixel_formats: Dict[str, str] = {}
+        for channel in self.header["channels"][0][:int(self.header["num_channels"][0])]:
+            dtype = np.dtype(channel["dtype"].decode())
+            shape = tuple(int(x) for x in channel["shape"][:channel["ndim"]])
+            self.pixel_formats[channel["name"].decode()] = channel["pixel_format"].decode()
+            frame_strides = tuple(dtype.itemsize * int(np.prod(shape[i + 1:])) for i in range(len(shape)))
+            self.channels[channel["name"].decode()] = np.ndarray(
+                (self.num_slots, *shape), dtype=dtype, buffer=shm.buf, offset=int(channel["offset"]),
+                strides=(int(channel["slot_size"]), *frame_strides))
+
+        self.frame_ring = FrameRing(self.header["head"][0], self.header["sequences"][0][:self.num_slots],
+                                    self.header["timestamps"][0][:self.num_slots], self.channels,
+                                    self.readers["pin"], self.header["frame_numbers"][0][:self.num_slots])
+
+    @property
+    def readers(self) -> np.ndarray:
+        """The reader table (READER_DTYPE). Entries with pid 0 are free."""
+        return self.header["readers"][0]
+
+
+    @classmethod
+    def create(cls, name: str, channels: Dict[str, Tuple[Tuple[int, ...], np.dtype]], num_slots: int, fps: float,
+               intrinsics: np.ndarray, pixel_formats: Optional[Dict[str, str]] = None) -> "CameraSegment":
+        """Create a new segment.
+
+        Args:
+            name: The name of the shared memory block.
+            channels: The shape and dtype of a single frame of every channel,
+                e.g. {"rgb_left": ((720, 1280, 3), np.uint8)}.
+            num_slots: The number of frames in the ring buffer.
+            fps: The fps of the camera.
+            intrinsics: The 3x3 intrinsics matrix of the camera.
+            pixel_formats: The pixel format of the image channels, e.g. {"rgb_left": "bgr"}.
+        """
+        if not 0 < num_slots <= MAX_SLOTS:
+            raise ValueError(f"The number of slots must be between 1 and {MAX_SLOTS}, got {num_slots}.")
+        if len(channels) > MAX_CHANNELS:
+            raise ValueError(f"A segment can hold at most {MAX_CHANNELS} channels, got {len(channels)}.")
+
+        header = np.zeros((1,), dtype=HEADER_DTYPE)
+        header["magic"] = SEGMENT_MAGIC
+        header["version"] = LAYOUT_VERSION
+        header["num_slots"] = num_slots
+        header["num_channels"] = len(channels)
+        header["fps"] = fps
+        header["intrinsics"] = intrinsics
+
+        offset = _round_up_to_page(HEADER_DTYPE.itemsize)
+        for i, (channel_name, (shape, dtype)) in enumerate(channels.items()):
+            dtype = np.dtype(dtype)
+            if len(shape) > MAX_DIMENSIONS:
+                raise ValueError(f"Channel {channel_name} has more than {MAX_DIMENSIONS} dimensions.")
+            slot_size = _round_up_to_page(int(np.prod(shape)) * dtype.itemsize)
+            channel = header["channels"][0][i]
+            channel["name"] = channel_name.encode()
+            channel["dtype"] = dtype.str.encode()
+            channel["ndim"] = len(shape)
+            channel["shape"][:len(shape)] = shape
+            channel["pixel_format"] = (pixel_formats or {}).get(channel_name, "").encode()
+            channel["offset"] = offset
+            channel["slot_size"] = slot_size
+            offset += num_slots * slot_size
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=offset)
+        np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)[:] = header
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> "CameraSegment":
+        shm = shared_memory.SharedMemory(name=name)
+        # Normally, we wouldn't have to do this unregistering. However, without it, the resource tracker incorrectly
+        # destroys access to the shared memory block when the process is terminated: https://bugs.python.org/issue39959
+        # We also ignore mypy telling us to use .name instead of ._name, because the latter is used in the registration.
+        resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+        return cls(shm)
+
+    def claim_reader(self, name: str, target_fps: float = 0.0) -> Optional[int]:
+        """Claim an entry of the reader table for this reader. This is needed to borrow frames without the writer
+        overwriting them and to publish subscription statistics. The entries of readers that crashed are cleared on the
+        way, so that their pins do not hold on to slots of the ring buffer.
+
+        Returns:
+            The index of the entry, or None if this is not supported on this platform or all entries are taken.
+        """
+        if self.reader_index is not None or fcntl is None:
+            return self.reader_index
+        lock_file = _reader_lock_files.get(self.shm.name)
+        if lock_file is None:
+            lock_file = _ReaderLockFile(os.open(_reader_lock_filename(self.shm.name), os.O_RDWR | os.O_CREAT, 0o666))
+            _reader_lock_files[self.shm.name] = lock_file
+        for index in range(MAX_READERS):
+            if index in lock_file.claimed:
+                continue
+            if self.reader_index is not None and self.readers["pid"][index] == 0 and self.readers["pin"][index] == 0:
+                continue  # A free entry, which does not need to be cleared.
+            try:
+                fcntl.lockf(lock_file.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, index)
+            except OSError:
+                continue  # Claimed by another process.
+            if self.reader_index is None:
+                lock_file.claimed.add(index)
+                self.reader_index = index
+                # Overwrite the entry of a reader that crashed, if any.
+                entry = np.zeros((), dtype=READER_DTYPE)
+                entry["name"] = name.encode()[:READER_DTYPE["name"].itemsize]
+                entry["target_fps"] = target_fps
+                entry["attached_at"] = time.time()
+                entry["pid"] = os.getpid()
+                self.readers[index] = entry
+            else:
+                # The reader of this entry crashed: release its pin, so that the writer can use the slot again. Its
+                # statistics are kept for the monitor.
+                self.readers["pin"][index] = 0
+                self.readers["pid"][index] = 0
+                fcntl.lockf(lock_file.fd, fcntl.LOCK_UN, 1, index)
+        if self.reader_index is None:
+            self._close_reader_lock_file()
+        return self.reader_index
+
+    def release_reader(self) -> None:
+        if self.reader_index is None:
+            return
+        self.readers["pin"][self.reader_index] = 0
+        self.readers["pid"][self.reader_index] = 0
+        lock_file = _reader_lock_files[self.shm.name]
+        fcntl.lockf(lock_file.fd, fcntl.LOCK_UN, 1, self.reader_index)
+        lock_file.claimed.discard(self.reader_index)
+        self.reader_index = None
+        self._close_reader_lock_file()
+
+    def _close_reader_lock_file(self) -> None:
+        """Close the lock file of this segment once no reader of this process has claimed an entry, as closing it
+        releases the locks of all of them."""
+        lock_file = _reader_lock_files.get(self.shm.name)
+        if lock_file is not None and not lock_file.claimed:
+            os.close(lock_file.fd)
+            del _reader_lock_files[self.shm.name]
+
+    def close(self) -> None:
+        self.release_reader()
+        # The numpy views must be released before the buffer of the shared memory block can be closed.
+        self.header = None
+        self.intrinsics = None
+        self.channels = {}
+        self.frame_ring = None
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+        if os.path.isfile(_reader_lock_filename(self.shm.name)):
+            os.remove(_reader_lock_filename(self.shm.name))
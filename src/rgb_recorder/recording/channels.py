@@ -0,0 +1,44 @@
+"""The channels that a ZedPublisher can publish, and their layout in shared memory. This module does not depend on the
+ZED SDK, so that it can also be used on hosts that only receive frames over the network."""
+import enum
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from rgb_recorder.recording.pixel_formats import PixelFormat, image_shape
+
+
+class ZedChannel(str, enum.Enum):
+    """The value is the name of the channel in the shared memory segment."""
+    RGB_LEFT = "rgb_left"  # uint8 image of the left view, RGB unless the publisher uses another PixelFormat.
+    RGB_RIGHT = "rgb_right"  # uint8 image of the right view, idem.
+    DEPTH = "depth"  # float32 depth in the unit of the camera (metres for the Zed class), in the left view.
+    DEPTH_MM = "depth_mm"  # uint16 depth in millimetres, 0 where depth is unknown.
+    CONFIDENCE = "confidence"  # float32 depth confidence, from 1 (most confident) to 100.
+    POINT_CLOUD = "point_cloud"  # float32 XYZ coordinates of every pixel, in the unit of the camera.
+
+
+DEFAULT_CHANNELS = (ZedChannel.RGB_LEFT, ZedChannel.RGB_RIGHT)
+DEPTH_CHANNELS = (ZedChannel.DEPTH, ZedChannel.DEPTH_MM, ZedChannel.CONFIDENCE, ZedChannel.POINT_CLOUD)
+# The channels that are images in a PixelFormat.
+VIEW_CHANNELS = (ZedChannel.RGB_LEFT, ZedChannel.RGB_RIGHT)
+
+# The number of values per pixel and the dtype of every channel in shared memory. For the views, this is the layout in
+# RGB: see channel_shape() for the other pixel formats.
+CHANNEL_LAYOUTS = {ZedChannel.RGB_LEFT: (3, np.uint8), ZedChannel.RGB_RIGHT: (3, np.uint8),
+                   ZedChannel.DEPTH: (1, np.float32), ZedChannel.DEPTH_MM: (1, np.uint16),
+                   ZedChannel.CONFIDENCE: (1, np.float32), ZedChannel.POINT_CLOUD: (3, np.float32)}
+
+
+def requires_depth(channels: Sequence[ZedChannel]) -> bool:
+    """Whether the camera must compute depth to publish these channels."""
+    return any(channel in DEPTH_CHANNELS for channel in channels)
+
+
+def channel_shape(channel: ZedChannel, width: int, height: int,
+                  pixel_format: PixelFormat = PixelFormat.RGB) -> Tuple[int, ...]:
+    """The shape of a frame of the channel. The pixel format only applies to the VIEW_CHANNELS."""
+    if channel in VIEW_CHANNELS:
+        return image_shape(pixel_format, width, height)
+    num_values, _ = CHANNEL_LAYOUTS[channel]
+    return (height, width, num_values) if num_values > 1 else (height, width)
@@ -1,7 +1,10 @@
 import argparse
 import multiprocessing
 
+from rgb_recorder.recording.encoders import EncoderBackend, EncoderSettings
+from rgb_recorder.recording.pixel_formats import PixelFormat
 from rgb_recorder.recording.record import record_videos
+from rgb_recorder.recording.simulated_cameras import ReplayCamera, SyntheticCamera
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -12,6 +15,29 @@ if __name__ == "__main__":
     parser.add_argument("--resolution",
                         help="Supported resolutions: [(2208, 1242), (1920, 1080), (1280, 720), (672, 376)]", nargs=2,
                         type=int, default=[2208, 1242])
+    parser.add_argument("--camera", choices=["zed", "synthetic", "replay"], default="zed",
+                        help="Record synthetic frames or replay videos instead of Zed cameras.")
+    parser.add_argument("--replay", nargs="+", type=str, metavar="PATH",
+                        help="With --camera replay: the video, image directory or glob pattern of the left view, "
+                             "optionally followed by that of the right view.")
+    parser.add_argument("--variable-frame-rate", action="store_true",
+                        help="Do not repeat frames to fill gaps. The frame times are in the .idx file of each video; "
+                             "use rgb_recorder.recording.postprocess to fill the gaps afterwards.")
+    parser.add_argument("--raw", action="store_true",
+                        help="Record raw frames without encoding. Encode them afterwards with "
+                             "rgb_recorder.recording.transcode.")
+    parser.add_argument("--ffmpeg", action="store_true", help="Encode with FFmpeg (H.264) instead of OpenCV.")
+    parser.add_argument("--adaptive-quality", action="store_true",
+                        help="With --ffmpeg: switch to faster presets at a lower quality when the recorders cannot "
+                             "keep up, instead of missing frames. See rgb_recorder.recording.quality_control.")
+    parser.add_argument("--raw-spill", action="store_true",
+                        help="With --adaptive-quality: when the recorders cannot keep up at the lowest quality, spill "
+                             "raw frames to disk (gigabytes per minute) and encode them afterwards with "
+                             "rgb_recorder.recording.transcode.")
+    parser.add_argument("--pixel-format", choices=[pixel_format.value for pixel_format in PixelFormat],
+                        default=PixelFormat.BGR.value,
+                        help="The pixel format of the views in shared memory. The default is what the video encoder "
+                             "takes, so the recorders do not convert frames.")
 
     args = parser.parse_args()
 
@@ -19,4 +45,17 @@ if __name__ == "__main__":
 
     resolution = tuple(args.resolution)
 
-    record_videos(args.serial_numbers, args.output_dir, args.fps, resolution)
+    camera_cls, camera_kwargs = None, None
+    if args.camera == "synthetic":
+        camera_cls = SyntheticCamera
+    elif args.camera == "replay":
+        if not args.replay:
+            parser.error("--camera replay requires --replay.")
+        camera_cls = ReplayCamera
+        camera_kwargs = dict(left_path=args.replay[0], right_path=args.replay[1] if len(args.replay) > 1 else None)
+
+    record_videos(args.serial_numbers, args.output_dir, args.fps, resolution, camera_cls, camera_kwargs,
+                  fill_missing_frames=not args.variable_frame_rate, raw=args.raw,
+                  pixel_format=PixelFormat(args.pixel_format), adaptive_quality=args.adaptive_quality,
+                  encoder_settings=EncoderSettings(EncoderBackend.FFMPEG) if args.ffmpeg else None,
+                  raw_spill=args.raw_spill)
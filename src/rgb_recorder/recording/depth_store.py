@@ -0,0 +1,137 @@
+"""On-disk stores for metric depth frames (uint16, millimetres) with per-frame random access.
+
+Two formats are supported, chosen by the extension of the path:
+* .npy: a memory-mappable numpy array of shape (frames, height, width). Uncompressed, but it needs no extra packages
+  and frames can be read without copying the file.
+* .zarr: a zarr array with one compressed chunk per frame. This requires the optional zarr package.
+
+Use open_depth_store() to read either format: the result can be indexed per frame, e.g. open_depth_store(path)[42].
+"""
+import os
+from typing import Tuple, Union
+
+import numpy as np
+
+DEPTH_DTYPE = np.uint16
+
+
+def _import_zarr():
+    try:
+        import zarr
+    except ImportError as e:
+        raise ImportError("Storing depth in .zarr format requires the zarr package: pip install zarr") from e
+    return zarr
+
+
+class NpyFrameWriter:
+    """Writes frames of a fixed shape and dtype to a memory-mapped .npy file. The file is preallocated for max_frames
+    frames and truncated to the number of frames that were actually written when it is released."""
+
+    def __init__(self, output_file: str, max_frames: int, frame_shape: Tuple[int, ...], dtype: np.dtype,
+                 allocate: bool = False):
+        """
+        Args:
+            allocate: Reserve the disk space of all frames up front, if the platform supports it. Otherwise, the file
+                is sparse and its blocks are allocated while frames are written.
+        """
+        self.output_file = output_file
+        self._array = np.lib.format.open_memmap(output_file, mode="w+", dtype=dtype,
+                                                shape=(max_frames, *frame_shape))
+        if allocate and hasattr(os, "posix_fallocate"):
+            with open(output_file, "r+b") as f:
+                os.posix_fallocate(f.fileno(), 0, self._array.offset + self._array.nbytes)
+        self.frames_written = 0
+        self.last_byte_offset = -1
+
+    @property
+    def full(self) -> bool:
+        return self.frames_written == len(self._array)
+
+    def next_frame(self) -> np.ndarray:
+        """A view of the next frame in the file, to write into directly. Call commit() when it has been written."""
+        return self._array[self.frames_written]
+
+    def commit(self) -> None:
+        self.last_byte_offset = self._array.offset + self.frames_written * self._array[0].nbytes
+        self.frames_written += 1
+
+    def write(self, frame: np.ndarray) -> None:
+        self._array[self.frames_written] = frame
+        self.commit()
+
+    def release(self) -> None:
+        if self._array is None:
+            return
+        max_frames, *frame_shape = self._array.shape
+        dtype = self._array.dtype
+        header_offset = self._array.offset
+        self._array.flush()
+        self._array = None
+
+        if self.frames_written < max_frames:
+            # numpy reserves room in the header for the number of frames to change, so the header can be rewritten in
+            # place and the data after the last written frame can be cut off.
+            header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+                      "shape": (self.frames_written, *frame_shape)}
+            with open(self.output_file, "r+b") as f:
+                np.lib.format.write_array_header_1_0(f, header)
+                if f.tell() != header_offset:
+                    raise IOError(f"Could not truncate {self.output_file}: header size changed.")
+                f.truncate(header_offset + self.frames_written * int(np.prod(frame_shape)) * dtype.itemsize)
+
+
+class NpyDepthWriter(NpyFrameWriter):
+    """Writes depth frames to a memory-mapped .npy file, see NpyFrameWriter."""
+
+    def __init__(self, output_file: str, max_frames: int, width: int, height: int):
+        super().__init__(output_file, max_frames, (height, width), DEPTH_DTYPE)
+
+
+class ZarrDepthWriter:
+    """Writes depth frames to a zarr array with one Zstandard-compressed chunk per frame."""
+
+    def __init__(self, output_file: str, max_frames: int, width: int, height: int):
+        zarr = _import_zarr()
+        from numcodecs import Blosc
+
+        self.output_file = output_file
+        self._array = zarr.open(output_file, mode="w-", shape=(max_frames, height, width), dtype=DEPTH_DTYPE,
+                                chunks=(1, height, width),
+                                compressor=Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE))
+        self._array.attrs["units"] = "mm"
+        self.frames_written = 0
+        # Chunks are compressed, so frames have no fixed offset.
+        self.last_byte_offset = -1
+
+    def write(self, frame: np.ndarray) -> None:
+        self._array[self.frames_written] = frame
+        self.frames_written += 1
+
+    def release(self) -> None:
+        if self._array is None:
+            return
+        _, height, width = self._array.shape
+        self._array.resize(self.frames_written, height, width)
+        self._array = None
+
+
+def create_depth_writer(output_file: str, max_frames: int, width: int,
+                        height: int) -> Union[NpyDepthWriter, ZarrDepthWriter]:
+    _, ext = os.path.splitext(output_file)
+    if ext == ".npy":
+        return NpyDepthWriter(output_file, max_frames, width, height)
+    elif ext == ".zarr":
+        return ZarrDepthWriter(output_file, max_frames, width, height)
+    else:
+        raise ValueError(f"Unsupported depth store format: {output_file}. Use .npy or .zarr.")
+
+
+def open_depth_store(path: str):
+    """Open a depth store for reading. Frames are only read from disk when they are indexed."""
+    _, ext = os.path.splitext(path)
+    if ext == ".npy":
+        return np.load(path, mmap_mode="r")
+    elif ext == ".zarr":
+        return _import_zarr().open(path, mode="r")
+    else:
+        raise ValueError(f"Unsupported depth store format: {path}. Use .npy or .zarr.")
@@ -0,0 +1,128 @@
+"""Video encoder backends. All encoders take BGR uint8 frames, like cv2.VideoWriter. The FFmpeg backend also takes the
+other pixel formats of pixel_formats.py, without converting them first.
+
+The OpenCV backend is the default and needs nothing besides OpenCV. The FFmpeg backend pipes raw frames to an ffmpeg
+process, which must be available on the PATH, and exposes the codec, preset, CRF and thread count of the encoder.
+"""
+import enum
+import shutil
+import subprocess
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from rgb_recorder.recording.pixel_formats import FFMPEG_PIXEL_FORMATS, PixelFormat
+
+
+class EncoderBackend(enum.Enum):
+    OPENCV = 0
+    FFMPEG = 1
+
+
+@dataclass
+class EncoderSettings:
+    """Settings of a video encoder. fourcc is only used by the OpenCV backend, the other settings only by FFmpeg."""
+    backend: EncoderBackend = EncoderBackend.OPENCV
+    fourcc: str = "M4S2"  # MPEG-4 part 2.
+    codec: str = "libx264"
+    preset: str = "veryfast"
+    crf: int = 23
+    threads: int = 0  # 0 lets FFmpeg decide.
+    pixel_format: str = "yuv420p"
+
+
+class VideoEncoder(ABC):
+    # The byte offset of the last written frame in the output file, or -1 if it is not known.
+    last_byte_offset: int = -1
+
+    @abstractmethod
+    def write(self, frame: np.ndarray) -> None:
+        """Encode a uint8 frame in the input pixel format of the encoder, BGR of shape (height, width, 3) by default."""
+
+    @abstractmethod
+    def release(self) -> None:
+        """Finish encoding and close the output file."""
+
+
+class OpenCVEncoder(VideoEncoder):
+    def __init__(self, output_file: str, fps: float, width: int, height: int, fourcc: str = "M4S2"):
+        self._video_writer = cv2.VideoWriter(output_file, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+        if not self._video_writer.isOpened():
+            raise IOError("Could not open video writer for file: " + output_file)
+
+    def write(self, frame: np.ndarray) -> None:
+        self._video_writer.write(frame)
+
+    def release(self) -> None:
+        self._video_writer.release()
+
+
+class FFmpegEncoder(VideoEncoder):
+    def __init__(self, output_file: str, fps: float, width: int, height: int, codec: str = "libx264",
+                 preset: str = "veryfast", crf: int = 23, threads: int = 0, pixel_format: str = "yuv420p",
+                 input_pixel_format: PixelFormat = PixelFormat.BGR):
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise IOError("FFmpeg was not found on the PATH.")
+
+        self.output_file = output_file
+        command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-n",
+                   "-f", "rawvideo", "-pix_fmt", FFMPEG_PIXEL_FORMATS[input_pixel_format], "-s", f"{width}x{height}",
+                   "-r", str(fps), "-i", "-",
+                   "-c:v", codec, "-preset", preset, "-crf", str(crf), "-threads", str(threads),
+                   "-pix_fmt", pixel_format, output_file]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray) -> None:
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            # FFmpeg exited before it got all frames, so the video is incomplete, whatever its exit code.
+            stderr = self._stop()
+            raise IOError(f"FFmpeg exited with code {self._process.returncode} while encoding {self.output_file}: "
+                          f"{stderr}")
+
+    def release(self) -> None:
+        if self._process.stdin.closed:
+            return
+        stderr = self._stop()
+        if self._process.returncode != 0:
+            raise IOError(f"FFmpeg could not encode {self.output_file}: {stderr}")
+
+    def _stop(self, max_stderr_lines: int = 20) -> str:
+        """Close the input of FFmpeg, wait for it to exit and return the tail of its error output."""
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass  # Flushing the remaining input fails if FFmpeg already exited.
+        stderr = self._process.stderr.read()
+        self._process.wait()
+        return "\n".join(stderr.decode(errors="replace").strip().splitlines()[-max_stderr_lines:])
+
+
+def encoder_input_format(pixel_format: PixelFormat, settings: Optional[EncoderSettings] = None) -> PixelFormat:
+    """The pixel format in which to pass frames that are in pixel_format to an encoder: the same format if the encoder
+    takes it, BGR otherwise."""
+    if settings is not None and settings.backend == EncoderBackend.FFMPEG:
+        return pixel_format
+    return PixelFormat.BGR
+
+
+def create_encoder(output_file: str, fps: float, width: int, height: int,
+                   settings: Optional[EncoderSettings] = None,
+                   input_pixel_format: PixelFormat = PixelFormat.BGR) -> VideoEncoder:
+    if settings is None:
+        settings = EncoderSettings()
+
+    if settings.backend == EncoderBackend.OPENCV:
+        if input_pixel_format != PixelFormat.BGR:
+            raise ValueError(f"The OpenCV encoder only takes BGR frames, not {input_pixel_format.value}.")
+        return OpenCVEncoder(output_file, fps, width, height, settings.fourcc)
+    elif settings.backend == EncoderBackend.FFMPEG:
+        return FFmpegEncoder(output_file, fps, width, height, settings.codec, settings.preset, settings.crf,
+                             settings.threads, settings.pixel_format, input_pixel_format)
+    else:
+        raise ValueError(f"Unsupported encoder backend: {settings.backend}")
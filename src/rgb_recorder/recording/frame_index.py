@@ -0,0 +1,90 @@
+"""Per-frame index files, written next to every recorded or exported output as <output>.idx.
+
+An index file is a short header followed by one fixed-size little-endian record per frame:
+* frame: the frame number in the output.
+* timestamp_ns: the capture timestamp of the camera, in nanoseconds.
+* svo_position: the position of the frame in the SVO file it was recorded to or exported from.
+* byte_offset: the offset of the frame in the output file, or -1 when it is not known (e.g., for encoded videos).
+
+Timestamps are monotonically increasing, so a frame can be looked up by timestamp with a binary search.
+"""
+import os
+from typing import BinaryIO, List, Optional
+
+import numpy as np
+
+INDEX_MAGIC = b"RGBIDX01"
+INDEX_DTYPE = np.dtype([("frame", "<i8"), ("timestamp_ns", "<i8"), ("svo_position", "<i8"), ("byte_offset", "<i8")])
+
+
+def index_filename(output_file: str) -> str:
+    return output_file.rstrip("/\\") + ".idx"
+
+
+class FrameIndexWriter:
+    def __init__(self, index_file: str):
+        self.index_file = index_file
+        self._file: Optional[BinaryIO] = open(index_file, "wb")
+        self._file.write(INDEX_MAGIC)
+        self._record = np.zeros(1, dtype=INDEX_DTYPE)
+        self.frames_written = 0
+
+    def append(self, timestamp_ns: int, svo_position: int = -1, byte_offset: int = -1) -> None:
+        self._record[0] = (self.frames_written, timestamp_ns, svo_position, byte_offset)
+        self._file.write(self._record.tobytes())
+        self.frames_written += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class FrameIndex:
+    """Read-only access to an index file. The records are memory-mapped, not read into memory."""
+
+    def __init__(self, index_file: str):
+        with open(index_file, "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise IOError(f"Not a frame index file: {index_file}")
+        n_records = (os.path.getsize(index_file) - len(INDEX_MAGIC)) // INDEX_DTYPE.itemsize
+        if n_records > 0:
+            self.records = np.memmap(index_file, dtype=INDEX_DTYPE, mode="r", offset=len(INDEX_MAGIC),
+                                     shape=(n_records,))
+        else:
+            self.records = np.zeros(0, dtype=INDEX_DTYPE)
+
+    @classmethod
+    def for_output(cls, output_file: str) -> "FrameIndex":
+        return cls(index_filename(output_file))
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, frame: int) -> np.void:
+        return self.records[frame]
+
+    @property
+    def timestamps_ns(self) -> np.ndarray:
+        return self.records["timestamp_ns"]
+
+    def find_frame(self, timestamp_ns: int) -> int:
+        """Return the frame whose timestamp is closest to timestamp_ns, in O(log n)."""
+        if len(self) == 0:
+            raise IndexError("The frame index is empty.")
+        timestamps = self.timestamps_ns
+        i = int(np.searchsorted(timestamps, timestamp_ns))
+        if i == 0:
+            return 0
+        if i == len(timestamps):
+            return len(timestamps) - 1
+        return i if timestamps[i] - timestamp_ns < timestamp_ns - timestamps[i - 1] else i - 1
+
+
+def concatenate_indexes(index_files: List[str], output_index_file: str) -> None:
+    """Join the indexes of consecutive segments into the index of the concatenated output, renumbering the frames."""
+    writer = FrameIndexWriter(output_index_file)
+    for index_file in index_files:
+        for record in FrameIndex(index_file).records:
+            writer.append(int(record["timestamp_ns"]), int(record["svo_position"]), -1)
+    writer.close()
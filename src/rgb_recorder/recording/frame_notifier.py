@@ -0,0 +1,144 @@
+"""Cross-process notification of new frames, so that receivers can block until a frame is published instead of polling
+the ring buffer in a sleep loop.
+
+Every subscriber creates a named pipe (FIFO) in a directory that belongs to the shared memory segment of the camera.
+After publishing a frame, the publisher writes a single byte to every pipe in that directory, which wakes up the
+subscribers that are waiting in select(). The publisher never blocks: if a pipe is full, the subscriber has not
+consumed its previous notifications yet and already knows that there are new frames.
+
+Named pipes are not available on Windows. There, FrameSubscription.wait() falls back to polling.
+"""
+import errno
+import os
+import select
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+NOTIFICATIONS_SUPPORTED = hasattr(os, "mkfifo")
+# Sleep time between two checks when notifications are not supported.
+_POLL_INTERVAL = 0.0001
+# The longest that FrameSubscription.wait() blocks, so that a lost notification only delays a receiver, which then
+# checks the ring buffer itself.
+MAX_WAIT = 0.1
+# The longest time between two listings of the subscribers, even if the directory seems unchanged: the modification
+# time may have too coarse a granularity to show a subscriber that came right after the previous listing.
+_RESCAN_INTERVAL = 1.0
+
+
+def notification_dir(segment_name: str) -> str:
+    return os.path.join(tempfile.gettempdir(), f"rgb_recorder_{segment_name}")
+
+
+class FrameNotifier:
+    """The publisher side: notifies every subscriber of the segment after a frame was published."""
+
+    def __init__(self, segment_name: str):
+        self.directory = notification_dir(segment_name)
+        self._pipes: Dict[str, int] = {}  # Filename -> file descriptor.
+        # Pipes that could not be opened yet, because their subscriber had created but not yet opened them.
+        self._pending: Set[str] = set()
+        self._directory_mtime = -1
+        self._last_scan = 0.0
+        if NOTIFICATIONS_SUPPORTED:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _update_subscribers(self) -> None:
+        # Subscribers add and remove pipes, which changes the modification time of the directory, so the directory is
+        # only listed when a subscriber came or went, or when the previous listing is getting old.
+        now = time.monotonic()
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime != self._directory_mtime or now - self._last_scan >= _RESCAN_INTERVAL:
+            self._directory_mtime = mtime
+            self._last_scan = now
+            filenames = set(os.listdir(self.directory))
+            for filename in set(self._pipes) - filenames:
+                os.close(self._pipes.pop(filename))
+            self._pending = (self._pending & filenames) | (filenames - set(self._pipes))
+        # Pending pipes are retried on every notification, whatever the modification time.
+        for filename in list(self._pending):
+            try:
+                self._pipes[filename] = os.open(os.path.join(self.directory, filename), os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    self._pending.discard(filename)  # The subscriber has gone away.
+                elif e.errno != errno.ENXIO:
+                    raise
+                # ENXIO: the subscriber has not opened its pipe yet, or has closed it but not removed it yet.
+                continue
+            self._pending.discard(filename)
+
+    def notify(self) -> None:
+        if not NOTIFICATIONS_SUPPORTED:
+            return
+        self._update_subscribers()
+        for filename, fd in list(self._pipes.items()):
+            try:
+                os.write(fd, b"\0")
+            except BlockingIOError:
+                pass  # The pipe is full: the subscriber has not even seen the previous notifications yet.
+            except BrokenPipeError:
+                logger.debug(f"Subscriber {filename} of {self.directory} has gone away.")
+                os.close(self._pipes.pop(filename))
+
+    def close(self) -> None:
+        for fd in self._pipes.values():
+            os.close(fd)
+        self._pipes = {}
+        self._pending = set()
+        if NOTIFICATIONS_SUPPORTED:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class FrameSubscription:
+    """The receiver side: a pipe that receives a notification for every published frame."""
+
+    def __init__(self, segment_name: str):
+        self.path: Optional[str] = None
+        self._fd = -1
+        if not NOTIFICATIONS_SUPPORTED:
+            return
+        directory = notification_dir(segment_name)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{os.getpid()}_{uuid.uuid4().hex}")
+        os.mkfifo(self.path)
+        # Opened for reading and writing, so that the pipe does not report end-of-file when the publisher closes it.
+        self._fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the publisher has published a frame since the previous call, or until the timeout (in seconds)
+        expires, but never longer than MAX_WAIT: a notification can be lost, e.g. for a subscriber that the publisher
+        has not found yet, so callers must check the ring buffer themselves after a False.
+
+        Returns:
+            Whether a notification was received. Without notification support, this sleeps briefly and returns True, so
+            the caller must still check whether a new frame was actually published.
+        """
+        if self._fd < 0:
+            time.sleep(_POLL_INTERVAL if timeout is None else min(timeout, _POLL_INTERVAL))
+            return True
+        readable, _, _ = select.select([self._fd], [], [], MAX_WAIT if timeout is None else min(timeout, MAX_WAIT))
+        if not readable:
+            return False
+        # Consume all pending notifications: the caller only needs to know that there is at least one new frame.
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass  # The publisher has removed the directory already.
+            self.path = None
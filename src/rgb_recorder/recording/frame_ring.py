@@ -0,0 +1,209 @@
+"""A single-writer, many-reader ring buffer of frames in shared memory, synchronized with per-slot sequence counters
+(a seqlock), so that neither the writer nor the readers ever need a lock.
+
+The ring consists of numpy arrays that are backed by shared memory (the arrays themselves are created by the caller):
+* head: two uint64s, the number of frames that have been published and the slot of the latest frame.
+* sequences: one uint64 per slot. It is odd while the writer is writing the slot and even otherwise, and it is
+  incremented twice for every frame written to the slot.
+* timestamps: one float64 per slot.
+* optionally, frame_numbers: one uint64 per slot, the number of the frame in the slot (counting from 1), so that
+  readers can tell how many frames they missed.
+* one array of shape (N, ...) per channel, e.g. the left and right images.
+* optionally, pins: one int64 per reader that may borrow frames, the slot that the reader is using plus one (0 for
+  none). Every entry is only written by the reader that owns it.
+
+The writer never waits: it writes to the first slot after the latest frame that is not pinned by a reader (or, if all
+other slots are pinned, to the slot after the latest frame anyway). A reader copies the latest frame and then checks
+that the sequence number of its slot is even and has not changed since it started copying. Otherwise, the writer has
+written to the slot in the meantime (which can only happen if the reader is more than N - 1 frames slow) and the reader
+retries, so a reader always gets an image and timestamp that belong together.
+
+Instead of copying, a reader can also borrow the latest frame: it pins the slot, uses views into shared memory and
+unpins the slot when it is done. The writer skips pinned slots, so borrowed views stay intact as long as fewer than
+N - 1 slots are pinned. Pinning is a handshake: the reader stores its pin before it checks that the slot is still the
+latest and not being written, and the writer claims a slot (makes its sequence odd) before it checks that the slot is
+not pinned, backing out if it is. A memory barrier between the store and the check on both sides guarantees that at
+least one of them sees the other. BorrowedFrame.intact tells whether the views stayed intact, and must be checked after
+using them: without pins (e.g. on Windows), or when too many slots are pinned, the writer may overwrite them.
+
+This relies on the stores of the writer becoming visible to readers in program order, which is the case on x86-64.
+"""
+import threading
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+HEAD_DTYPE = np.uint64
+SEQUENCE_DTYPE = np.uint64
+TIMESTAMP_DTYPE = np.float64
+PIN_DTYPE = np.int64
+FRAME_NUMBER_DTYPE = np.uint64
+
+
+class TornReadError(RuntimeError):
+    pass
+
+
+_fence_lock = threading.Lock()
+
+
+def _memory_fence() -> None:
+    """A full memory barrier: stores before it are visible to other processes before loads after it are performed.
+    Python has no such primitive, but acquiring a lock uses an atomic read-modify-write, which is a full barrier on
+    x86-64."""
+    with _fence_lock:
+        pass
+
+
+class BorrowedFrame:
+    """Read-only views of the channels of a pinned slot. Only valid until the pin is released."""
+
+    def __init__(self, ring: "FrameRing", slot: int, sequence: int, timestamp: float, frame_number: int,
+                 names: Iterable[str]):
+        self._ring = ring
+        self.slot = slot
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.frame_number = frame_number
+        self.channels: Dict[str, np.ndarray] = {}
+        for name in names:
+            view = ring.channels[name][slot].view()
+            view.flags.writeable = False
+            self.channels[name] = view
+
+    @property
+    def intact(self) -> bool:
+        """Whether the writer has left the slot alone so far. Check this after using the views."""
+        return int(self._ring.sequences[self.slot]) == self.sequence
+
+
+class FrameRing:
+    def __init__(self, head: np.ndarray, sequences: np.ndarray, timestamps: np.ndarray,
+                 channels: Dict[str, np.ndarray], pins: Optional[np.ndarray] = None,
+                 frame_numbers: Optional[np.ndarray] = None):
+        self.head = head
+        self.sequences = sequences
+        self.timestamps = timestamps
+        self.channels = channels
+        self.pins = pins
+        self.frame_numbers = frame_numbers
+        self.num_slots = len(sequences)
+        # The number of the frame that was last copied by read_latest(), or 0 if frame numbers are not tracked.
+        self.last_read_frame_number = 0
+
+    @property
+    def frames_published(self) -> int:
+        return int(self.head[0])
+
+    def latest_slot(self) -> Optional[int]:
+        if self.frames_published == 0:
+            return None
+        return int(self.head[1])
+
+    def _frame_number(self, slot: int) -> int:
+        return int(self.frame_numbers[slot]) if self.frame_numbers is not None else 0
+
+    def latest_timestamp(self) -> float:
+        slot = self.latest_slot()
+        return float(self.timestamps[slot]) if slot is not None else 0.0
+
+    # Writer side.
+
+    def begin_write(self) -> int:
+        """Claim the next slot for writing and return its index. The caller writes the channels of that slot, e.g.
+        ring.channels["rgb_left"][slot][:] = image, and then calls end_write()."""
+        latest_slot = self.latest_slot()
+        first_slot = 0 if latest_slot is None else (latest_slot + 1) % self.num_slots
+        if self.pins is not None:
+            for i in range(self.num_slots - 1):
+                slot = (first_slot + i) % self.num_slots
+                if self._is_pinned(slot):
+                    continue
+                self.sequences[slot] += 1  # Odd: readers of this slot will retry.
+                _memory_fence()
+                # A reader that pinned the slot before it saw the claim is using it, see borrow_latest().
+                if not self._is_pinned(slot):
+                    return slot
+                self.sequences[slot] -= 1  # Back out, leaving the sequence as the reader saw it.
+        # All other slots are pinned: overwrite the slot after the latest frame anyway.
+        self.sequences[first_slot] += 1
+        return first_slot
+
+    def _is_pinned(self, slot: int) -> bool:
+        return bool(np.any(self.pins == slot + 1))
+
+    def end_write(self, slot: int, timestamp: float) -> None:
+        self.timestamps[slot] = timestamp
+        if self.frame_numbers is not None:
+            self.frame_numbers[slot] = self.frames_published + 1
+        self.sequences[slot] += 1  # Even again: the slot is consistent.
+        self.head[1] = slot  # Publish the slot as the latest frame.
+        self.head[0] += 1
+
+    def write(self, timestamp: float, frames: Dict[str, np.ndarray]) -> None:
+        slot = self.begin_write()
+        for name, frame in frames.items():
+            self.channels[name][slot][:] = frame
+        self.end_write(slot, timestamp)
+
+    # Reader side.
+
+    def read_latest(self, out: Dict[str, np.ndarray], max_retries: int = 100) -> Optional[float]:
+        """Copy the latest frame of every channel in out into the corresponding array of out.
+
+        Returns:
+            The timestamp of the copied frame, or None if nothing has been published yet.
+
+        Raises:
+            TornReadError: if no consistent frame could be read in max_retries attempts.
+        """
+        for _ in range(max_retries):
+            slot = self.latest_slot()
+            if slot is None:
+                return None
+            sequence = int(self.sequences[slot])
+            if sequence % 2 == 1:
+                continue  # The writer has wrapped around and is writing this slot right now.
+            for name, array in out.items():
+                array[:] = self.channels[name][slot]
+            timestamp = float(self.timestamps[slot])
+            frame_number = self._frame_number(slot)
+            if int(self.sequences[slot]) == sequence:
+                self.last_read_frame_number = frame_number
+                return timestamp
+        raise TornReadError(f"Could not read a consistent frame in {max_retries} attempts.")
+
+    def borrow_latest(self, pin_index: Optional[int], names: Iterable[str],
+                      max_retries: int = 100) -> Optional[BorrowedFrame]:
+        """Pin the slot of the latest frame and return views of the channels in names. Call release() when done, after
+        checking BorrowedFrame.intact.
+
+        Args:
+            pin_index: The entry of the pin table that belongs to this reader, or None to borrow without pinning (the
+                views are then only intact while the reader is less than N - 1 frames slow).
+
+        Returns:
+            The borrowed frame, or None if nothing has been published yet.
+
+        Raises:
+            TornReadError: if no slot could be pinned in max_retries attempts.
+        """
+        for _ in range(max_retries):
+            slot = self.latest_slot()
+            if slot is None:
+                return None
+            if pin_index is not None:
+                self.pins[pin_index] = slot + 1
+                # Make the pin visible to the writer before checking the slot, see begin_write().
+                _memory_fence()
+            sequence = int(self.sequences[slot])
+            # The writer may have claimed the slot, or published a newer frame, before it saw the pin.
+            if sequence % 2 == 0 and slot == self.latest_slot():
+                return BorrowedFrame(self, slot, sequence, float(self.timestamps[slot]), self._frame_number(slot),
+                                     names)
+        self.release(pin_index)
+        raise TornReadError(f"Could not pin a consistent frame in {max_retries} attempts.")
+
+    def release(self, pin_index: Optional[int]) -> None:
+        if pin_index is not None:
+            self.pins[pin_index] = 0
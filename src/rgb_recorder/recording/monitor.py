@@ -0,0 +1,82 @@
+"""Shows the subscriptions of running publishers: for every reader, its target rate, how far it lags behind the
+publisher, and how many frames were delivered, skipped on purpose, or overwritten before the reader got to them.
+
+python -m rgb_recorder.recording.monitor --serial-numbers 35357320 34670760 [--interval 1.0] [--once]
+"""
+import argparse
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from rgb_recorder.recording.camera_segment import CameraSegment, segment_name
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # The process exists, but belongs to another user.
+    return True
+
+
+def format_subscriptions(namespace: str, segment: CameraSegment, previous: Dict[str, np.ndarray],
+                         interval: float) -> List[str]:
+    """Describe the publisher and readers of a segment. previous holds the state of the previous call, to measure
+    rates, and is updated."""
+    frames_published = segment.frame_ring.frames_published
+    readers = segment.readers.copy()
+    lines = []
+
+    publisher_fps = ""
+    if "head" in previous:
+        publisher_fps = f", {(frames_published - int(previous['head'])) / interval:.1f} fps"
+    lines.append(f"{namespace}: {frames_published} frames published (camera {segment.fps:.0f} fps{publisher_fps})")
+
+    active = [index for index in range(len(readers)) if readers["pid"][index] != 0]
+    if not active:
+        lines.append("  no readers")
+    for index in active:
+        reader = readers[index]
+        name = reader["name"].decode()
+        target = f"{reader['target_fps']:.1f} fps" if reader["target_fps"] > 0 else "all frames"
+        rate = ""
+        if "readers" in previous and previous["readers"]["pid"][index] == reader["pid"]:
+            rate = f"{(int(reader['delivered']) - int(previous['readers']['delivered'][index])) / interval:.1f} fps, "
+        lag = frames_published - int(reader["cursor"]) if reader["cursor"] > 0 else 0
+        state = "" if _is_alive(int(reader["pid"])) else " (process has exited)"
+        lines.append(f"  {name} [pid {reader['pid']}]{state}: target {target}, {rate}lag {lag} frames, "
+                     f"delivered {reader['delivered']}, skipped {reader['skipped']}, "
+                     f"overwritten {reader['overwritten']}")
+
+    previous["head"] = np.array(frames_published)
+    previous["readers"] = readers
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serial-numbers", nargs='+', type=str, required=True,
+                        help="The shared memory namespaces of the publishers, i.e. the serial numbers of the cameras.")
+    parser.add_argument("--interval", type=float, default=1.0, help="Refresh interval in seconds.")
+    parser.add_argument("--once", action="store_true", help="Print the subscriptions once and exit.")
+    args = parser.parse_args()
+
+    segments = {namespace: CameraSegment.attach(segment_name(namespace)) for namespace in args.serial_numbers}
+    previous_states: Dict[str, Dict[str, np.ndarray]] = {namespace: {} for namespace in segments}
+    try:
+        while True:
+            for namespace, segment in segments.items():
+                print("\n".join(format_subscriptions(namespace, segment, previous_states[namespace], args.interval)))
+            if args.once:
+                break
+            print()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for segment in segments.values():
+            segment.close()
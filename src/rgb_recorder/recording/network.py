@@ -0,0 +1,535 @@
+"""Streams the frames of a publisher over TCP, so that they can be consumed on another host.
+
+On the capture host, a FrameStreamServer attaches to a publisher namespace like any other ZedReceiver and sends every
+frame to its clients. On the other host, a RemoteZedReceiver connects to the server and offers the same API as a
+ZedReceiver: wait_for_frame(), retrieve_channels(), borrow_frame(), pixel_format and the RGBCamera methods. Frames
+arrive over the network, so borrow_frame() cannot avoid decoding them, and there is no subscription for the monitor.
+
+Every client has a bounded queue of frames. When the network cannot keep up, the oldest queued frame is dropped, so
+that clients always receive recent frames instead of falling further and further behind. Frames can be compressed per
+channel (JPEG for 8-bit images, zlib for anything) and sent in batches of several frames.
+
+Protocol: the server first sends a handshake, a big-endian uint32 length followed by a JSON object that describes the
+camera (fps, intrinsics, the pixel format of the views) and every channel (shape, dtype, encoding). Then it sends
+batches: a BATCH_HEADER (magic and number of frames), and for every frame a FRAME_HEADER (frame number and timestamp)
+followed by, for every channel in handshake order, a uint32 length and the encoded channel.
+
+To serve a camera that is being recorded, run on the capture host:
+
+    python -m rgb_recorder.recording.network --serial-number 35357320 [--port 5600] [--compression jpeg]
+"""
+import argparse
+import collections
+import contextlib
+import enum
+import json
+import socket
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+from airo_camera_toolkit.interfaces import RGBCamera, StereoRGBDCamera
+from airo_camera_toolkit.utils.image_converter import ImageConverter
+from airo_typing import CameraIntrinsicsMatrixType, CameraResolutionType, NumpyFloatImageType, NumpyIntImageType
+from loguru import logger
+
+from rgb_recorder.recording.channels import VIEW_CHANNELS, ZedChannel
+from rgb_recorder.recording.pixel_formats import PixelFormat, convert, image_resolution
+
+_VIEW_CHANNELS = {StereoRGBDCamera.LEFT_RGB: ZedChannel.RGB_LEFT, StereoRGBDCamera.RIGHT_RGB: ZedChannel.RGB_RIGHT}
+
+DEFAULT_PORT = 5600
+PROTOCOL_VERSION = 1
+BATCH_MAGIC = b"RGBF"
+BATCH_HEADER = struct.Struct("!4sI")  # Magic, number of frames.
+FRAME_HEADER = struct.Struct("!Qd")  # Frame number, timestamp.
+LENGTH = struct.Struct("!I")
+
+
+class FrameCompression(str, enum.Enum):
+    NONE = "none"
+    JPEG = "jpeg"  # Lossy. Only used for uint8 images, other channels are compressed losslessly.
+    LOSSLESS = "lossless"  # zlib.
+
+
+def _channel_encoding(compression: FrameCompression, shape: Tuple[int, ...], dtype: np.dtype) -> str:
+    if compression == FrameCompression.JPEG:
+        return "jpeg" if dtype == np.uint8 and len(shape) == 3 and shape[2] == 3 else "zlib"
+    return "zlib" if compression == FrameCompression.LOSSLESS else "raw"
+
+
+def _encode(encoding: str, array: np.ndarray, jpeg_quality: int) -> bytes:
+    if encoding == "jpeg":
+        # JPEG does not care about the channel order, as long as the decoder uses the same one.
+        success, data = cv2.imencode(".jpg", array, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        if not success:
+            raise RuntimeError("Could not encode a frame as JPEG.")
+        return data.tobytes()
+    if encoding == "zlib":
+        return zlib.compress(array, level=1)  # Fast, and still effective on depth maps.
+    return array.tobytes()
+
+
+def _decode(encoding: str, data: bytes, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+    if encoding == "jpeg":
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if encoding == "zlib":
+        return np.frombuffer(zlib.decompress(data), dtype=dtype).reshape(shape)
+    # A read-only view of the received data, which belongs to the receiver.
+    image = np.frombuffer(data, dtype=dtype).reshape(shape)
+    image.setflags(write=False)
+    return image
+
+
+def _send_message(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(LENGTH.pack(len(payload)) + payload)
+
+
+def _receive_into(sock: socket.socket, buffer: Union[bytearray, memoryview]) -> None:
+    """Fill buffer with the next bytes of the connection."""
+    view = memoryview(buffer)
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("The connection was closed.")
+        received += n
+
+
+def _receive_exactly(sock: socket.socket, num_bytes: int) -> bytearray:
+    buffer = bytearray(num_bytes)
+    _receive_into(sock, buffer)
+    return buffer
+
+
+# An encoded frame: frame number, timestamp and the encoded channels in handshake order.
+EncodedFrame = Tuple[int, float, List[bytes]]
+
+
+@dataclass
+class ReceivedFrame:
+    """A frame that is borrowed from a RemoteZedReceiver, with the attributes of a BorrowedFrame."""
+    timestamp: float
+    frame_number: int
+    channels: Dict[Union[str, ZedChannel], np.ndarray]
+    # The frame was received as a whole, so unlike a BorrowedFrame, it cannot be overwritten while it is used.
+    intact: bool = True
+
+
+class _ClientConnection:
+    """Sends the frames that the server offers to one client, from a bounded queue that drops the oldest frames."""
+
+    def __init__(self, sock: socket.socket, address: Tuple[str, int], batch_size: int, max_queued_frames: int):
+        self.sock = sock
+        self.address = address
+        self.batch_size = batch_size
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self._frames: Deque[EncodedFrame] = collections.deque(maxlen=max_queued_frames)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._send_loop, daemon=True)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def offer(self, frame: EncodedFrame) -> None:
+        with self._condition:
+            if len(self._frames) == self._frames.maxlen:
+                self.frames_dropped += 1  # The deque drops the oldest frame.
+            self._frames.append(frame)
+            self._condition.notify()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)  # Wakes up the send loop if it is blocked on a slow client.
+        except OSError:
+            pass
+        self.sock.close()
+        if self._thread.ident is not None:
+            self._thread.join()
+
+    def _send_loop(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    while not self._frames and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                    # Send everything that is queued, up to a batch, in a single write.
+                    batch = [self._frames.popleft() for _ in range(min(self.batch_size, len(self._frames)))]
+
+                parts = [BATCH_HEADER.pack(BATCH_MAGIC, len(batch))]
+                for frame_number, timestamp, channels in batch:
+                    parts.append(FRAME_HEADER.pack(frame_number, timestamp))
+                    for data in channels:
+                        parts.append(LENGTH.pack(len(data)))
+                        parts.append(data)
+                self.sock.sendall(b"".join(parts))
+                self.frames_sent += len(batch)
+        except OSError as e:
+            if not self._closed:
+                logger.info(f"Client {self.address} disconnected: {e}")
+        finally:
+            self._closed = True
+
+
+class FrameStreamServer:
+    """Serves the frames of a publisher namespace to any number of RemoteZedReceivers."""
+
+    def __init__(self, shared_memory_namespace: str, host: str = "0.0.0.0", port: int = DEFAULT_PORT,
+                 channels: Optional[Sequence[ZedChannel]] = None,
+                 compression: FrameCompression = FrameCompression.NONE, jpeg_quality: int = 90, batch_size: int = 1,
+                 max_queued_frames: int = 2, target_fps: float = 0.0):
+        """
+        Args:
+            shared_memory_namespace: The namespace of the publisher, usually the serial number of the camera.
+            host: The address to listen on.
+            port: The port to listen on, 0 to pick a free port (see the port attribute).
+            channels: The channels to send. Defaults to all channels of the publisher.
+            compression: How to compress the channels of every frame.
+            jpeg_quality: The JPEG quality, from 0 to 100.
+            batch_size: The maximum number of queued frames that are sent in a single write.
+            max_queued_frames: The number of frames that are queued per client before the oldest are dropped.
+            target_fps: Only send frames at this rate, 0 to send every frame.
+        """
+        if max_queued_frames < batch_size:
+            raise ValueError("max_queued_frames must be at least batch_size.")
+        self.shared_memory_namespace = shared_memory_namespace
+        self.channels = list(channels) if channels is not None else None
+        self.compression = FrameCompression(compression)
+        self.jpeg_quality = jpeg_quality
+        self.batch_size = batch_size
+        self.max_queued_frames = max_queued_frames
+        self.target_fps = target_fps
+
+        self._server_socket = socket.create_server((host, port))
+        self.port = self._server_socket.getsockname()[1]
+        self._clients: List[_ClientConnection] = []
+        self._clients_lock = threading.Lock()
+        self._shutdown_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._receiver = None
+        self._encoder_pool: Optional[ThreadPoolExecutor] = None
+        self._encodings: List[str] = []
+        self._handshake = b""
+
+    def start(self) -> None:
+        # Imported here, so that hosts that only run RemoteZedReceivers do not need the ZED SDK.
+        from rgb_recorder.recording.zed_multiprocessing import ZedReceiver
+
+        # The views are sent as they were published, so that they are not converted on either side unless the client
+        # asks for another pixel format.
+        self._receiver = ZedReceiver(self.shared_memory_namespace, name=f"network:{self.port}",
+                                     target_fps=self.target_fps, pixel_format=None)
+        if self.channels is None:
+            self.channels = self._receiver.channels
+        channel_specs = []
+        for channel in self.channels:
+            shape, dtype = self._receiver.channel_layout(channel)
+            channel_specs.append({"name": channel.value, "shape": list(shape), "dtype": dtype.str,
+                                  "encoding": _channel_encoding(self.compression, shape, dtype)})
+        self._encodings = [spec["encoding"] for spec in channel_specs]
+        # zlib and OpenCV release the GIL, so the channels of a frame are encoded in parallel.
+        self._encoder_pool = ThreadPoolExecutor(len(self.channels), thread_name_prefix="frame_encoder")
+        self._handshake = json.dumps({
+            "version": PROTOCOL_VERSION,
+            "fps": self._receiver.fps,
+            "intrinsics": self._receiver.intrinsics_matrix().tolist(),
+            "pixel_format": self._receiver.pixel_format.value,
+            "channels": channel_specs,
+        }).encode()
+
+        self._threads = [threading.Thread(target=self._capture_loop, daemon=True),
+                         threading.Thread(target=self._accept_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def frames_dropped(self) -> int:
+        """The number of stale frames that were dropped from the queues of the connected clients."""
+        with self._clients_lock:
+            return sum(client.frames_dropped for client in self._clients)
+
+    def stop(self) -> None:
+        self._shutdown_event.set()
+        try:
+            self._server_socket.shutdown(socket.SHUT_RDWR)  # Wakes up the accept loop.
+        except OSError:
+            pass
+        self._server_socket.close()
+        for thread in self._threads:
+            thread.join()
+        with self._clients_lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            client.close()  # Also joins the thread of the client.
+
+    def _accept_loop(self) -> None:
+        while not self._shutdown_event.is_set():
+            try:
+                sock, address = self._server_socket.accept()
+            except OSError:
+                return  # The server socket was closed.
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                _send_message(sock, self._handshake)
+            except OSError:
+                sock.close()
+                continue
+            client = _ClientConnection(sock, address, self.batch_size, self.max_queued_frames)
+            client.start()
+            logger.info(f"Streaming {self.shared_memory_namespace} to {address}.")
+            with self._clients_lock:
+                self._clients = [c for c in self._clients if not c.closed] + [client]
+
+    def _capture_loop(self) -> None:
+        receiver = self._receiver
+        try:
+            while not self._shutdown_event.is_set():
+                if not receiver.wait_for_frame(receiver.retrieved_timestamp, timeout=0.1):
+                    continue
+                with self._clients_lock:
+                    clients = [client for client in self._clients if not client.closed]
+                if not clients:
+                    receiver.retrieve_channels([])  # Only move the cursor, so that the monitor shows no lag.
+                    continue
+                images = receiver.retrieve_channels(self.channels)
+                # Encode once for all clients.
+                encoded_channels = list(self._encoder_pool.map(
+                    lambda channel, encoding: _encode(encoding, images[channel], self.jpeg_quality),
+                    self.channels, self._encodings))
+                frame = (receiver.frame_ring.last_read_frame_number, receiver.retrieved_timestamp, encoded_channels)
+                for client in clients:
+                    client.offer(frame)
+        finally:
+            self._encoder_pool.shutdown()
+            receiver._close_shared_memory()
+
+
+class RemoteZedReceiver(RGBCamera):
+    """The client side of a FrameStreamServer, with the same API as a ZedReceiver. The latest received frame is kept,
+    and only decoded when it is retrieved."""
+
+    def __init__(self, host: str, port: int = DEFAULT_PORT, connect_timeout: float = 10.0,
+                 pixel_format: Optional[PixelFormat] = None):
+        """
+        Args:
+            host: The host of the FrameStreamServer.
+            port: The port of the FrameStreamServer.
+            connect_timeout: The maximum time to wait for the connection, in seconds.
+            pixel_format: The pixel format in which the views are retrieved, like that of a ZedReceiver. By default
+                (None), they are retrieved as the server sends them, see published_pixel_format.
+        """
+        super().__init__()
+        self._sock = socket.create_connection((host, port), timeout=connect_timeout)
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        (handshake_length,) = LENGTH.unpack(_receive_exactly(self._sock, LENGTH.size))
+        handshake = json.loads(_receive_exactly(self._sock, handshake_length))
+        if handshake["version"] != PROTOCOL_VERSION:
+            raise ValueError(f"The server uses protocol version {handshake['version']}, expected {PROTOCOL_VERSION}.")
+        self.fps = handshake["fps"]
+        self._intrinsics = np.array(handshake["intrinsics"])
+        self._channel_specs = [(ZedChannel(spec["name"]), tuple(spec["shape"]), np.dtype(spec["dtype"]),
+                                spec["encoding"]) for spec in handshake["channels"]]
+        self.channels = [channel for channel, _, _, _ in self._channel_specs]
+        self.published_pixel_format = PixelFormat(handshake.get("pixel_format", PixelFormat.RGB.value))
+        self.pixel_format = PixelFormat(pixel_format) if pixel_format is not None else self.published_pixel_format
+
+        self._latest_frame: Optional[EncodedFrame] = None
+        self._condition = threading.Condition()
+        self._closed = False
+        self.frames_received = 0
+        self.bytes_received = 0
+        # Frames that were dropped by the server or the network, or replaced by a newer frame before they were
+        # retrieved.
+        self.frames_missed = 0
+        self._last_retrieved_frame_number = 0
+
+        self.previous_timestamp = time.time()
+        self.retrieved_timestamp = 0.0
+        self._receive_thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self._receive_thread.start()
+
+    def _receive_loop(self) -> None:
+        # The headers are received into these buffers, the channels straight into the buffer of every frame.
+        batch_header = bytearray(BATCH_HEADER.size)
+        frame_header = bytearray(FRAME_HEADER.size)
+        length_buffer = bytearray(LENGTH.size)
+        try:
+            while True:
+                _receive_into(self._sock, batch_header)
+                magic, num_frames = BATCH_HEADER.unpack(batch_header)
+                if magic != BATCH_MAGIC:
+                    raise ConnectionError("Received a corrupt batch of frames.")
+                for _ in range(num_frames):
+                    _receive_into(self._sock, frame_header)
+                    frame_number, timestamp = FRAME_HEADER.unpack(frame_header)
+                    channels = []
+                    for _ in self._channel_specs:
+                        _receive_into(self._sock, length_buffer)
+                        (length,) = LENGTH.unpack(length_buffer)
+                        channels.append(_receive_exactly(self._sock, length))
+                    with self._condition:
+                        self._latest_frame = (frame_number, timestamp, channels)
+                        self.frames_received += 1
+                        self.bytes_received += sum(len(data) for data in channels)
+                        self._condition.notify_all()
+        except (ConnectionError, OSError) as e:
+            if not self._closed:
+                logger.warning(f"Lost the connection to the frame stream server: {e}")
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+
+    @property
+    def connected(self) -> bool:
+        return not self._closed
+
+    def get_current_timestamp(self) -> float:
+        with self._condition:
+            return self._latest_frame[1] if self._latest_frame is not None else 0.0
+
+    @property
+    def resolution(self) -> CameraResolutionType:
+        channel, shape, _, _ = self._channel_specs[0]
+        if channel in VIEW_CHANNELS:
+            return image_resolution(self.published_pixel_format, shape)
+        height, width = shape[:2]
+        return (width, height)
+
+    def intrinsics_matrix(self) -> CameraIntrinsicsMatrixType:
+        return self._intrinsics.copy()
+
+    def wait_for_frame(self, timestamp: Optional[float] = None, timeout: Optional[float] = None) -> bool:
+        """Block until a frame newer than timestamp (by default, the previously grabbed frame) has been received.
+
+        Returns:
+            Whether a newer frame is available, i.e. False if the timeout expired or the connection was lost.
+        """
+        if timestamp is None:
+            timestamp = self.previous_timestamp
+        with self._condition:
+            return self._condition.wait_for(lambda: self._closed or (self._latest_frame is not None and
+                                                                     self._latest_frame[1] > timestamp),
+                                            timeout) and not self._closed
+
+    def _grab_images(self) -> None:
+        if not self.wait_for_frame():
+            raise ConnectionError("Lost the connection to the frame stream server.")
+        self.previous_timestamp = self.get_current_timestamp()
+
+    def retrieve_channels(self, channels: Sequence[ZedChannel]) -> Dict[ZedChannel, np.ndarray]:
+        """Decode the given channels of the latest received frame, with the views in pixel_format. Its timestamp is
+        stored in retrieved_timestamp."""
+        _, images = self._decode_latest(channels)
+        for channel, image in images.items():
+            if channel in VIEW_CHANNELS:
+                image = convert(image, self.published_pixel_format, self.pixel_format)
+            # Uncompressed channels are views of the received frame, which must not be shared with the caller.
+            images[channel] = image if image.flags.writeable else image.copy()
+        return images
+
+    @contextlib.contextmanager
+    def borrow_frame(self, views: Sequence[Union[str, ZedChannel]] = (StereoRGBDCamera.LEFT_RGB,
+                                                                       StereoRGBDCamera.RIGHT_RGB)
+                     ) -> Iterator[ReceivedFrame]:
+        """Borrow the latest received frame, like ZedReceiver.borrow_frame(): frame.channels[view] holds every
+        requested view, read-only and in the pixel format of the server (published_pixel_format). Unlike a frame
+        borrowed from shared memory, the channels are decoded (uncompressed channels are not copied) and stay valid
+        after the with block.
+
+        Raises:
+            RuntimeError: if no frame has been received yet.
+        """
+        channels = {view: view if isinstance(view, ZedChannel) else _VIEW_CHANNELS[view] for view in views}
+        frame_number, images = self._decode_latest(list(channels.values()))
+        for image in images.values():
+            image.flags.writeable = False
+        yield ReceivedFrame(self.retrieved_timestamp, frame_number,
+                            {view: images[channel] for view, channel in channels.items()})
+
+    def _decode_latest(self, channels: Sequence[ZedChannel]) -> Tuple[int, Dict[ZedChannel, np.ndarray]]:
+        with self._condition:
+            if self._latest_frame is None:
+                raise RuntimeError("No frame has been received yet.")
+            frame_number, timestamp, encoded_channels = self._latest_frame
+        if frame_number > self._last_retrieved_frame_number > 0:
+            self.frames_missed += frame_number - self._last_retrieved_frame_number - 1
+        self._last_retrieved_frame_number = frame_number
+        self.retrieved_timestamp = timestamp
+
+        images = {}
+        for (channel, shape, dtype, encoding), data in zip(self._channel_specs, encoded_channels):
+            if channel in channels:
+                images[channel] = _decode(encoding, data, shape, dtype)
+        return frame_number, images
+
+    def _retrieve_rgb_image(self) -> Tuple[NumpyFloatImageType, NumpyFloatImageType]:
+        image_left, image_right = self._retrieve_rgb_image_as_int()
+        image_left = ImageConverter.from_numpy_int_format(image_left).image_in_numpy_format
+        image_right = ImageConverter.from_numpy_int_format(image_right).image_in_numpy_format
+        return image_left, image_right
+
+    def _retrieve_rgb_image_as_int(self) -> Tuple[NumpyIntImageType, NumpyIntImageType]:
+        images = self.retrieve_channels([ZedChannel.RGB_LEFT, ZedChannel.RGB_RIGHT])
+        return images[ZedChannel.RGB_LEFT], images[ZedChannel.RGB_RIGHT]
+
+    def close(self) -> None:
+        if not hasattr(self, "_receive_thread"):
+            return  # The connection failed.
+        self._closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._receive_thread.join()
+
+    def __del__(self) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serial-number", type=str, required=True, help="The namespace of the publisher.")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--channels", nargs="+", type=ZedChannel, default=None,
+                        help=f"Defaults to all published channels. Choices: {[c.value for c in ZedChannel]}")
+    parser.add_argument("--compression", type=FrameCompression, default=FrameCompression.NONE,
+                        help=f"Choices: {[c.value for c in FrameCompression]}")
+    parser.add_argument("--jpeg-quality", type=int, default=90)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--max-queued-frames", type=int, default=2)
+    parser.add_argument("--fps", type=float, default=0.0, help="Target rate, 0 to send every frame.")
+    args = parser.parse_args()
+
+    server = FrameStreamServer(args.serial_number, args.host, args.port, args.channels, args.compression,
+                               args.jpeg_quality, args.batch_size, args.max_queued_frames, args.fps)
+    server.start()
+    logger.info(f"Serving {args.serial_number} on port {server.port}. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
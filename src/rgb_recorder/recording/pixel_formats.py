@@ -0,0 +1,74 @@
+"""The pixel formats in which the RGB views of a camera can be published to shared memory, and the conversions between
+them.
+
+The ZED SDK delivers BGRA images, the video encoders take BGR (OpenCV) or any raw format (FFmpeg), and the airo
+RGBCamera interface returns RGB. Publishing in the format that the consumers need avoids a full-frame conversion in
+every consumer: a publisher converts once, into the slot, and a receiver that asks for the published format copies
+without converting.
+
+YUV420 is planar I420 (a full-resolution Y plane followed by quarter-resolution U and V planes, 1.5 bytes per pixel),
+stored as an array of shape (height * 3 / 2, width). FFmpeg encodes it without any conversion (yuv420p).
+"""
+import enum
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class PixelFormat(str, enum.Enum):
+    RGB = "rgb"
+    BGR = "bgr"
+    BGRA = "bgra"
+    YUV420 = "yuv420"
+
+
+# The pixel format of the views that the ZED SDK retrieves.
+SDK_PIXEL_FORMAT = PixelFormat.BGRA
+
+# The names of the pixel formats for the rawvideo input of FFmpeg.
+FFMPEG_PIXEL_FORMATS = {PixelFormat.RGB: "rgb24", PixelFormat.BGR: "bgr24", PixelFormat.BGRA: "bgra",
+                        PixelFormat.YUV420: "yuv420p"}
+
+_CONVERSIONS = {
+    (PixelFormat.RGB, PixelFormat.BGR): cv2.COLOR_RGB2BGR,
+    (PixelFormat.RGB, PixelFormat.BGRA): cv2.COLOR_RGB2BGRA,
+    (PixelFormat.RGB, PixelFormat.YUV420): cv2.COLOR_RGB2YUV_I420,
+    (PixelFormat.BGR, PixelFormat.RGB): cv2.COLOR_BGR2RGB,
+    (PixelFormat.BGR, PixelFormat.BGRA): cv2.COLOR_BGR2BGRA,
+    (PixelFormat.BGR, PixelFormat.YUV420): cv2.COLOR_BGR2YUV_I420,
+    (PixelFormat.BGRA, PixelFormat.RGB): cv2.COLOR_BGRA2RGB,
+    (PixelFormat.BGRA, PixelFormat.BGR): cv2.COLOR_BGRA2BGR,
+    (PixelFormat.BGRA, PixelFormat.YUV420): cv2.COLOR_BGRA2YUV_I420,
+    (PixelFormat.YUV420, PixelFormat.RGB): cv2.COLOR_YUV2RGB_I420,
+    (PixelFormat.YUV420, PixelFormat.BGR): cv2.COLOR_YUV2BGR_I420,
+    (PixelFormat.YUV420, PixelFormat.BGRA): cv2.COLOR_YUV2BGRA_I420,
+}
+
+
+def image_shape(pixel_format: PixelFormat, width: int, height: int) -> Tuple[int, ...]:
+    """The shape of a uint8 image of the given resolution in this pixel format."""
+    if pixel_format == PixelFormat.YUV420:
+        if width % 2 or height % 2:
+            raise ValueError(f"YUV420 needs an even width and height, got {width}x{height}.")
+        return (height * 3 // 2, width)
+    return (height, width, 4 if pixel_format == PixelFormat.BGRA else 3)
+
+
+def image_resolution(pixel_format: PixelFormat, shape: Tuple[int, ...]) -> Tuple[int, int]:
+    """The (width, height) of an image of this shape in this pixel format, the inverse of image_shape()."""
+    if pixel_format == PixelFormat.YUV420:
+        return shape[1], shape[0] * 2 // 3
+    return shape[1], shape[0]
+
+
+def convert(image: np.ndarray, source: PixelFormat, target: PixelFormat,
+            dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Convert an image between pixel formats, into dst if it is given. Images that are already in the target format
+    are copied (into dst) or returned as they are (without dst)."""
+    if source == target:
+        if dst is None:
+            return image
+        np.copyto(dst, image)
+        return dst
+    return cv2.cvtColor(image, _CONVERSIONS[(source, target)], dst=dst)
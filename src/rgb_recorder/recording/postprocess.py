@@ -0,0 +1,139 @@
+"""Offline post-processing of videos that were recorded with variable frame timing.
+
+A MultiprocessVideoRecorder with fill_missing_frames=False records every frame it receives only once. Gaps are not
+filled with repeated frames, so the video has no constant frame rate: the real capture time of every frame is in its
+frame index (see frame_index.py). This module turns such a recording into a constant-rate video afterwards, by
+repeating the previous frame for every missed frame (what the recorder does while recording with
+fill_missing_frames=True), and can export the frame times as a timecode file for tools that understand them, e.g.
+mkvmerge -o out.mkv --timestamps 0:color_left.txt color_left.mp4.
+
+    python -m rgb_recorder.recording.postprocess fill output/2024-01-01/12-00-00/35357320/color_left.mp4 [--fps 30]
+    python -m rgb_recorder.recording.postprocess timecodes output/2024-01-01/12-00-00/35357320/color_left.mp4
+"""
+import argparse
+import os
+from typing import Iterable, Iterator, Optional
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from rgb_recorder.recording.encoders import EncoderSettings, VideoEncoder, create_encoder
+from rgb_recorder.recording.frame_index import FrameIndex, FrameIndexWriter, index_filename
+
+
+def recording_index_file(video_file: str) -> str:
+    """The frame index of a recorded video. The left and right videos of a recording share a single index, named after
+    the video without the _left or _right suffix."""
+    index_file = index_filename(video_file)
+    if os.path.exists(index_file):
+        return index_file
+    root, extension = os.path.splitext(video_file)
+    for suffix in ("_left", "_right"):
+        if root.endswith(suffix):
+            return index_filename(root[:-len(suffix)] + extension)
+    return index_file
+
+
+def write_frames(frames: Iterable[np.ndarray], timestamps_ns: np.ndarray, encoder: VideoEncoder,
+                 output_index: FrameIndexWriter, fps: Optional[float] = None) -> int:
+    """Encode BGR frames and index them with their capture timestamps. If fps is given, the previous frame is repeated
+    for every frame period without a frame, and the repeated frames are indexed with the timestamps at which the
+    missed frames were expected.
+
+    Returns:
+        The number of repeated frames.
+    """
+    period_ns = 1e9 / fps if fps is not None else None
+    frames_filled = 0
+    previous_frame, previous_timestamp_ns = None, None
+    for frame, timestamp_ns in zip(frames, timestamps_ns):
+        if previous_frame is not None and period_ns is not None:
+            missed_frames = int((timestamp_ns - previous_timestamp_ns) / period_ns) - 1
+            for i in range(missed_frames):
+                encoder.write(previous_frame)
+                output_index.append(int(previous_timestamp_ns + (i + 1) * period_ns))
+            frames_filled += max(missed_frames, 0)
+        encoder.write(frame)
+        output_index.append(int(timestamp_ns))
+        previous_frame, previous_timestamp_ns = frame, timestamp_ns
+    return frames_filled
+
+
+def _read_video(capture) -> Iterator[np.ndarray]:
+    while True:
+        success, frame = capture.read()
+        if not success:
+            return
+        yield frame
+
+
+def fill_constant_rate(video_file: str, output_file: str, fps: Optional[float] = None,
+                       index_file: Optional[str] = None, encoder_settings: Optional[EncoderSettings] = None) -> int:
+    """Write a constant-rate copy of a video, repeating the previous frame for every frame period without a frame.
+    The output gets its own frame index, in which repeated frames have the timestamps at which the missed frames were
+    expected.
+
+    Args:
+        video_file: The recorded video.
+        output_file: The constant-rate video to write.
+        fps: The frame rate of the output. Defaults to the frame rate of the input, i.e. of the camera.
+        index_file: The frame index with the capture times of the frames. Defaults to recording_index_file().
+        encoder_settings: The settings of the video encoder. Defaults to OpenCV with the MPEG-4 part 2 codec.
+
+    Returns:
+        The number of repeated frames.
+    """
+    index = FrameIndex(index_file if index_file is not None else recording_index_file(video_file))
+    timestamps_ns = np.array(index.timestamps_ns)
+    capture = cv2.VideoCapture(video_file)
+    if not capture.isOpened():
+        raise IOError(f"Could not open {video_file}.")
+    if fps is None:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+    width, height = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    encoder = create_encoder(output_file, fps, width, height, encoder_settings)
+    output_index = FrameIndexWriter(index_filename(output_file))
+    try:
+        frames_filled = write_frames(_read_video(capture), timestamps_ns, encoder, output_index, fps)
+        if output_index.frames_written - frames_filled < len(timestamps_ns):
+            logger.warning(f"{video_file} has fewer frames than its index ({len(timestamps_ns)}).")
+    finally:
+        capture.release()
+        encoder.release()
+        output_index.close()
+    return frames_filled
+
+
+def write_timecodes(index_file: str, output_file: str) -> None:
+    """Write the frame times of an index as a timecode file (format v2: one time in milliseconds per frame, relative to
+    the first frame)."""
+    timestamps_ns = np.array(FrameIndex(index_file).timestamps_ns)
+    with open(output_file, "w") as f:
+        f.write("# timestamp format v2\n")
+        for timestamp_ns in timestamps_ns:
+            f.write(f"{(timestamp_ns - timestamps_ns[0]) / 1e6:.3f}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fill_parser = subparsers.add_parser("fill", help="Fill the gaps of videos to get a constant frame rate.")
+    fill_parser.add_argument("videos", nargs="+", type=str)
+    fill_parser.add_argument("--fps", type=float, default=None, help="Defaults to the frame rate of the video.")
+    fill_parser.add_argument("--suffix", type=str, default="_cfr", help="Appended to the name of every output.")
+    timecodes_parser = subparsers.add_parser("timecodes", help="Export the frame times of videos to timecode files.")
+    timecodes_parser.add_argument("videos", nargs="+", type=str)
+    args = parser.parse_args()
+
+    for video in args.videos:
+        root, extension = os.path.splitext(video)
+        if args.command == "fill":
+            output = f"{root}{args.suffix}{extension}"
+            filled = fill_constant_rate(video, output, args.fps)
+            logger.info(f"Wrote {output}, repeating {filled} frames.")
+        else:
+            output = f"{root}.txt"
+            write_timecodes(recording_index_file(video), output)
+            logger.info(f"Wrote {output}.")
@@ -0,0 +1,166 @@
+"""Adaptive quality control for the live video recorder.
+
+A MultiprocessVideoRecorder that cannot keep up with the camera misses frames. With a quality ladder, it steps down to a
+cheaper encoder setting instead: a faster preset at a lower quality, and as the last resort a raw spill, which only
+copies frames to disk (see raw_recorder.py) so that they can be encoded afterwards with transcode.py. When the load
+drops, it steps back up. Encoders cannot change their settings mid-stream, so every switch starts a new segment of the
+recording, see segment_video_path().
+
+The QualityController decides when to switch. Every frame, it gets the signals of the recorder: whether frames were
+missed, how full the encoder queues are, and the load of the encoders (the encode time per frame, relative to the
+frame period). These are smoothed over about half a second, so that a single hiccup does not cause a switch. Stepping
+up waits until the recorder has had no pressure for step_up_after seconds. If it has to step down again soon after,
+it waits twice as long before the next attempt, so that it does not oscillate between two levels.
+"""
+import dataclasses
+import math
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from rgb_recorder.recording.encoders import EncoderBackend, EncoderSettings
+
+# The x264/x265 presets, from the slowest to the fastest.
+FFMPEG_PRESETS = ("veryslow", "slower", "slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast")
+
+
+@dataclass
+class QualityLevel:
+    name: str
+    # None for a raw spill.
+    encoder_settings: Optional[EncoderSettings]
+
+    @property
+    def raw(self) -> bool:
+        return self.encoder_settings is None
+
+    def to_dict(self) -> dict:
+        settings = None
+        if self.encoder_settings is not None:
+            settings = dataclasses.asdict(self.encoder_settings)
+            settings["backend"] = self.encoder_settings.backend.name
+        return {"name": self.name, "encoder_settings": settings}
+
+
+def quality_ladder(settings: EncoderSettings, raw_spill: bool = False, crf_step: int = 2) -> List[QualityLevel]:
+    """The quality levels for a recorder with the given encoder settings, from the best to the cheapest.
+
+    With FFmpeg, every next level uses the next faster preset, with a CRF that is crf_step higher (a lower quality),
+    which offsets the larger files of the faster presets. OpenCV has no cheaper settings, so its ladder only has the
+    given settings. With raw_spill, the ladder ends with a raw spill, which takes gigabytes of disk per minute.
+    """
+    levels = [QualityLevel("full", settings)]
+    if settings.backend == EncoderBackend.FFMPEG and settings.preset in FFMPEG_PRESETS:
+        for i, preset in enumerate(FFMPEG_PRESETS[FFMPEG_PRESETS.index(settings.preset) + 1:]):
+            crf = min(settings.crf + (i + 1) * crf_step, 51)
+            levels.append(QualityLevel(f"{preset}_crf{crf}", dataclasses.replace(settings, preset=preset, crf=crf)))
+    if raw_spill:
+        levels.append(QualityLevel("raw", None))
+    return levels
+
+
+def segment_video_path(video_path: str, segment: int) -> str:
+    """The video path of a segment of a recording: video_path itself for the first segment, e.g. color_001.mp4 for
+    the next ones. The views and frame index of a segment are named after it, like those of a recording."""
+    if segment == 0:
+        return video_path
+    root, extension = os.path.splitext(video_path)
+    return f"{root}_{segment:03d}{extension}"
+
+
+class QualityController:
+    """Decides when a recorder switches between the levels of its quality ladder. Call update() for every frame."""
+
+    def __init__(self, num_levels: int, frame_period: float, high_load: float = 0.9, low_load: float = 0.5,
+                 step_down_after: float = 1.0, step_up_after: float = 10.0, max_step_up_after: float = 120.0,
+                 time_constant: float = 0.5):
+        """
+        Args:
+            num_levels: The number of levels of the ladder.
+            frame_period: The frame period of the camera, in seconds.
+            high_load: The load (encode time per frame / frame period) above which the encoders are under pressure.
+            low_load: The load below which a better level may be tried.
+            step_down_after: The minimum time at a level before stepping down again, e.g. to let a new encoder start.
+            step_up_after: The time without pressure after which a better level is tried.
+            max_step_up_after: The maximum of step_up_after, which doubles every time a step up fails.
+            time_constant: The time constant of the smoothing of the pressure, in seconds.
+        """
+        self.num_levels = num_levels
+        self.frame_period = frame_period
+        self.high_load = high_load
+        self.low_load = low_load
+        self.step_down_after = step_down_after
+        self.step_up_after = step_up_after
+        self._initial_step_up_after = step_up_after
+        self.max_step_up_after = max_step_up_after
+        self.time_constant = time_constant
+
+        self.level = 0
+        # The smoothed pressure, from 0 (none) to 1 (under pressure on every frame).
+        self.pressure = 0.0
+        self._last_update: Optional[float] = None
+        self._last_switch: Optional[float] = None
+        self._calm_since: Optional[float] = None
+        self._stepped_up = False
+        self._missed_since_switch = 0
+
+    def update(self, now: float, missed_frames: int, queue_fill: float, load: float) -> Optional[Tuple[int, str]]:
+        """Update the controller with the signals of a frame.
+
+        Args:
+            now: The time of the frame, in seconds.
+            missed_frames: The number of frames that were missed before this one.
+            queue_fill: How full the encoder queues are, from 0 to 1.
+            load: The encode time per frame divided by the frame period.
+
+        Returns:
+            The new level and the reason of the switch, or None to stay at the current level.
+        """
+        if self._last_switch is None:
+            self._last_switch = now
+        pressured = missed_frames > 0 or queue_fill >= 0.75 or load > self.high_load
+        dt = self.frame_period if self._last_update is None else max(now - self._last_update, 0.0)
+        alpha = 1 - math.exp(-dt / self.time_constant)
+        self.pressure += alpha * (float(pressured) - self.pressure)
+        self._last_update = now
+        self._missed_since_switch += max(missed_frames, 0)
+
+        if pressured or load > self.low_load:
+            self._calm_since = None
+        elif self._calm_since is None:
+            self._calm_since = now
+
+        since_switch = now - self._last_switch
+        if self.pressure > 0.5 and since_switch >= self.step_down_after and self.level < self.num_levels - 1:
+            reason = (f"pressure {self.pressure:.2f}: {self._missed_since_switch} frames missed in "
+                      f"{since_switch:.1f} s, queues {queue_fill:.0%} full, load {load:.2f}")
+            return self._switch(now, self.level + 1, reason)
+        if self.level > 0 and self._calm_since is not None and now - self._calm_since >= self.step_up_after:
+            return self._switch(now, self.level - 1, f"no pressure for {now - self._calm_since:.0f} s, "
+                                                     f"load {load:.2f}")
+        return None
+
+    def retire_cheapest_level(self, now: float, reason: str) -> Optional[Tuple[int, str]]:
+        """Stop using the cheapest level for the rest of the recording, e.g. when a raw spill is full. At that level,
+        the controller steps up to the next cheapest one, regardless of the pressure."""
+        if self.num_levels == 1:
+            raise ValueError("Cannot retire the only level of the ladder.")
+        self.num_levels -= 1
+        if self.level < self.num_levels:
+            return None
+        return self._switch(now, self.num_levels - 1, reason)
+
+    def _switch(self, now: float, level: int, reason: str) -> Tuple[int, str]:
+        if level > self.level and self._stepped_up:
+            if now - self._last_switch < self.step_up_after:
+                # The better level could not keep up: wait longer before trying it again.
+                self.step_up_after = min(2 * self.step_up_after, self.max_step_up_after)
+            else:
+                self.step_up_after = self._initial_step_up_after
+        self._stepped_up = level < self.level
+        self.level = level
+        self._last_switch = now
+        self._calm_since = None
+        self.pressure = 0.0
+        self._missed_since_switch = 0
+        return level, reason
@@ -0,0 +1,166 @@
+"""Records the views of a camera without encoding them, so that the frame rate is only limited by the bandwidth of the
+disk. Use transcode.py to encode the recordings to videos afterwards."""
+import json
+import multiprocessing
+import os
+import shutil
+from multiprocessing import Process
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from rgb_recorder.recording.channels import ZedChannel
+from rgb_recorder.recording.depth_store import NpyFrameWriter
+from rgb_recorder.recording.frame_index import FrameIndexWriter, index_filename
+from rgb_recorder.recording.pixel_formats import PixelFormat
+from rgb_recorder.recording.quality_control import segment_video_path
+from rgb_recorder.recording.zed_multiprocessing import ZedReceiver
+
+# The part of the free disk space that a recording may take.
+_MAX_DISK_USE = 0.95
+
+
+def raw_filenames(video_path: str) -> dict:
+    """The raw files of the left and right views, their shared frame index and their metadata (see
+    raw_metadata_file()), for a recording to video_path."""
+    return {ZedChannel.RGB_LEFT: video_path.replace(".mp4", "_left.npy"),
+            ZedChannel.RGB_RIGHT: video_path.replace(".mp4", "_right.npy"),
+            "index": index_filename(video_path.replace(".mp4", ".npy")),
+            "metadata": video_path.replace(".mp4", ".json")}
+
+
+def raw_metadata_file(raw_file: str) -> str:
+    """The metadata of a raw recording: a JSON file with the pixel format of the frames and the fps of the camera,
+    shared by the left and right views."""
+    root = os.path.splitext(raw_file)[0]
+    for suffix in ("_left", "_right"):
+        if root.endswith(suffix):
+            root = root[:-len(suffix)]
+    return root + ".json"
+
+
+class RawViewWriter:
+    """Writes the left and right views of a camera to raw files (see raw_filenames()), with their frame index and
+    metadata. The files are preallocated for max_duration seconds, or for as much as fits on the disk."""
+
+    def __init__(self, video_path: str, shape: Tuple[int, ...], pixel_format: PixelFormat, fps: float,
+                 max_duration: float, allocate: bool = True):
+        self.filenames = raw_filenames(video_path)
+        directory = os.path.dirname(self.filenames["index"])
+        with open(self.filenames["metadata"], "w") as f:
+            json.dump({"pixel_format": pixel_format.value, "fps": fps}, f)
+
+        self.max_frames = int(max_duration * fps)
+        bytes_per_frame = 2 * int(np.prod(shape))
+        frames_that_fit = int(shutil.disk_usage(directory).free * _MAX_DISK_USE) // bytes_per_frame
+        if frames_that_fit < self.max_frames:
+            logger.warning(f"Only {frames_that_fit / fps:.0f} s of {max_duration:.0f} s fit on the disk of "
+                           f"{directory}.")
+            self.max_frames = frames_that_fit
+
+        self._writers = {channel: NpyFrameWriter(self.filenames[channel], self.max_frames, shape, np.uint8, allocate)
+                         for channel in (ZedChannel.RGB_LEFT, ZedChannel.RGB_RIGHT)}
+        self._frame_index = FrameIndexWriter(self.filenames["index"])
+
+    @property
+    def full(self) -> bool:
+        return self._writers[ZedChannel.RGB_LEFT].full
+
+    def next_frames(self) -> Dict[ZedChannel, np.ndarray]:
+        """The memory-mapped frames that the next views are written to."""
+        return {channel: writer.next_frame() for channel, writer in self._writers.items()}
+
+    def commit(self, timestamp: float) -> None:
+        """Add the frames of next_frames() to the files, with the capture time of the frame."""
+        for writer in self._writers.values():
+            writer.commit()
+        self._frame_index.append(int(timestamp * 1e9), byte_offset=self._writers[ZedChannel.RGB_LEFT].last_byte_offset)
+
+    def close(self) -> None:
+        for writer in self._writers.values():
+            writer.release()
+        self._frame_index.close()
+
+
+class RawVideoRecorder(Process):
+    """Copies the left and right RGB views from shared memory straight into preallocated, memory-mapped .npy files (see
+    depth_store.NpyFrameWriter), one per view, with a frame index that holds the capture time and byte offset of every
+    frame. There is no color conversion or encoding on the critical path: frames are stored in the pixel format of the
+    publisher, which is recorded in a metadata file, and the files are written sequentially.
+
+    A view takes width * height * 3 bytes per frame in RGB or BGR, e.g. 8.2 MB at 2208x1242 (half that in YUV420):
+    record to a fast local disk. The files
+    are preallocated for max_duration seconds, or for as much as fits on the disk. When they are full, the recording
+    rolls over to the next segment, with its own preallocated files and frame index (see segment_video_path()): e.g.
+    color_left.npy is followed by color_001_left.npy. The recording only stops when the disk is full."""
+
+    def __init__(
+            self,
+            shared_memory_namespace: str,
+            video_path: str,
+            max_duration: float = 600.0,
+            multi_recorder_barrier: Optional[multiprocessing.Barrier] = None,
+            allocate: bool = True,
+    ):
+        super().__init__(daemon=True)
+        self._shared_memory_namespace = shared_memory_namespace
+        self.shutdown_event = multiprocessing.Event()
+        self._multi_recorder_barrier = multi_recorder_barrier
+        self._max_duration = max_duration
+        self._allocate = allocate
+        self._video_path = video_path
+        self._filenames = raw_filenames(video_path)
+
+    def _open_writer(self, segment: int, receiver: ZedReceiver, shape: Tuple[int, ...]) -> Optional[RawViewWriter]:
+        """Open the raw files of a segment of the recording, or return None if not a single frame fits on the disk."""
+        writer = RawViewWriter(segment_video_path(self._video_path, segment), shape, receiver.pixel_format,
+                               receiver.fps, self._max_duration, self._allocate)
+        if writer.max_frames == 0:
+            writer.close()
+            for filename in writer.filenames.values():
+                os.remove(filename)
+            logger.error(f"The disk of {self._video_path} is full, stopped recording.")
+            return None
+        logger.info(f"Recording raw frames to {writer.filenames[ZedChannel.RGB_LEFT]} and "
+                    f"{writer.filenames[ZedChannel.RGB_RIGHT]}")
+        return writer
+
+    def run(self) -> None:
+        if self._multi_recorder_barrier is not None:
+            logger.info("Waiting for barrier")
+            self._multi_recorder_barrier.wait()
+            logger.info("Barrier released")
+
+        os.makedirs(os.path.dirname(self._filenames["index"]), exist_ok=False)
+
+        receiver = ZedReceiver(self._shared_memory_namespace, name="raw_recorder", pixel_format=None)
+        channels = [ZedChannel.RGB_LEFT, ZedChannel.RGB_RIGHT]
+        shape, _ = receiver.channel_layout(ZedChannel.RGB_LEFT)
+        segment = 0
+        writer = self._open_writer(segment, receiver, shape)
+
+        timestamp_prev_frame = None
+        try:
+            while writer is not None and not self.shutdown_event.is_set():
+                if not receiver.wait_for_frame(timestamp_prev_frame, timeout=0.1):
+                    continue
+                if writer.full:
+                    # The next segment is only opened for a frame, so that a recording never ends with an empty one.
+                    writer.close()
+                    segment += 1
+                    writer = self._open_writer(segment, receiver, shape)
+                    if writer is None:
+                        break
+                # Copy the frame from shared memory straight into the memory-mapped files.
+                receiver.retrieve_channels(channels, out=writer.next_frames())
+                timestamp_prev_frame = receiver.retrieved_timestamp
+                writer.commit(timestamp_prev_frame)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if receiver.segment.reader_index is not None:
+            reader = receiver.segment.readers[receiver.segment.reader_index]
+            logger.info(f"Recorded {reader['delivered']} frames from the camera, {reader['overwritten']} frames were "
+                        f"overwritten before they could be recorded.")
@@ -1,16 +1,17 @@
 import datetime
 import os
 from multiprocessing import Barrier
-from typing import List
-
-from airo_camera_toolkit.cameras.zed.zed import Zed
-from pyzed import sl
+from typing import List, Optional, Sequence
 
+from rgb_recorder.recording.channels import DEFAULT_CHANNELS, ZedChannel, requires_depth
+from rgb_recorder.recording.encoders import EncoderSettings
+from rgb_recorder.recording.pixel_formats import PixelFormat
+from rgb_recorder.recording.raw_recorder import RawVideoRecorder
 from rgb_recorder.recording.video_recorder import MultiprocessVideoRecorder
-from rgb_recorder.recording.zed_multiprocessing import ZedPublisher
+from rgb_recorder.recording.zed_multiprocessing import Zed, ZedPublisher, sl
 
 
-def create_output_directory(output_dir: str) -> str:
+def create_output_file(output_dir: str) -> str:
     output_dir = output_dir
     os.makedirs(output_dir, exist_ok=True)
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d/%H-%M-%S")
@@ -20,8 +21,12 @@ def create_output_directory(output_dir: str) -> str:
 
 
 def record_videos(serial_numbers: List[str], output_dir: str, fps: int,
-                  resolution: tuple[int, int]) -> None:
-    publishers = create_publishers(fps, resolution, serial_numbers)
+                  resolution: tuple[int, int], camera_cls: Optional[type] = None,
+                  camera_kwargs: Optional[dict] = None, fill_missing_frames: bool = True, raw: bool = False,
+                  pixel_format: PixelFormat = PixelFormat.BGR, adaptive_quality: bool = False,
+                  encoder_settings: Optional[EncoderSettings] = None, raw_spill: bool = False) -> None:
+    publishers = create_publishers(fps, resolution, serial_numbers, camera_cls=camera_cls, camera_kwargs=camera_kwargs,
+                                   pixel_format=pixel_format)
     start_publishers(publishers)
 
     video_path = create_output_file(output_dir)
@@ -29,7 +34,8 @@ def record_videos(serial_numbers: List[str], output_dir: str, fps: int,
     # Barrier to synchronize recording start.
     barrier = Barrier(len(serial_numbers) + 1)  # One per camera, plus one for this process.
 
-    recorders = create_recorders(barrier, serial_numbers, video_path)
+    recorders = create_recorders(barrier, serial_numbers, video_path, fill_missing_frames, raw, adaptive_quality,
+                                 encoder_settings, raw_spill)
     start_recorders(recorders)
 
     read_user_input(barrier)
@@ -74,13 +80,23 @@ def start_recorders(recorders):
         recorder.start()
 
 
-def create_recorders(barrier, serial_numbers, video_path):
-    # Initialize the camera subscribers (video recorders).
+def create_recorders(barrier, serial_numbers, video_path, fill_missing_frames: bool = True, raw: bool = False,
+                     adaptive_quality: bool = False, encoder_settings: Optional[EncoderSettings] = None,
+                     raw_spill: bool = False):
+    # Initialize the camera subscribers (video recorders). Raw recorders do not encode, see raw_recorder.py. With
+    # adaptive_quality, video recorders lower their quality when they cannot keep up, see quality_control.py: with
+    # FFmpeg encoder settings to faster presets, and with raw_spill to raw files.
     recorders = []
     for serial_number in serial_numbers:
-        recorder = MultiprocessVideoRecorder(serial_number,
-                                             video_path.replace("color.mp4", f"{serial_number}/color.mp4"),
-                                             multi_recorder_barrier=barrier)
+        recorder_video_path = video_path.replace("color.mp4", f"{serial_number}/color.mp4")
+        if raw:
+            recorder = RawVideoRecorder(serial_number, recorder_video_path, multi_recorder_barrier=barrier)
+        else:
+            recorder = MultiprocessVideoRecorder(serial_number, recorder_video_path,
+                                                 fill_missing_frames=fill_missing_frames,
+                                                 multi_recorder_barrier=barrier,
+                                                 encoder_settings=encoder_settings,
+                                                 adaptive_quality=adaptive_quality, raw_spill=raw_spill)
         recorders.append(recorder)
     return recorders
 
@@ -91,14 +107,32 @@ def start_publishers(publishers):
         publisher.start()
 
 
-def create_publishers(fps, resolution, serial_numbers):
-    # Initialize the camera publishers.
+def create_publishers(fps, resolution, serial_numbers, channels: Sequence[ZedChannel] = DEFAULT_CHANNELS,
+                      depth_mode: Optional["sl.DEPTH_MODE"] = None, camera_cls: Optional[type] = None,
+                      camera_kwargs: Optional[dict] = None, pixel_format: PixelFormat = PixelFormat.BGR):
+    """Create a publisher per serial number. By default, these publish Zed cameras, which compute depth (with
+    depth_mode, NEURAL by default) only if one of the channels needs it. Pass a SimulatedCamera class, e.g.
+    SyntheticCamera or ReplayCamera, as camera_cls to run without cameras. Its publishers are still named after the
+    serial numbers, and it is instantiated with the resolution and fps, plus camera_kwargs.
+
+    The views are published in BGR by default, the pixel format of the video encoders, so that the recorders do not
+    convert them."""
     publishers = []
     for serial_number in serial_numbers:
-        publisher = ZedPublisher(Zed, camera_kwargs=dict(resolution=resolution,
-                                                         serial_number=serial_number,
-                                                         fps=fps,
-                                                         depth_mode=sl.DEPTH_MODE.NONE),
-                                 shared_memory_namespace=serial_number)
+        if camera_cls is None or camera_cls is Zed:
+            if Zed is None:
+                raise ImportError("Publishing Zed cameras requires the ZED SDK (pyzed).")
+            if depth_mode is None:
+                depth_mode = sl.DEPTH_MODE.NEURAL
+            kwargs = dict(resolution=resolution, serial_number=serial_number, fps=fps,
+                          depth_mode=depth_mode if requires_depth(channels) else sl.DEPTH_MODE.NONE)
+            publisher_camera_cls = Zed
+        else:
+            kwargs = dict(resolution=resolution, fps=fps)
+            publisher_camera_cls = camera_cls
+        if camera_kwargs is not None:
+            kwargs.update(camera_kwargs)
+        publisher = ZedPublisher(publisher_camera_cls, camera_kwargs=kwargs, shared_memory_namespace=serial_number,
+                                 channels=channels, pixel_format=pixel_format)
         publishers.append(publisher)
     return publishers
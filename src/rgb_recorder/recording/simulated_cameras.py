@@ -0,0 +1,269 @@
+"""Cameras that can be published by a ZedPublisher without a ZED camera or the ZED SDK, e.g. to reproduce throughput
+problems on a laptop or in CI.
+
+* SyntheticCamera generates frames of any resolution and rate: a moving textured pattern for the RGB views and a
+  sloped floor for the depth channels.
+* ReplayCamera plays back recorded videos (e.g. the _left.mp4 and _right.mp4 files of the legacy recorder) or
+  directories of images.
+
+Both can run in real time, pacing _grab_images() at their fps like a camera does, or as fast as possible.
+"""
+import glob
+import os
+import time
+from abc import abstractmethod
+from typing import List, Optional, Sequence
+
+import cv2
+import numpy as np
+from airo_camera_toolkit.interfaces import RGBCamera, StereoRGBDCamera
+from airo_camera_toolkit.utils.image_converter import ImageConverter
+from airo_typing import CameraIntrinsicsMatrixType, CameraResolutionType, NumpyFloatImageType, NumpyIntImageType
+
+from rgb_recorder.recording.channels import DEFAULT_CHANNELS, ZedChannel
+from rgb_recorder.recording.pixel_formats import PixelFormat, convert, image_shape
+
+_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+class SimulatedCamera(RGBCamera):
+    """Base class of the cameras in this module. A ZedPublisher calls retrieve_channel_into() for every published
+    channel after every _grab_images()."""
+
+    # The channels that this camera can produce.
+    supported_channels: Sequence[ZedChannel] = DEFAULT_CHANNELS
+    # The pixel format in which retrieve_channel_into() writes the views.
+    native_pixel_format: PixelFormat = PixelFormat.RGB
+
+    def __init__(self, resolution: CameraResolutionType, fps: float, realtime: bool):
+        super().__init__()
+        self._resolution = resolution
+        self._fps = fps
+        self.realtime = realtime
+        self.frame_number = 0
+        self._next_frame_time: Optional[float] = None
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    @property
+    def resolution(self) -> CameraResolutionType:
+        return self._resolution
+
+    def intrinsics_matrix(self) -> CameraIntrinsicsMatrixType:
+        # A pinhole camera with a horizontal field of view of 90 degrees.
+        width, height = self._resolution
+        focal_length = width / 2
+        return np.array([[focal_length, 0, width / 2], [0, focal_length, height / 2], [0, 0, 1]])
+
+    def _grab_images(self) -> None:
+        if self.realtime:
+            now = time.time()
+            if self._next_frame_time is None or now - self._next_frame_time > 1 / self._fps:
+                # First frame, or we fell behind: restart the clock instead of delivering a burst of frames.
+                self._next_frame_time = now
+            else:
+                time.sleep(max(self._next_frame_time - now, 0))
+            self._next_frame_time += 1 / self._fps
+        self._next_frame()
+        self.frame_number += 1
+
+    @abstractmethod
+    def _next_frame(self) -> None:
+        """Advance to the next frame."""
+
+    @abstractmethod
+    def retrieve_channel_into(self, channel: ZedChannel, destination: np.ndarray) -> None:
+        """Write a channel of the current frame into destination, an array with the shape and dtype of
+        channels.channel_shape() and channels.CHANNEL_LAYOUTS, e.g. a slot of the shared memory segment. The views are
+        written in native_pixel_format: a publisher with another pixel format converts them."""
+
+    def _retrieve_rgb_image(self, view: str = StereoRGBDCamera.LEFT_RGB) -> NumpyFloatImageType:
+        return ImageConverter.from_numpy_int_format(self._retrieve_rgb_image_as_int(view)).image_in_numpy_format
+
+    def _retrieve_rgb_image_as_int(self, view: str = StereoRGBDCamera.LEFT_RGB) -> NumpyIntImageType:
+        # Like the Zed class, this returns a single view.
+        width, height = self._resolution
+        image = np.empty(image_shape(self.native_pixel_format, width, height), dtype=np.uint8)
+        self.retrieve_channel_into(ZedChannel.RGB_LEFT if view == StereoRGBDCamera.LEFT_RGB else ZedChannel.RGB_RIGHT,
+                                   image)
+        return convert(image, self.native_pixel_format, PixelFormat.RGB)
+
+
+class SyntheticCamera(SimulatedCamera):
+    """Generates a textured pattern that moves a few pixels per frame, so that video encoders have realistic work to
+    do, and a static sloped floor for depth. Frames are cut from patterns that are generated once, so producing a
+    frame costs a single copy per channel."""
+
+    supported_channels = tuple(ZedChannel)
+
+    def __init__(self, resolution: CameraResolutionType = (1280, 720), fps: float = 30.0, realtime: bool = True,
+                 speed: int = 4, disparity: int = 16, seed: int = 0):
+        """
+        Args:
+            resolution: The (width, height) of the frames.
+            fps: The frame rate.
+            realtime: Pace _grab_images() at fps. If False, frames are produced as fast as possible.
+            speed: How many pixels the pattern moves per frame.
+            disparity: The horizontal offset in pixels between the left and right views.
+            seed: The seed of the random texture.
+        """
+        super().__init__(resolution, fps, realtime)
+        width, height = resolution
+        self._speed = speed
+        self._disparity = disparity
+
+        # The pattern repeats every width pixels, so any window of width pixels is a valid frame.
+        rows, columns = np.indices((height, 2 * width + disparity), dtype=np.float32)
+        phase = 2 * np.pi * (columns % width) / width
+        texture = np.random.default_rng(seed).normal(0, 8, (height, width)).astype(np.float32)
+        texture = np.tile(texture, (1, 3))[:, :2 * width + disparity]
+        pattern = np.stack([127 + 100 * np.sin(phase + rows / 40), 127 + 100 * np.sin(2 * phase),
+                            255 * rows / height], axis=-1) + texture[..., None]
+        self._pattern = np.clip(pattern, 0, 255).astype(np.uint8)
+
+        # The floor is 3 metres away at the top of the image and 0.5 metres away at the bottom.
+        self._depth = np.repeat(np.linspace(3.0, 0.5, height, dtype=np.float32)[:, None], width, axis=1)
+        self._depth_mm = (self._depth * 1000).astype(np.uint16)
+        intrinsics = self.intrinsics_matrix()
+        rows, columns = np.indices((height, width), dtype=np.float32)
+        self._point_cloud = np.stack([(columns - intrinsics[0, 2]) * self._depth / intrinsics[0, 0],
+                                      (rows - intrinsics[1, 2]) * self._depth / intrinsics[1, 1],
+                                      self._depth], axis=-1)
+        self._confidence = np.full((height, width), 10.0, dtype=np.float32)
+
+    def _next_frame(self) -> None:
+        pass  # Frames are cut from the patterns using frame_number.
+
+    def retrieve_channel_into(self, channel: ZedChannel, destination: np.ndarray) -> None:
+        width, _ = self._resolution
+        offset = (self.frame_number * self._speed) % width
+        if channel == ZedChannel.RGB_LEFT:
+            np.copyto(destination, self._pattern[:, offset:offset + width])
+        elif channel == ZedChannel.RGB_RIGHT:
+            np.copyto(destination, self._pattern[:, offset + self._disparity:offset + self._disparity + width])
+        elif channel == ZedChannel.DEPTH:
+            np.copyto(destination, self._depth)
+        elif channel == ZedChannel.DEPTH_MM:
+            np.copyto(destination, self._depth_mm)
+        elif channel == ZedChannel.CONFIDENCE:
+            np.copyto(destination, self._confidence)
+        elif channel == ZedChannel.POINT_CLOUD:
+            np.copyto(destination, self._point_cloud)
+        else:
+            raise ValueError(f"Unsupported channel: {channel}")
+
+
+class _VideoSource:
+    def __init__(self, path: str):
+        self.path = path
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise IOError(f"Could not open {path}.")
+        self.fps: Optional[float] = self._capture.get(cv2.CAP_PROP_FPS) or None
+
+    def read(self) -> Optional[np.ndarray]:
+        success, frame = self._capture.read()
+        return frame if success else None
+
+    def rewind(self) -> None:
+        self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+
+class _ImageSequenceSource:
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.isdir(path):
+            filenames = [os.path.join(path, filename) for filename in os.listdir(path)]
+        else:
+            filenames = glob.glob(path)
+        self._filenames: List[str] = sorted(filename for filename in filenames
+                                            if filename.lower().endswith(_IMAGE_EXTENSIONS))
+        if not self._filenames:
+            raise IOError(f"No images found in {path}.")
+        self.fps: Optional[float] = None
+        self._index = 0
+
+    def read(self) -> Optional[np.ndarray]:
+        if self._index >= len(self._filenames):
+            return None
+        frame = cv2.imread(self._filenames[self._index], cv2.IMREAD_COLOR)
+        if frame is None:
+            raise IOError(f"Could not read {self._filenames[self._index]}.")
+        self._index += 1
+        return frame
+
+    def rewind(self) -> None:
+        self._index = 0
+
+
+def _open_source(path: str):
+    if os.path.isdir(path) or glob.has_magic(path) or path.lower().endswith(_IMAGE_EXTENSIONS):
+        return _ImageSequenceSource(path)
+    return _VideoSource(path)
+
+
+class ReplayCamera(SimulatedCamera):
+    """Plays back a video file, a directory of images or a glob pattern of images (e.g. "frames/*.png"), sorted by
+    filename. The left and right views can come from different sources; by default, both show the same frames.
+
+    The views are written in BGR, as OpenCV decodes them, so that a publisher in BGR (the default of the recorders)
+    copies them without any color conversion."""
+
+    native_pixel_format = PixelFormat.BGR
+
+    def __init__(self, left_path: str, right_path: Optional[str] = None, fps: Optional[float] = None,
+                 realtime: bool = True, loop: bool = True, resolution: Optional[CameraResolutionType] = None):
+        """
+        Args:
+            left_path: The source of the left view.
+            right_path: The source of the right view. Defaults to left_path.
+            fps: The frame rate. Defaults to the frame rate of the left video, or 30 for images.
+            realtime: Pace _grab_images() at fps. If False, frames are played back as fast as they can be decoded.
+            loop: Start again when the left source ends. Otherwise, _grab_images() raises EOFError.
+            resolution: The (width, height) to resize the frames to. Defaults to the resolution of the sources.
+        """
+        self._target_resolution = tuple(resolution) if resolution is not None else None
+        self._left_source = _open_source(left_path)
+        self._right_source = _open_source(right_path) if right_path is not None else None
+        self.loop = loop
+        self._left_frame = self._read(self._left_source)
+        self._right_frame = self._read(self._right_source) if self._right_source is not None else self._left_frame
+        if self._left_frame.shape != self._right_frame.shape:
+            raise ValueError(f"The views have different shapes: {self._left_frame.shape} and "
+                             f"{self._right_frame.shape}.")
+        height, width, _ = self._left_frame.shape
+        if fps is None:
+            fps = self._left_source.fps or 30.0
+        super().__init__((width, height), fps, realtime)
+        # The first frame has been read already.
+        self._first_frame_read = True
+
+    def _read(self, source) -> np.ndarray:
+        frame = source.read()
+        if frame is None:
+            if not self.loop:
+                raise EOFError(f"Reached the end of {source.path}.")
+            source.rewind()
+            frame = source.read()
+            if frame is None:
+                raise IOError(f"Could not read a frame from {source.path}.")
+        if self._target_resolution is not None and (frame.shape[1], frame.shape[0]) != self._target_resolution:
+            frame = cv2.resize(frame, self._target_resolution, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def _next_frame(self) -> None:
+        if self._first_frame_read:
+            self._first_frame_read = False
+            return
+        self._left_frame = self._read(self._left_source)
+        self._right_frame = self._read(self._right_source) if self._right_source is not None else self._left_frame
+
+    def retrieve_channel_into(self, channel: ZedChannel, destination: np.ndarray) -> None:
+        if channel == ZedChannel.RGB_LEFT:
+            np.copyto(destination, self._left_frame)
+        elif channel == ZedChannel.RGB_RIGHT:
+            np.copyto(destination, self._right_frame)
+        else:
+            raise ValueError(f"Unsupported channel: {channel}")
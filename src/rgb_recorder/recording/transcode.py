@@ -0,0 +1,137 @@
+"""Encodes the raw recordings of RawVideoRecorder to videos, using a process per file, so that all cores are used.
+
+Every video gets its own frame index. By default, the videos have variable frame timing like the raw recordings:
+missed frames are not filled (see postprocess.py). Usage:
+
+    python -m rgb_recorder.recording.transcode output/2024-01-01/12-00-00/*/color_*.npy [--workers 8]
+        [--fill-missing-frames] [--delete]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from rgb_recorder.recording.encoders import EncoderBackend, EncoderSettings, create_encoder, encoder_input_format
+from rgb_recorder.recording.frame_index import FrameIndex, FrameIndexWriter, index_filename
+from rgb_recorder.recording.pixel_formats import PixelFormat, convert, image_resolution, image_shape
+from rgb_recorder.recording.postprocess import recording_index_file, write_frames
+from rgb_recorder.recording.raw_recorder import raw_metadata_file
+
+
+def estimate_fps(timestamps_ns: np.ndarray, default: float = 30.0) -> float:
+    """The frame rate of a recording, from the median time between frames, which ignores missed frames."""
+    if len(timestamps_ns) < 2:
+        return default
+    return float(np.round(1e9 / np.median(np.diff(timestamps_ns)), 2))
+
+
+def _converted_frames(frames: np.ndarray, pixel_format: PixelFormat, target: PixelFormat,
+                      shape: Tuple[int, ...]) -> Iterator[np.ndarray]:
+    if pixel_format == target:
+        yield from frames
+        return
+    # Two buffers, used in turn: write_frames() may still repeat the previous frame after the next one was converted.
+    buffers = [np.empty(shape, dtype=np.uint8) for _ in range(2)]
+    for i, frame in enumerate(frames):
+        yield convert(frame, pixel_format, target, dst=buffers[i % 2])
+
+
+def transcode(raw_file: str, output_file: str, fps: Optional[float] = None, index_file: Optional[str] = None,
+              encoder_settings: Optional[EncoderSettings] = None, fill_missing_frames: bool = False) -> int:
+    """Encode a raw recording (a .npy file of frames) to a video. The frames are only converted if the encoder does
+    not take their pixel format, which is read from the metadata of the recording (RGB if there is none).
+
+    Args:
+        raw_file: The raw recording.
+        output_file: The video to write.
+        fps: The frame rate of the video. Defaults to the fps of the camera in the metadata of the recording, or else
+            to the frame rate estimated from its index.
+        index_file: The frame index of the recording. Defaults to postprocess.recording_index_file().
+        encoder_settings: The settings of the video encoder. Defaults to OpenCV with the MPEG-4 part 2 codec.
+        fill_missing_frames: Repeat the previous frame for missed frames, for a constant frame rate.
+
+    Returns:
+        The number of frames in the video.
+    """
+    frames = np.load(raw_file, mmap_mode="r")
+    timestamps_ns = np.array(FrameIndex(index_file if index_file is not None
+                                        else recording_index_file(raw_file)).timestamps_ns[:len(frames)])
+    metadata = {}
+    if os.path.exists(raw_metadata_file(raw_file)):
+        with open(raw_metadata_file(raw_file)) as f:
+            metadata = json.load(f)
+    pixel_format = PixelFormat(metadata.get("pixel_format", PixelFormat.RGB.value))
+    if fps is None:
+        fps = metadata.get("fps") or estimate_fps(timestamps_ns)
+    width, height = image_resolution(pixel_format, frames.shape[1:])
+
+    input_format = encoder_input_format(pixel_format, encoder_settings)
+    encoder = create_encoder(output_file, fps, width, height, encoder_settings, input_format)
+    output_index = FrameIndexWriter(index_filename(output_file))
+    try:
+        write_frames(_converted_frames(frames, pixel_format, input_format, image_shape(input_format, width, height)),
+                     timestamps_ns, encoder, output_index, fps if fill_missing_frames else None)
+    finally:
+        encoder.release()
+        output_index.close()
+    return output_index.frames_written
+
+
+def transcode_all(raw_files: List[str], workers: Optional[int] = None,
+                  encoder_settings: Optional[EncoderSettings] = None, fill_missing_frames: bool = False,
+                  delete: bool = False) -> List[str]:
+    """Transcode raw recordings in parallel, each to a video next to it with the same name.
+
+    Args:
+        workers: The number of processes. Defaults to the number of cores.
+        delete: Delete every raw file once it has been transcoded. The shared index and metadata of the views are
+            deleted once all views have been transcoded.
+
+    Returns:
+        The videos that were written.
+    """
+    outputs = {raw_file: os.path.splitext(raw_file)[0] + ".mp4" for raw_file in raw_files}
+    context = multiprocessing.get_context("spawn")
+    written = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(transcode, raw_file, output, None, None, encoder_settings, fill_missing_frames):
+                   raw_file for raw_file, output in outputs.items()}
+        for future in as_completed(futures):
+            raw_file = futures[future]
+            try:
+                frames = future.result()
+            except Exception as e:
+                logger.error(f"Could not transcode {raw_file}: {e}")
+                continue
+            logger.info(f"Transcoded {raw_file} to {outputs[raw_file]} ({frames} frames).")
+            written.append(outputs[raw_file])
+            if delete:
+                os.remove(raw_file)
+
+    if delete:
+        for shared_file in {file_of(raw_file) for raw_file in raw_files
+                            for file_of in (recording_index_file, raw_metadata_file)}:
+            if os.path.exists(shared_file) and not any(os.path.exists(raw_file) for raw_file in raw_files
+                                                       if shared_file in (recording_index_file(raw_file),
+                                                                          raw_metadata_file(raw_file))):
+                os.remove(shared_file)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("raw_files", nargs="+", type=str)
+    parser.add_argument("--workers", type=int, default=None, help="Defaults to the number of cores.")
+    parser.add_argument("--fill-missing-frames", action="store_true",
+                        help="Repeat the previous frame for missed frames, for a constant frame rate.")
+    parser.add_argument("--delete", action="store_true", help="Delete the raw files once they have been transcoded.")
+    parser.add_argument("--ffmpeg", action="store_true", help="Encode with FFmpeg (H.264) instead of OpenCV.")
+    args = parser.parse_args()
+
+    settings = EncoderSettings(EncoderBackend.FFMPEG) if args.ffmpeg else None
+    transcode_all(args.raw_files, args.workers, settings, args.fill_missing_frames, args.delete)
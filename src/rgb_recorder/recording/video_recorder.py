@@ -1,17 +1,204 @@
+import json
 import multiprocessing
 import os
+import queue
+import threading
 import time
 from multiprocessing import Process
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
 
-import cv2
+import numpy as np
 from loguru import logger
 
+from rgb_recorder.recording.channels import ZedChannel
+from rgb_recorder.recording.encoders import EncoderSettings, VideoEncoder, create_encoder, encoder_input_format
+from rgb_recorder.recording.frame_index import FrameIndexWriter, index_filename
+from rgb_recorder.recording.pixel_formats import PixelFormat, convert, image_shape
+from rgb_recorder.recording.quality_control import (QualityController, QualityLevel, quality_ladder,
+                                                    segment_video_path)
+from rgb_recorder.recording.raw_recorder import RawViewWriter
 from rgb_recorder.recording.zed_multiprocessing import ZedReceiver
 
 
+class _ViewEncoder(threading.Thread):
+    """Converts and encodes the frames of one view on its own thread. OpenCV and the encoders release the GIL, so the
+    views are encoded in parallel, while the receive loop only copies frames.
+
+    Frames are handed over in a small pool of preallocated buffers: the receive loop acquires a free buffer, copies a
+    frame into it and submits it, and the buffer is freed again once it has been encoded. When the encoder falls
+    behind, acquire_buffer() blocks and the receive loop misses frames, instead of the queue growing without bound.
+
+    Frames are only converted if the encoder does not take their pixel format, e.g. RGB frames for OpenCV. Otherwise
+    the buffers are encoded as they are, and the last one is kept to repeat it for missed frames."""
+
+    def __init__(self, encoder: VideoEncoder, queue_size: int, pixel_format: PixelFormat, shape: Tuple[int, ...],
+                 encoder_pixel_format: PixelFormat, encoder_shape: Tuple[int, ...]):
+        super().__init__(daemon=True)
+        self._encoder = encoder
+        self._pixel_format = pixel_format
+        self._encoder_pixel_format = encoder_pixel_format
+        self._frames: queue.Queue = queue.Queue(maxsize=queue_size)
+        # Besides the buffers that fit in the queue, one for the frame that is being encoded and, without conversion,
+        # one for the previous frame.
+        self._free_buffers: queue.Queue = queue.Queue()
+        for _ in range(queue_size + (1 if self._converts else 2)):
+            self._free_buffers.put(np.empty(shape, dtype=np.uint8))
+        self._converted = np.empty(encoder_shape, dtype=np.uint8) if self._converts else None
+        # The last encoded frame.
+        self._previous: Optional[np.ndarray] = None
+        # The smoothed time it takes to encode a frame, in seconds.
+        self.encode_time = 0.0
+        self.error: Optional[Exception] = None
+
+    @property
+    def _converts(self) -> bool:
+        return self._pixel_format != self._encoder_pixel_format
+
+    @property
+    def queue_fill(self) -> float:
+        """How full the queue of frames is, from 0 to 1."""
+        return self._frames.qsize() / self._frames.maxsize
+
+    def acquire_buffer(self) -> np.ndarray:
+        while True:
+            if self.error is not None:
+                raise RuntimeError(f"Encoding failed: {self.error}") from self.error
+            try:
+                return self._free_buffers.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def submit(self, image: np.ndarray, fill_frames: int = 0) -> None:
+        """Encode image, which must have been acquired with acquire_buffer(), after repeating the previous frame
+        fill_frames times."""
+        self._frames.put((image, fill_frames))
+
+    def run(self) -> None:
+        try:
+            while True:
+                item = self._frames.get()
+                if item is None:
+                    return
+                image, fill_frames = item
+                start_time = time.perf_counter()
+                for _ in range(fill_frames):
+                    self._encoder.write(self._previous)
+                if self._converts:
+                    self._previous = convert(image, self._pixel_format, self._encoder_pixel_format,
+                                             dst=self._converted)
+                    self._free_buffers.put(image)
+                    self._encoder.write(self._previous)
+                else:
+                    self._encoder.write(image)
+                    if self._previous is not None:
+                        self._free_buffers.put(self._previous)
+                    self._previous = image
+                frame_time = (time.perf_counter() - start_time) / (fill_frames + 1)
+                self.encode_time += 0.1 * (frame_time - self.encode_time)
+        except Exception as e:
+            logger.error(f"Error while encoding: {e}")
+            self.error = e
+
+    def close(self) -> None:
+        """Encode the remaining frames and release the encoder."""
+        if self.error is None:
+            self._frames.put(None)
+            self.join()
+        self._encoder.release()
+
+
+class _EncodedSegment:
+    """A segment of a recording that is encoded while recording: a video per view, encoded by a _ViewEncoder each,
+    and a shared frame index."""
+
+    def __init__(self, video_path: str, fps: float, resolution: Tuple[int, int], settings: EncoderSettings,
+                 queue_size: int, pixel_format: PixelFormat, shape: Tuple[int, ...]):
+        self.video_path = video_path
+        self.frame_period = 1 / fps
+        width, height = resolution
+        input_format = encoder_input_format(pixel_format, settings)
+        if input_format != pixel_format:
+            logger.info(f"Converting {pixel_format.value} frames to {input_format.value} for the encoder.")
+        self.encoders = {
+            channel: _ViewEncoder(create_encoder(video_path.replace(".mp4", f"{suffix}.mp4"), fps, width, height,
+                                                 settings, input_format),
+                                  queue_size, pixel_format, shape, input_format,
+                                  image_shape(input_format, width, height))
+            for channel, suffix in [(ZedChannel.RGB_LEFT, "_left"), (ZedChannel.RGB_RIGHT, "_right")]}
+        for encoder in self.encoders.values():
+            encoder.start()
+        # Both views are written frame by frame, so they share a single index.
+        self.frame_index = FrameIndexWriter(index_filename(video_path))
+
+    @property
+    def queue_fill(self) -> float:
+        return max(encoder.queue_fill for encoder in self.encoders.values())
+
+    @property
+    def load(self) -> float:
+        """The encode time per frame of the slowest view, relative to the frame period."""
+        return max(encoder.encode_time for encoder in self.encoders.values()) / self.frame_period
+
+    def acquire_buffers(self) -> Dict[ZedChannel, np.ndarray]:
+        return {channel: encoder.acquire_buffer() for channel, encoder in self.encoders.items()}
+
+    def submit(self, buffers: Dict[ZedChannel, np.ndarray], timestamp: float, fill_timestamps: List[float]) -> None:
+        """Encode the views of a frame, after repeating the previous frame for every timestamp of fill_timestamps."""
+        if self.frame_index.frames_written == 0:
+            fill_timestamps = []  # There is no previous frame in this segment.
+        # Filled frames get the timestamps at which the missed frames were expected.
+        for fill_timestamp in fill_timestamps:
+            self.frame_index.append(int(fill_timestamp * 1e9))
+        for channel, encoder in self.encoders.items():
+            encoder.submit(buffers[channel], len(fill_timestamps))
+        self.frame_index.append(int(timestamp * 1e9))
+
+    def close(self) -> None:
+        """Encode the remaining frames and close the videos."""
+        for encoder in self.encoders.values():
+            encoder.close()
+        self.frame_index.close()
+
+
+class _RawSegment:
+    """A segment of a recording that is spilled to raw files (see raw_recorder.py), when encoding cannot keep up. The
+    frames are copied straight into the files. Gaps are not filled: transcode.py can fill them when it encodes the
+    segment afterwards."""
+
+    queue_fill = 0.0
+    load = 0.0
+
+    def __init__(self, video_path: str, fps: float, pixel_format: PixelFormat, shape: Tuple[int, ...],
+                 max_duration: float):
+        self.video_path = video_path
+        # Not preallocated: reserving minutes of frames would hold up the recorder right when it is behind.
+        self.writer = RawViewWriter(video_path, shape, pixel_format, fps, max_duration, allocate=False)
+
+    @property
+    def full(self) -> bool:
+        return self.writer.full
+
+    def acquire_buffers(self) -> Dict[ZedChannel, np.ndarray]:
+        return self.writer.next_frames()
+
+    def submit(self, buffers: Dict[ZedChannel, np.ndarray], timestamp: float, fill_timestamps: List[float]) -> None:
+        self.writer.commit(timestamp)
+
+    def close(self) -> None:
+        self.writer.close()
+
+
 class MultiprocessVideoRecorder(Process):
-    """Based on airo-mono example: https://github.com/airo-ugent/airo-mono/blob/main/airo-camera-toolkit/airo_camera_toolkit/cameras/multiprocess/multiprocess_video_recorder.py"""
+    """Based on airo-mono example: https://github.com/airo-ugent/airo-mono/blob/main/airo-camera-toolkit/airo_camera_toolkit/cameras/multiprocess/multiprocess_video_recorder.py
+
+    With adaptive_quality, the recorder steps down its quality ladder (see quality_control.py) when it cannot keep up,
+    instead of missing frames, and back up when the load drops. The ladder has cheaper levels for the FFmpeg backend
+    only, and ends with a raw spill if raw_spill is set. Every switch starts a new segment of the recording:
+    color.mp4 is followed by color_001.mp4, color_002.mp4 and so on, or by the raw files of a raw spill, e.g.
+    color_002_left.npy, which can be encoded with transcode.py. The switches are logged in color_session.json, with the
+    number of frames that every segment missed and filled. A raw spill holds at most max_spill_duration seconds: when
+    it is full, the raw spill is no longer used, and the recorder continues at the cheapest encoded level, missing
+    frames if it cannot keep up."""
 
     def __init__(
             self,
@@ -19,80 +206,145 @@ class MultiprocessVideoRecorder(Process):
             video_path: str,
             fill_missing_frames: bool = True,
             multi_recorder_barrier: Optional[multiprocessing.Barrier] = None,
+            encoder_settings: Optional[EncoderSettings] = None,
+            encoder_queue_size: int = 4,
+            adaptive_quality: bool = False,
+            raw_spill: bool = False,
+            max_spill_duration: float = 60.0,
     ):
         super().__init__(daemon=True)
         self._shared_memory_namespace = shared_memory_namespace
         self.shutdown_event = multiprocessing.Event()
+        # Repeat the previous frame for missed frames, for a constant frame rate. Otherwise, gaps are only recorded in
+        # the frame index, which has the real capture time of every frame, and can be filled offline with
+        # postprocess.py. This saves encoding work exactly when the recorder is falling behind.
         self.fill_missing_frames = fill_missing_frames
         self._multi_recorder_barrier = multi_recorder_barrier
+        self._encoder_settings = encoder_settings if encoder_settings is not None else EncoderSettings(fourcc="mp4v")
+        # The number of frames per view that can wait for their encoder.
+        self._encoder_queue_size = encoder_queue_size
+        # A raw spill takes gigabytes per minute, so it is only a level of the ladder on request. Without it, the
+        # ladder of the OpenCV backend has a single level, so the quality is fixed.
+        self._quality_ladder: List[QualityLevel] = quality_ladder(self._encoder_settings, raw_spill) \
+            if adaptive_quality else [QualityLevel("full", self._encoder_settings)]
+        # The maximum length of a raw spill, in seconds, which bounds the disk space that it takes.
+        self._max_spill_duration = max_spill_duration
 
-        self._video_path_left = video_path.replace(".mp4", "_left.mp4")
-        self._video_path_right = video_path.replace(".mp4", "_right.mp4")
+        self._video_path = video_path
+        self._session_path = video_path.replace(".mp4", "_session.json")
 
     def start(self) -> None:
         super().start()
 
+    def _open_segment(self, number: int, level: QualityLevel, receiver: ZedReceiver,
+                      shape: Tuple[int, ...]) -> Union[_EncodedSegment, _RawSegment]:
+        video_path = segment_video_path(self._video_path, number)
+        if level.raw:
+            logger.info(f"Spilling raw frames to {video_path.replace('.mp4', '_[left,right].npy')}")
+            return _RawSegment(video_path, receiver.fps, receiver.pixel_format, shape, self._max_spill_duration)
+        logger.info(f"Recording videos to {video_path.replace('.mp4', '_[left,right].mp4')} ({level.name})")
+        return _EncodedSegment(video_path, receiver.fps, receiver.resolution, level.encoder_settings,
+                               self._encoder_queue_size, receiver.pixel_format, shape)
+
+    def _write_session(self, session: dict) -> None:
+        with open(self._session_path, "w") as f:
+            json.dump(session, f, indent=2)
+
     def run(self) -> None:
         if self._multi_recorder_barrier is not None:
             logger.info("Waiting for barrier")
             self._multi_recorder_barrier.wait()
             logger.info("Barrier released")
 
-        os.makedirs(os.path.dirname(self._video_path_left), exist_ok=False)
+        os.makedirs(os.path.dirname(self._video_path), exist_ok=False)
 
-        receiver = ZedReceiver(self._shared_memory_namespace)
-        camera_fps = receiver.fps_shm_array[0]
+        # The views are retrieved in the pixel format of the publisher, and only converted if the encoder needs it.
+        receiver = ZedReceiver(self._shared_memory_namespace, name="video_recorder", pixel_format=None)
+        camera_fps = receiver.fps
         camera_period = 1 / camera_fps
+        shape, _ = receiver.channel_layout(ZedChannel.RGB_LEFT)
 
-        height, width, _ = receiver.rgb_left_shm_array.shape
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video_writer_left = cv2.VideoWriter(self._video_path_left, fourcc, camera_fps, (width, height))
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video_writer_right = cv2.VideoWriter(self._video_path_right, fourcc, camera_fps, (width, height))
-
-        logger.info(f"Recording videos to {self._video_path_left} and {self._video_path_right}")
-
-        image_previous_left, image_previous_right = receiver.get_rgb_image_as_int()
-        timestamp_prev_frame = receiver.get_current_timestamp()
-        video_writer_left.write(cv2.cvtColor(image_previous_left, cv2.COLOR_RGB2BGR))
-        video_writer_right.write(cv2.cvtColor(image_previous_right, cv2.COLOR_RGB2BGR))
-        n_consecutive_frames_dropped = 0
-
-        while not self.shutdown_event.is_set():
-            timestamp_receiver = receiver.get_current_timestamp()
-
-            if timestamp_receiver <= timestamp_prev_frame:
-                time.sleep(0.00001)  # Prevent busy waiting
-                continue
-
-            # New frame arrived
-            image_rgb_new_left, image_rgb_new_right = receiver._retrieve_rgb_image_as_int()
+        controller = QualityController(len(self._quality_ladder), camera_period) \
+            if len(self._quality_ladder) > 1 else None
+        session = {"camera": self._shared_memory_namespace, "fps": camera_fps, "resolution": list(receiver.resolution),
+                   "pixel_format": receiver.pixel_format.value,
+                   "quality_ladder": [level.to_dict() for level in self._quality_ladder],
+                   "segments": [{"video_path": self._video_path, "level": 0,
+                                 "level_name": self._quality_ladder[0].name, "start_time": time.time(),
+                                 "reason": "start", "missed_frames": 0, "filled_frames": 0}]}
+        if controller is not None:
+            self._write_session(session)
 
-            timestamp_difference = timestamp_receiver - timestamp_prev_frame
-            missed_frames = int(timestamp_difference / camera_period) - 1
+        segment = self._open_segment(0, self._quality_ladder[0], receiver, shape)
+        # The threads that finish the previous segments, so that the recorder does not wait for their encoders.
+        closing_threads: List[threading.Thread] = []
 
-            if missed_frames > 0:
-                logger.warning(f"Missed {missed_frames} frames (fill_missing_frames = {self.fill_missing_frames}).")
+        # None until the first frame: wait_for_frame() then waits for a frame that is newer than the receiver.
+        timestamp_prev_frame = None
+        try:
+            while not self.shutdown_event.is_set():
+                # Sleep until the publisher notifies us of a new frame. The timeout lets us check the shutdown event.
+                if not receiver.wait_for_frame(timestamp_prev_frame, timeout=0.1):
+                    continue
 
-                if self.fill_missing_frames:
-                    image_fill_left = cv2.cvtColor(image_previous_left, cv2.COLOR_RGB2BGR)
-                    image_fill_right = cv2.cvtColor(image_previous_right, cv2.COLOR_RGB2BGR)
-                    for _ in range(missed_frames):
-                        video_writer_left.write(image_fill_left)
-                        video_writer_right.write(image_fill_right)
-                        n_consecutive_frames_dropped += 1
+                switch = None
+                if isinstance(segment, _RawSegment) and segment.full:
+                    # The ladder always starts with encoded levels, so this switches to the cheapest one.
+                    switch = controller.retire_cheapest_level(time.time(), "the raw spill is full")
+                if switch is None:
+                    # New frame arrived. Copy it straight into the buffers of the encoder threads or the raw files.
+                    buffers = segment.acquire_buffers()
+                    receiver.retrieve_channels(list(buffers), out=buffers)
+                    # An even newer frame may have been published since we checked, so use the timestamp of what we
+                    # copied.
+                    timestamp_receiver = receiver.retrieved_timestamp
 
-            timestamp_prev_frame = timestamp_receiver
-            image_previous_left = image_rgb_new_left
-            image_previous_right = image_rgb_new_right
+                    missed_frames = 0
+                    fill_timestamps = []
+                    if timestamp_prev_frame is not None:
+                        missed_frames = int((timestamp_receiver - timestamp_prev_frame) / camera_period) - 1
+                        if missed_frames > 0:
+                            logger.warning(f"Missed {missed_frames} frames "
+                                           f"(fill_missing_frames = {self.fill_missing_frames}).")
+                            # A raw spill leaves the gaps to transcode.py.
+                            if self.fill_missing_frames and not isinstance(segment, _RawSegment):
+                                fill_timestamps = [timestamp_prev_frame + (i + 1) * camera_period
+                                                   for i in range(missed_frames)]
 
-            image_left = cv2.cvtColor(image_rgb_new_left, cv2.COLOR_RGB2BGR)
-            image_right = cv2.cvtColor(image_rgb_new_right, cv2.COLOR_RGB2BGR)
+                    segment.submit(buffers, timestamp_receiver, fill_timestamps)
+                    timestamp_prev_frame = timestamp_receiver
+                    session["segments"][-1]["missed_frames"] += max(missed_frames, 0)
+                    session["segments"][-1]["filled_frames"] += len(fill_timestamps)
+                    if controller is not None:
+                        switch = controller.update(timestamp_receiver, missed_frames, segment.queue_fill, segment.load)
 
-            video_writer_left.write(image_left)
-            video_writer_right.write(image_right)
+                if switch is not None:
+                    level, reason = switch
+                    number = len(session["segments"])
+                    logger.warning(f"Switching from {session['segments'][-1]['level_name']} to "
+                                   f"{self._quality_ladder[level].name}: {reason}.")
+                    closing_thread = threading.Thread(target=segment.close)
+                    closing_thread.start()
+                    closing_threads.append(closing_thread)
+                    segment = self._open_segment(number, self._quality_ladder[level], receiver, shape)
+                    session["segments"].append({"video_path": segment_video_path(self._video_path, number),
+                                                "level": level, "level_name": self._quality_ladder[level].name,
+                                                "start_time": time.time(), "reason": reason, "missed_frames": 0,
+                                                "filled_frames": 0})
+                    self._write_session(session)
+        finally:
+            logger.info("Video recorder has detected shutdown event. Releasing the current segment.")
+            segment.close()
+            for closing_thread in closing_threads:
+                closing_thread.join()
+            if controller is not None:
+                self._write_session(session)
 
-        logger.info("Video recorder has detected shutdown event. Releasing video_writer_[left,right].")
-        video_writer_left.release()
-        video_writer_right.release()
-        logger.info(f"Videos saved to {self._video_path_left} and {self._video_path_right}")
+        if receiver.segment.reader_index is not None:
+            reader = receiver.segment.readers[receiver.segment.reader_index]
+            logger.info(f"Recorded {reader['delivered']} frames from the camera, {reader['overwritten']} frames were "
+                        f"overwritten before they could be recorded.")
+        if len(session["segments"]) > 1:
+            logger.info(f"Recording saved in {len(session['segments'])} segments, see {self._session_path}")
+        else:
+            logger.info(f"Videos saved to {self._video_path.replace('.mp4', '_[left,right].mp4')}")
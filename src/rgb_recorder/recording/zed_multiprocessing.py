@@ -1,35 +1,50 @@
 """This file is a slightly modified copy of airo-camera-toolkit's multiprocess_rgb_camera.
-It explicitly checks whether a Zed camera was instantiated and supports reading either the left or the right view
-of the camera."""
+It explicitly checks whether a Zed camera (or one of the simulated cameras of simulated_cameras.py) was instantiated
+and supports reading either the left or the right view of the camera. Besides the RGB images, it can also publish
+depth, confidence and point cloud channels. The ZED SDK is optional: without it, only simulated cameras can be
+published.
 
+The views are published in a configurable pixel format (see pixel_formats.py), and every receiver asks for the format
+it needs. When the formats match, frames are copied without any color conversion."""
+
+import contextlib
 import multiprocessing
-from multiprocessing import resource_tracker
 import time
-from multiprocessing import shared_memory
-from typing import Optional, Tuple
+from typing import Dict, Iterator, Optional, Sequence, Tuple, Union
 
 import numpy as np
-from airo_camera_toolkit.cameras.multiprocess.multiprocess_rgb_camera import shared_memory_block_like
-from airo_camera_toolkit.cameras.zed.zed import Zed
 from airo_camera_toolkit.interfaces import RGBCamera, StereoRGBDCamera
 from airo_camera_toolkit.utils.image_converter import ImageConverter
 from airo_typing import CameraResolutionType, NumpyFloatImageType, NumpyIntImageType, CameraIntrinsicsMatrixType
 from loguru import logger
 
-_RGB_LEFT_SHM_NAME = "rgb_left"
-_RGB_RIGHT_SHM_NAME = "rgb_right"
-_RGB_SHAPE_SHM_NAME = "rgb_shape"
-_TIMESTAMP_SHM_NAME = "timestamp"
-_INTRINSICS_SHM_NAME = "intrinsics"
-_FPS_SHM_NAME = "fps"
-# We use this flag as a lock (we can't use built-in events/locks because they need to be passed explicitly to the receivers.)
-_WRITE_LOCK_SHM_NAME = "write_lock"  # Boolean: only one writer allowed at a time.
-_READ_LOCK_SHM_NAME = "read_lock"  # int: number of readers currently reading.
+from rgb_recorder.recording.camera_segment import CameraSegment, segment_name
+from rgb_recorder.recording.channels import (CHANNEL_LAYOUTS, DEFAULT_CHANNELS, VIEW_CHANNELS, ZedChannel,
+                                             channel_shape, requires_depth)
+from rgb_recorder.recording.frame_notifier import MAX_WAIT, FrameNotifier, FrameSubscription
+from rgb_recorder.recording.frame_ring import BorrowedFrame
+from rgb_recorder.recording.pixel_formats import PixelFormat, SDK_PIXEL_FORMAT, convert, image_resolution, image_shape
+from rgb_recorder.recording.simulated_cameras import SimulatedCamera
+
+try:
+    import pyzed.sl as sl
+    from airo_camera_toolkit.cameras.zed.zed import Zed
+except ImportError:
+    sl = None
+    Zed = None
+
+_VIEW_CHANNELS = {StereoRGBDCamera.LEFT_RGB: ZedChannel.RGB_LEFT, StereoRGBDCamera.RIGHT_RGB: ZedChannel.RGB_RIGHT}
+if sl is not None:
+    _SDK_VIEWS = {ZedChannel.RGB_LEFT: sl.VIEW.LEFT, ZedChannel.RGB_RIGHT: sl.VIEW.RIGHT}
+    _SDK_MEASURES = {ZedChannel.DEPTH: sl.MEASURE.DEPTH, ZedChannel.DEPTH_MM: sl.MEASURE.DEPTH_U16_MM,
+                     ZedChannel.CONFIDENCE: sl.MEASURE.CONFIDENCE, ZedChannel.POINT_CLOUD: sl.MEASURE.XYZ}
+
+_DEFAULT_NUM_SLOTS = 4
 
 
 class ZedPublisher(multiprocessing.context.SpawnProcess):
-    """Publishes the data of a camera that implements the RGBCamera interface to shared memory blocks.
-    Shared memory blocks can then be accessed in other processes using their names,
+    """Publishes the data of a camera that implements the RGBCamera interface to a shared memory segment.
+    The segment can then be accessed in other processes using its name,
     cf. https://docs.python.org/3/library/multiprocessing.shared_memory.html#module-multiprocessing.shared_memory
 
     The Receiver class is a convenient way of doing so and is the intended way of using this class.
@@ -41,13 +56,24 @@ class ZedPublisher(multiprocessing.context.SpawnProcess):
             camera_kwargs: dict = {},
             shared_memory_namespace: str = "camera",
             log_debug: bool = False,
+            num_slots: int = _DEFAULT_NUM_SLOTS,
+            channels: Sequence[ZedChannel] = DEFAULT_CHANNELS,
+            pixel_format: PixelFormat = PixelFormat.RGB,
     ):
         """Instantiates the publisher. Note that the publisher (and its process) will not start until start() is called.
 
         Args:
-            camera_cls (type): The class e.g. Zed that this publisher will instantiate.
+            camera_cls (type): The class that this publisher will instantiate: Zed, or a SimulatedCamera such as
+                SyntheticCamera or ReplayCamera.
             camera_kwargs (dict, optional): The kwargs that will be passed to the camera_cls constructor.
-            shared_memory_namespace (str, optional): The string that will be used to prefix the shared memory blocks that this class will create.
+            shared_memory_namespace (str, optional): The string that will be used to prefix the name of the shared memory segment that this class will create.
+            num_slots (int, optional): The number of frames in the ring buffer. A receiver that takes longer than
+                num_slots - 1 frame periods to copy a frame has to retry.
+            channels (Sequence[ZedChannel], optional): The channels to publish, each in its own slots. For depth,
+                confidence or point cloud channels, the camera must be instantiated with a depth mode other than NONE.
+            pixel_format (PixelFormat, optional): The pixel format of the views in shared memory. Pick the format of
+                the main consumer, e.g. BGR for the video recorders: the SDK's BGRA images are converted once, straight
+                into the slot, and receivers that ask for the same format copy them without converting.
         """
 
         # context = multiprocessing.get_context("spawn")  # Default "fork" leads to CUDA issues.
@@ -57,98 +83,101 @@ class ZedPublisher(multiprocessing.context.SpawnProcess):
         self._shared_memory_namespace = shared_memory_namespace
         self._camera_cls = camera_cls
         self._camera_kwargs = camera_kwargs
-        self._camera: Zed | None = None
+        self._camera: Optional[RGBCamera] = None
         self.log_debug = log_debug
+        self.num_slots = num_slots
+        self.channels = list(channels)
+        self.pixel_format = PixelFormat(pixel_format)
         self.running_event = multiprocessing.Event()
         self.shutdown_event = multiprocessing.Event()
+        # Reports an error that stops the process before it has published a frame, so that start() does not block.
+        self._error_queue = multiprocessing.SimpleQueue()
 
-        # Declare these here so mypy doesn't complain.
-        self.rgb_left_shm: Optional[shared_memory.SharedMemory] = None
-        self.rgb_right_shm: Optional[shared_memory.SharedMemory] = None
-        self.rgb_shape_shm: Optional[shared_memory.SharedMemory] = None
-        self.timestamp_shm: Optional[shared_memory.SharedMemory] = None
-        self.intrinsics_shm: Optional[shared_memory.SharedMemory] = None
-        self.fps_shm: Optional[shared_memory.SharedMemory] = None
-        self.write_lock_shm: Optional[shared_memory.SharedMemory] = None
-        self.read_lock_shm: Optional[shared_memory.SharedMemory] = None
+        # Declare this here so mypy doesn't complain.
+        self.segment: Optional[CameraSegment] = None
+        self.notifier: Optional[FrameNotifier] = None
 
         self.fps = None  # set in setup
         self.camera_period = None  # set in setup
 
     def start(self) -> None:
-        """Starts the process. The process will not start until this method is called."""
+        """Starts the process. The process will not start until this method is called.
+
+        Blocks until the first frame has been published.
+
+        Raises:
+            RuntimeError: If the process failed before publishing a frame, e.g. because the camera could not be
+                instantiated or cannot publish the channels.
+        """
         super().start()
-        self.running_event.wait()  # Block until the publisher has started
+        while not self.running_event.wait(0.1):  # Block until the publisher has started
+            if not self._error_queue.empty():
+                raise RuntimeError(f"{self.__class__.__name__} failed to start: {self._error_queue.get()}")
+            if not self.is_alive():
+                raise RuntimeError(f"{self.__class__.__name__} exited with code {self.exitcode} before it started.")
 
     def _setup(self) -> None:
         """Note: to be able to retrieve camera image from the Publisher process, the camera must be instantiated in the
         Publisher process. For this reason, we do not instantiate the camera in __init__ but, here instead.
 
-        We also create the shared memory blocks here, so that their lifetime is bound to the lifetime of the Publisher
+        We also create the shared memory segment here, so that its lifetime is bound to the lifetime of the Publisher
         process. Usually shared memory may outlive its creator process, but as the Publisher is the only process that
-        writes to the shared memory blocks, we want to make sure that they are deleted when the Publisher process is
-        terminated. This also frees up the names of the shared memory blocks so that they can be reused.
-
-
-        Five SharedMemory blocks are created, each block is prefixed with the namespace of the publisher. Three of these
-        are only written once, the other two are written continuously.
-
-        Constant blocks:
-        * intrinsics: the intrinsics matrix of the camera
-        * rgb_shape: the shape that rgb image array should be
-        * fps: the fps of the camera
-
-        Blocks that are written continuously:
-        * rgb: the most recently retrieved image
-        * timestamp: the timestamp of that image
-
+        writes to the segment, we want to make sure that it is deleted when the Publisher process is terminated. This
+        also frees up the name of the segment so that it can be reused.
 
-        To simplify access, we create numpy arrays that are backed by the shared memory blocks for the rgb image and
-        the intrinsics matrix.
+        A single segment is created, named after the namespace of the publisher (see camera_segment.py). Its header
+        holds the constant data (intrinsics, fps and the shape of the images) and the state of the ring buffer of
+        num_slots frames (see frame_ring.py). It is followed by the slots of every published channel.
         """
 
         # Instantiating a camera.
         logger.info(f"Instantiating a {self._camera_cls.__name__} camera.")
         self._camera = self._camera_cls(**self._camera_kwargs)
-        assert isinstance(self._camera, Zed)  # Check whether user passed a valid camera class
+        # Check whether user passed a valid camera class.
+        self._is_zed = Zed is not None and isinstance(self._camera, Zed)
+        assert self._is_zed or isinstance(self._camera, SimulatedCamera)
         logger.info(f"Successfully instantiated a {self._camera_cls.__name__} camera.")
 
-        rgb_left_name = f"{self._shared_memory_namespace}_{_RGB_LEFT_SHM_NAME}"
-        rgb_right_name = f"{self._shared_memory_namespace}_{_RGB_RIGHT_SHM_NAME}"
-        rgb_shape_name = f"{self._shared_memory_namespace}_{_RGB_SHAPE_SHM_NAME}"
-        timestamp_name = f"{self._shared_memory_namespace}_{_TIMESTAMP_SHM_NAME}"
-        intrinsics_name = f"{self._shared_memory_namespace}_{_INTRINSICS_SHM_NAME}"
-        fps_name = f"{self._shared_memory_namespace}_{_FPS_SHM_NAME}"
-        write_lock_name = f"{self._shared_memory_namespace}_{_WRITE_LOCK_SHM_NAME}"
-        read_lock_name = f"{self._shared_memory_namespace}_{_READ_LOCK_SHM_NAME}"
-
-        # Get the example arrays (this is the easiest way to initialize the shared memory blocks with the correct size).
+        if self._is_zed:
+            depth_mode = self._camera.camera.get_init_parameters().depth_mode
+            if requires_depth(self.channels) and depth_mode == sl.DEPTH_MODE.NONE:
+                raise ValueError(f"Publishing {[channel.value for channel in self.channels]} requires depth, but the "
+                                 f"camera was opened with depth_mode=NONE.")
+        else:
+            unsupported = [channel.value for channel in self.channels
+                           if channel not in self._camera.supported_channels]
+            if unsupported:
+                raise ValueError(f"A {self._camera_cls.__name__} cannot publish {unsupported}.")
+
+        # Get an example image to determine the size of the frame slots.
         rgb = self._camera.get_rgb_image_as_int()  # We pass uint8 images as they consume 4x less memory
-        rgb_shape = np.array(rgb.shape)
         logger.info(f"Successfully retrieved an image of shape {rgb.shape} from the camera.")
+        height, width, _ = rgb.shape
 
-        timestamp = np.array([time.time()])
         intrinsics = self._camera.intrinsics_matrix()
 
         self.fps = self._camera.fps
-        fps = np.array([self.fps], dtype=np.float64)
         self.camera_period = 1 / self.fps
 
-        write_lock = np.array([False], dtype=np.bool_)
-        read_lock = np.array([0], dtype=np.int_)
-
-        # Create the shared memory blocks and numpy arrays that are backed by them.
-        logger.info("Creating RGB shared memory blocks.")
-        self.rgb_left_shm, self.rgb_left_shm_array = shared_memory_block_like(rgb, rgb_left_name)
-        self.rgb_right_shm, self.rgb_right_shm_array = shared_memory_block_like(rgb, rgb_right_name)
-        self.rgb_shape_shm, self.rgb_shape_shm_array = shared_memory_block_like(rgb_shape, rgb_shape_name)
-        self.timestamp_shm, self.timestamp_shm_array = shared_memory_block_like(timestamp, timestamp_name)
-        self.intrinsics_shm, self.intrinsics_shm_array = shared_memory_block_like(intrinsics, intrinsics_name)
-        self.fps_shm, self.fps_shm_array = shared_memory_block_like(fps, fps_name)
-        self.write_lock_shm, self.write_lock_shm_array = shared_memory_block_like(write_lock, write_lock_name)
-        self.read_lock_shm, self.read_lock_shm_array = shared_memory_block_like(read_lock, read_lock_name)
-
-        logger.info("Created RGB shared memory blocks.")
+        logger.info("Creating RGB shared memory segment.")
+        self.segment = CameraSegment.create(segment_name(self._shared_memory_namespace),
+                                            {channel.value: (channel_shape(channel, width, height, self.pixel_format),
+                                                             CHANNEL_LAYOUTS[channel][1])
+                                             for channel in self.channels},
+                                            self.num_slots, self.fps, intrinsics,
+                                            {channel.value: self.pixel_format.value for channel in self.channels
+                                             if channel in VIEW_CHANNELS})
+        self.frame_ring = self.segment.frame_ring
+        self.notifier = FrameNotifier(self.segment.shm.name)
+        logger.info("Created RGB shared memory segment.")
+
+        # The SDK retrieves into these matrices, which are allocated once and reused for every frame.
+        self._sdk_images = {channel: sl.Mat() for channel in self.channels} if self._is_zed else {}
+        # Simulated cameras produce views in their native pixel format, which are converted through this buffer for
+        # other pixel formats.
+        self._native_image = None
+        if not self._is_zed and self._camera.native_pixel_format != self.pixel_format:
+            self._native_image = np.empty(image_shape(self._camera.native_pixel_format, width, height), dtype=np.uint8)
 
     def stop(self) -> None:
         self.shutdown_event.set()
@@ -156,48 +185,66 @@ class ZedPublisher(multiprocessing.context.SpawnProcess):
     def run(self) -> None:
         """Main loop of the process, runs until the process is terminated.
 
-        Each iteration a new image is retrieved from the camera and copied to the shared memory block.
-
-        Note that we update timestamp after image data has been copied. This ensure that if the receiver sees a new
-        timestamp, it will also see the new image data. Theoretically it is possble that the recevier reads new image
-        data, but the timestamp is still old. I'm not sure whether this is a problem in practice.
-
-        # TODO: invesitgate whether a Lock is required when copying the image data to the shared memory block. Also
-        whether it is possible to do this without having to spawn all processes from a single Python script (e.g. to
-        pass the Lock object).
+        Each iteration a new image is retrieved from the camera and converted straight into the next slot of the ring
+        buffer, see _retrieve_into_slot(). The publisher never waits for receivers: the sequence counter of the slot
+        tells receivers whether the slot was overwritten while they were reading it.
         """
 
         logger.info(f"{self.__class__.__name__} process started.")
-        self._setup()
-        assert isinstance(self._camera, RGBCamera)  # Just to make mypy happy, already checked in _setup()
-        logger.info(f'{self.__class__.__name__} starting to publish to "{self._shared_memory_namespace}".')
-
         try:
+            self._setup()
+            assert isinstance(self._camera, RGBCamera)  # Just to make mypy happy, already checked in _setup()
+            logger.info(f'{self.__class__.__name__} starting to publish to "{self._shared_memory_namespace}".')
+
             while not self.shutdown_event.is_set():
                 self._camera._grab_images()
 
-                # Retrieve an image from the camera
-                image_left = self._camera._retrieve_rgb_image_as_int(view=StereoRGBDCamera.LEFT_RGB)
-                image_right = self._camera._retrieve_rgb_image_as_int(view=StereoRGBDCamera.RIGHT_RGB)
-
-                # Wait to write to the shared memory block until there are no active readers (or writers).
-                # (Normally we should be the only writer though.)
-                while self.read_lock_shm_array[0] > 0 and self.write_lock_shm_array[0]:
-                    time.sleep(0.00001)
-                self.write_lock_shm_array[0] = True
-
-                self.rgb_left_shm_array[:] = image_left[:]
-                self.rgb_right_shm_array[:] = image_right[:]
-                self.timestamp_shm_array[0] = time.time()
-                self.write_lock_shm_array[0] = False
+                # Retrieve the images and measures from the camera into the next slot of the ring buffer.
+                slot = self.frame_ring.begin_write()
+                for channel in self.channels:
+                    self._retrieve_into_slot(channel, slot)
+                self.frame_ring.end_write(slot, time.time())
+                self.notifier.notify()
                 self.running_event.set()
         except Exception as e:
             logger.error(f"Error in {self.__class__.__name__}: {e}")
+            if not self.running_event.is_set():
+                self._error_queue.put(f"{type(e).__name__}: {e}")
         finally:
             self.unlink_shared_memory()
             logger.info(f"{self.__class__.__name__} process terminated.")
         self.unlink_shared_memory()
 
+    def _retrieve_into_slot(self, channel: ZedChannel, slot: int) -> None:
+        """The SDK delivers BGRA images and 4-channel point clouds in its own memory (an sl.Mat cannot wrap shared
+        memory), so the conversion to the pixel format of the segment or to XYZ writes directly into the slot. This
+        replaces the RGB array that the Zed class allocates on every retrieve, and the copy of that array into shared
+        memory. Simulated cameras write into the slot themselves."""
+        destination = self.segment.channels[channel.value][slot]
+        if not self._is_zed:
+            if channel in VIEW_CHANNELS and self._native_image is not None:
+                self._camera.retrieve_channel_into(channel, self._native_image)
+                convert(self._native_image, self._camera.native_pixel_format, self.pixel_format, dst=destination)
+            else:
+                self._camera.retrieve_channel_into(channel, destination)
+            return
+
+        image = self._sdk_images[channel]
+        if channel in _SDK_VIEWS:
+            error = self._camera.camera.retrieve_image(image, _SDK_VIEWS[channel])
+        else:
+            error = self._camera.camera.retrieve_measure(image, _SDK_MEASURES[channel])
+        if error != sl.ERROR_CODE.SUCCESS:
+            raise RuntimeError(f"Could not retrieve the {channel.value} channel: {error}")
+
+        data = image.get_data(deep_copy=False)
+        if channel in _SDK_VIEWS:
+            convert(data, SDK_PIXEL_FORMAT, self.pixel_format, dst=destination)
+        elif channel == ZedChannel.POINT_CLOUD:
+            np.copyto(destination, data[..., :3])
+        else:
+            np.copyto(destination, data)
+
     def unlink_shared_memory(self) -> None:
         """Cleanup of the SharedMemory as recommended by the docs:
         https://docs.python.org/3/library/multiprocessing.shared_memory.html
@@ -207,149 +254,149 @@ class ZedPublisher(multiprocessing.context.SpawnProcess):
 
         However, I'm not sure how essential this actually is.
         """
-        print(f"Unlinking RGB shared memory blocks of {self.__class__.__name__}.")
-
-        if self.rgb_left_shm is not None:
-            self.rgb_left_shm.close()
-            self.rgb_left_shm.unlink()
-            self.rgb_left_shm = None
-
-        if self.rgb_right_shm is not None:
-            self.rgb_right_shm.close()
-            self.rgb_right_shm.unlink()
-            self.rgb_right_shm = None
-
-        if self.rgb_shape_shm is not None:
-            self.rgb_shape_shm.close()
-            self.rgb_shape_shm.unlink()
-            self.rgb_shape_shm = None
-
-        if self.timestamp_shm is not None:
-            self.timestamp_shm.close()
-            self.timestamp_shm.unlink()
-            self.timestamp_shm = None
-
-        if self.intrinsics_shm is not None:
-            self.intrinsics_shm.close()
-            self.intrinsics_shm.unlink()
-            self.intrinsics_shm = None
-
-        if self.fps_shm is not None:
-            self.fps_shm.close()
-            self.fps_shm.unlink()
-            self.fps_shm = None
-
-        if self.write_lock_shm is not None:
-            self.write_lock_shm.close()
-            self.write_lock_shm.unlink()
-            self.write_lock_shm = None
-
-        if self.read_lock_shm is not None:
-            self.read_lock_shm.close()
-            self.read_lock_shm.unlink()
-            self.read_lock_shm = None
+        print(f"Unlinking RGB shared memory segment of {self.__class__.__name__}.")
+
+        if self.notifier is not None:
+            self.notifier.close()
+            self.notifier = None
+
+        if self.segment is not None:
+            self.frame_ring = None
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
 
     def __del__(self) -> None:
         self.unlink_shared_memory()
 
 
 class ZedReceiver(RGBCamera):
-    """Implements the RGBD camera interface for a camera that is running in a different process and shares its data using shared memory blocks.
+    """Implements the RGBD camera interface for a camera that is running in a different process and shares its data using a shared memory segment.
     To be used with the Publisher class.
     """
 
     def __init__(
         self,
         shared_memory_namespace: str,
+        notify: bool = True,
+        name: Optional[str] = None,
+        target_fps: float = 0.0,
+        pixel_format: Optional[PixelFormat] = None,
     ) -> None:
+        """Attaches to the shared memory segment of a running publisher.
+
+        Every receiver registers a subscription in the segment, which records its cursor (the last frame it retrieved)
+        and how many frames were delivered, skipped to stay at target_fps, or overwritten before it got to them. Use
+        python -m rgb_recorder.recording.monitor to watch the subscriptions of a camera.
+
+        Args:
+            shared_memory_namespace (str): The namespace that was passed to the publisher.
+            notify (bool, optional): Subscribe to notifications of new frames, so that waiting for a frame does not
+                need to poll. See frame_notifier.py.
+            name (str, optional): The name of the subscription, shown by the monitor. Defaults to the process name.
+            target_fps (float, optional): Only wait for frames at this rate, e.g. 5 for a preview of a 60 fps camera.
+                0 to wait for every frame.
+            pixel_format (PixelFormat, optional): The pixel format in which the views are retrieved. If it differs from
+                the pixel format of the publisher, every view is converted while it is retrieved. By default (None),
+                the views are retrieved as they were published, see published_pixel_format. The RGBCamera methods
+                always return RGB images.
+        """
         super().__init__()
 
         self._shared_memory_namespace = shared_memory_namespace
-        rgb_left_name = f"{self._shared_memory_namespace}_{_RGB_LEFT_SHM_NAME}"
-        rgb_right_name = f"{self._shared_memory_namespace}_{_RGB_RIGHT_SHM_NAME}"
-        rgb_shape_name = f"{self._shared_memory_namespace}_{_RGB_SHAPE_SHM_NAME}"
-        timestamp_name = f"{self._shared_memory_namespace}_{_TIMESTAMP_SHM_NAME}"
-        intrinsics_name = f"{self._shared_memory_namespace}_{_INTRINSICS_SHM_NAME}"
-        fps_name = f"{self._shared_memory_namespace}_{_FPS_SHM_NAME}"
-        write_lock_name = f"{self._shared_memory_namespace}_{_WRITE_LOCK_SHM_NAME}"
-        read_lock_name = f"{self._shared_memory_namespace}_{_READ_LOCK_SHM_NAME}"
-
-        # Attach to existing shared memory blocks. Retry a few times to give the publisher time to start up (opening
-        # connection to a camera can take a while).
-
-        self.rgb_left_shm = shared_memory.SharedMemory(name=rgb_left_name)
-        self.rgb_right_shm = shared_memory.SharedMemory(name=rgb_right_name)
-        self.rgb_shape_shm = shared_memory.SharedMemory(name=rgb_shape_name)
-        self.timestamp_shm = shared_memory.SharedMemory(name=timestamp_name)
-        self.intrinsics_shm = shared_memory.SharedMemory(name=intrinsics_name)
-        self.fps_shm = shared_memory.SharedMemory(name=fps_name)
-        self.write_lock_shm = shared_memory.SharedMemory(name=write_lock_name)
-        self.read_lock_shm = shared_memory.SharedMemory(name=read_lock_name)
 
+        # Attach to the existing shared memory segment. Its header describes everything else: the shape of the
+        # images, the intrinsics, the fps and the number of slots of the ring buffer.
+        self.segment = CameraSegment.attach(segment_name(self._shared_memory_namespace))
         logger.info(f'SharedMemory namespace "{self._shared_memory_namespace}" found.')
 
-        # Normally, we wouldn't have to do this unregistering. However, without it, the resource tracker incorrectly
-        # destroys access to the shared memory blocks when the process is terminated. This is a known 3 year old bug
-        # that hasn't been resolved yet: https://bugs.python.org/issue39959
-        # Concretely, the problem was that once any MultiprocessRGBReceiver object was destroyed, all further access to
-        # the shared memory blocks would fail with a FileNotFoundError.
-        # We also ignore mypy telling us to use .name instead of ._name, because the latter is used in the registration.
-        resource_tracker.unregister(self.rgb_left_shm._name, "shared_memory")  # type: ignore[attr-defined]
-        resource_tracker.unregister(self.rgb_right_shm._name, "shared_memory")  # type: ignore[attr-defined]
-        resource_tracker.unregister(self.rgb_shape_shm._name, "shared_memory")  # type: ignore[attr-defined]
-        resource_tracker.unregister(self.intrinsics_shm._name, "shared_memory")  # type: ignore[attr-defined]
-        resource_tracker.unregister(self.timestamp_shm._name, "shared_memory")  # type: ignore[attr-defined]
-        resource_tracker.unregister(self.fps_shm._name, "shared_memory")  # type: ignore[attr-defined]
-        resource_tracker.unregister(self.write_lock_shm._name, "shared_memory")  # type: ignore[attr-defined]
-        resource_tracker.unregister(self.read_lock_shm._name, "shared_memory")  # type: ignore[attr-defined]
-
-        # Timestamp and intrinsics are the same shape for all images, so I decided that we could hardcode their shape.
-        # However, images come in many shapes, which I also decided to pass via shared memory. (Previously, I required
-        # the image resolution to be passed to this class' constructor, but that was inconvenient to keep in sync
-        # between publisher and receiver scripts.)
-        # Create numpy arrays that are backed by the shared memory blocks
-        self.rgb_shape_shm_array: np.ndarray = np.ndarray((3,), dtype=np.int64, buffer=self.rgb_shape_shm.buf)
-        self.intrinsics_shm_array: np.ndarray = np.ndarray((3, 3), dtype=np.float64, buffer=self.intrinsics_shm.buf)
-        self.timestamp_shm_array: np.ndarray = np.ndarray((1,), dtype=np.float64, buffer=self.timestamp_shm.buf)
-        self.fps_shm_array: np.ndarray = np.ndarray((1,), dtype=np.float64, buffer=self.fps_shm.buf)
-        self.write_lock_shm_array: np.ndarray = np.ndarray((1,), dtype=np.bool_, buffer=self.write_lock_shm.buf)
-        self.read_lock_shm_array: np.ndarray = np.ndarray((1,), dtype=np.int_, buffer=self.read_lock_shm.buf)
-
-        self.fps = self.fps_shm_array[0]
-
-        # The shape of the image is not known in advance, so we need to retrieve it from the shared memory block.
-        rgb_shape = tuple(self.rgb_shape_shm_array[:])
-        self.rgb_left_shm_array: np.ndarray = np.ndarray(rgb_shape, dtype=np.uint8, buffer=self.rgb_left_shm.buf)
-        self.rgb_right_shm_array: np.ndarray = np.ndarray(rgb_shape, dtype=np.uint8, buffer=self.rgb_right_shm.buf)
-
-        # Preallocate the buffer array to avoid reallocation at each retrieve.
-        self.rgb_left_buffer_array: np.ndarray = np.ndarray(rgb_shape, dtype=np.uint8)
-        self.rgb_right_buffer_array: np.ndarray = np.ndarray(rgb_shape, dtype=np.uint8)
+        self.fps = self.segment.fps
+        self.frame_ring = self.segment.frame_ring
+        self.subscription = FrameSubscription(self.segment.shm.name) if notify else None
+        self.target_fps = target_fps
+        self.segment.claim_reader(name if name is not None else multiprocessing.current_process().name, target_fps)
+        self.channels = [ZedChannel(name) for name in self.segment.channels]
+
+        # The pixel format of the views in shared memory (RGB if the segment does not say), and the one in which they
+        # are retrieved.
+        published_formats = {PixelFormat(self.segment.pixel_formats[channel.value] or PixelFormat.RGB.value)
+                             for channel in self.channels if channel in VIEW_CHANNELS}
+        self.published_pixel_format = published_formats.pop() if published_formats else PixelFormat.RGB
+        self.pixel_format = PixelFormat(pixel_format) if pixel_format is not None else self.published_pixel_format
+
+        # Preallocate the buffer arrays to avoid reallocation at each retrieve. Views that must be converted are first
+        # copied into a staging buffer, so that the conversion does not hold up the publisher.
+        self._buffers: Dict[ZedChannel, np.ndarray] = {
+            channel: np.empty(self.channel_layout(channel)[0], dtype=self.segment.channels[channel.value].dtype)
+            for channel in self.channels}
+        self._staging_buffers: Dict[ZedChannel, np.ndarray] = {
+            channel: np.empty(self.segment.channels[channel.value].shape[1:], dtype=np.uint8)
+            for channel in self.channels
+            if channel in VIEW_CHANNELS and self.pixel_format != self.published_pixel_format}
+        self.rgb_left_buffer_array: Optional[np.ndarray] = self._buffers.get(ZedChannel.RGB_LEFT)
+        self.rgb_right_buffer_array: Optional[np.ndarray] = self._buffers.get(ZedChannel.RGB_RIGHT)
 
         self.previous_timestamp = time.time()
+        # The timestamp of the images that were last copied by _retrieve_rgb_image_as_int(). Unlike
+        # get_current_timestamp(), this is guaranteed to belong to those images.
+        self.retrieved_timestamp = 0.0
 
     def get_current_timestamp(self) -> float:
-        """Timestamp of the image that is currently in the shared memory block.
-
-        Warning: our current implementation, in theory the image and the timestamp could be out of sync when reading.
-        Having atomic read/writes of both the image and timestap (a la ROS) would solve this.
-        """
-        return self.timestamp_shm_array[0]
+        """Timestamp of the latest image in the shared memory segment. Use retrieved_timestamp for the timestamp of the
+        images that were retrieved, as a new image may have been published in the meantime."""
+        return self.frame_ring.latest_timestamp()
 
     @property
     def resolution(self) -> CameraResolutionType:
         """The resolution of the camera, in pixels."""
-        shape_array = [int(x) for x in self.rgb_shape_shm_array[:2]]
-        return (shape_array[1], shape_array[0])
+        channel = next(iter(self.channels))
+        shape = self.segment.channels[channel.value].shape[1:]
+        if channel in VIEW_CHANNELS:
+            return image_resolution(self.published_pixel_format, shape)
+        height, width = shape[:2]
+        return (width, height)
+
+    def channel_layout(self, channel: ZedChannel) -> Tuple[Tuple[int, ...], np.dtype]:
+        """The shape and dtype of the frames of a channel as they are retrieved, i.e. in the pixel format of this
+        receiver for the views."""
+        slots = self.segment.channels[channel.value]
+        if channel in VIEW_CHANNELS:
+            width, height = image_resolution(self.published_pixel_format, slots.shape[1:])
+            return channel_shape(channel, width, height, self.pixel_format), slots.dtype
+        return slots.shape[1:], slots.dtype
+
+    def wait_for_frame(self, timestamp: Optional[float] = None, timeout: Optional[float] = None) -> bool:
+        """Block until an image newer than timestamp has been published.
+
+        Args:
+            timestamp: Defaults to the timestamp of the previously grabbed image.
+            timeout: The maximum time to wait, in seconds. None waits forever.
+
+        Returns:
+            Whether a newer image is available, i.e. False if the timeout expired.
+        """
+        if timestamp is None:
+            timestamp = self.previous_timestamp
+        if self.target_fps > 0 and self.retrieved_timestamp > 0:
+            # Wait for the first frame that is at least one target period newer than the last retrieved frame. Half a
+            # camera period of slack keeps the jitter of the timestamps from lowering the rate.
+            timestamp = max(timestamp, self.retrieved_timestamp + 1 / self.target_fps - 0.5 / self.fps)
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.get_current_timestamp() > timestamp:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            if self.subscription is not None:
+                self.subscription.wait(remaining)
+            else:
+                time.sleep(0.0001 if remaining is None else min(remaining, 0.0001))
+        return True
 
     def _grab_images(self) -> None:
-        # logger.info(
-        #     f"Current timestamp: {self.get_current_timestamp():.3f}, previous timestamp: {self.previous_timestamp:.3f}"
-        # )
-        while not self.get_current_timestamp() > self.previous_timestamp:
-            time.sleep(0.0001)
+        # Bounded waits, so that the timestamp in the ring buffer is checked again even if a notification was lost.
+        while not self.wait_for_frame(timeout=MAX_WAIT):
+            pass
         self.previous_timestamp = self.get_current_timestamp()
-        # logger.debug(f"Updating timestamp: {self.previous_timestamp:.3f}")
 
     def _retrieve_rgb_image(self) -> Tuple[NumpyFloatImageType, NumpyFloatImageType]:
         # No need to check writing lock here because the _retrieve_rgb_image_as_int method does it.
@@ -359,53 +406,97 @@ class ZedReceiver(RGBCamera):
         return image_left, image_right
 
     def _retrieve_rgb_image_as_int(self) -> Tuple[NumpyIntImageType, NumpyIntImageType]:
-        while self.write_lock_shm_array[0]:
-            time.sleep(0.00001)
-        self.read_lock_shm_array[0] += 1
-#         logger.info(f"{self.rgb_left_shm_array.mean()}, {self.rgb_right_shm_array.mean()}")
-        self.rgb_left_buffer_array[:] = self.rgb_left_shm_array[:]
-        self.rgb_right_buffer_array[:] = self.rgb_right_shm_array[:]
-        self.read_lock_shm_array[0] -= 1
-        return self.rgb_left_buffer_array, self.rgb_right_buffer_array
+        # The ring buffer retries until it has copied a left image, right image and timestamp of the same frame.
+        images = self.retrieve_channels([ZedChannel.RGB_LEFT, ZedChannel.RGB_RIGHT])
+        # The RGBCamera interface returns RGB images, whatever the pixel format of this receiver.
+        return (convert(images[ZedChannel.RGB_LEFT], self.pixel_format, PixelFormat.RGB),
+                convert(images[ZedChannel.RGB_RIGHT], self.pixel_format, PixelFormat.RGB))
+
+    def retrieve_channels(self, channels: Sequence[ZedChannel],
+                          out: Optional[Dict[ZedChannel, np.ndarray]] = None) -> Dict[ZedChannel, np.ndarray]:
+        """Copy the given channels of the latest frame, e.g. [ZedChannel.RGB_LEFT, ZedChannel.DEPTH]. The channels all
+        belong to the same frame, whose timestamp is stored in retrieved_timestamp. The returned arrays are reused by
+        the next retrieve, unless out is given: then the channels are copied into the arrays of out, e.g. to hand
+        them over to another thread. The views are in the pixel format of this receiver."""
+        buffers = {channel: out[channel] if out is not None and channel in out else self._buffers[channel]
+                   for channel in channels}
+        self.retrieved_timestamp = self.frame_ring.read_latest({
+            channel.value: self._staging_buffers.get(channel, buffer) for channel, buffer in buffers.items()})
+        for channel, buffer in buffers.items():
+            if channel in self._staging_buffers:
+                convert(self._staging_buffers[channel], self.published_pixel_format, self.pixel_format, dst=buffer)
+        self._record_delivery(self.frame_ring.last_read_frame_number, self.retrieved_timestamp)
+        return buffers
+
+    @contextlib.contextmanager
+    def borrow_frame(self, views: Sequence[Union[str, ZedChannel]] = (StereoRGBDCamera.LEFT_RGB,
+                                                                       StereoRGBDCamera.RIGHT_RGB)
+                     ) -> Iterator[BorrowedFrame]:
+        """Borrow the latest frame without copying it: the yielded frame holds read-only views into shared memory,
+        frame.channels[view] for every requested view, which are only valid inside the with block. The views are in
+        the pixel format of the publisher (published_pixel_format), as nothing is converted. The slot of the
+        frame is pinned, so the publisher does not overwrite it until the block exits.
+
+        Example:
+            with receiver.borrow_frame(views=[StereoRGBDCamera.LEFT_RGB]) as frame:
+                video_writer.write(frame.channels[StereoRGBDCamera.LEFT_RGB])
 
-    def intrinsics_matrix(self) -> CameraIntrinsicsMatrixType:
-        return self.intrinsics_shm_array
-
-    def _close_shared_memory(self) -> None:
-        """Signal that the shared memory blocks are no longer needed from this process."""
-        print(f"Closing RGB shared memory blocks of {self.__class__.__name__}.")
-
-        if self.rgb_left_shm is not None:
-            self.rgb_left_shm.close()
-            self.rgb_left_shm = None  # type: ignore
-
-        if self.rgb_right_shm is not None:
-            self.rgb_right_shm.close()
-            self.rgb_right_shm = None  # type: ignore
-
-        if self.rgb_shape_shm is not None:
-            self.rgb_shape_shm.close()
-            self.rgb_shape_shm = None  # type: ignore
+        Args:
+            views: StereoRGBDCamera.LEFT_RGB, StereoRGBDCamera.RIGHT_RGB and/or any ZedChannel that the publisher
+                publishes, e.g. ZedChannel.DEPTH.
 
-        if self.timestamp_shm is not None:
-            self.timestamp_shm.close()
-            self.timestamp_shm = None  # type: ignore
+        Raises:
+            RuntimeError: if nothing has been published yet.
+        """
+        pin_index = self.segment.reader_index
+        channels = {view: view if isinstance(view, ZedChannel) else _VIEW_CHANNELS[view] for view in views}
+        frame = self.frame_ring.borrow_latest(pin_index, [channel.value for channel in channels.values()])
+        if frame is None:
+            raise RuntimeError(f'No frame has been published to "{self._shared_memory_namespace}" yet.')
+        frame.channels = {view: frame.channels[channel.value] for view, channel in channels.items()}
+        self.retrieved_timestamp = frame.timestamp
+        self._record_delivery(frame.frame_number, frame.timestamp)
+        try:
+            yield frame
+        finally:
+            if not frame.intact:
+                # Only possible when too many slots are pinned or pinning is not supported on this platform.
+                logger.warning("A borrowed frame was overwritten by the publisher before it was released.")
+            self.frame_ring.release(pin_index)
+
+    def _record_delivery(self, frame_number: int, timestamp: float) -> None:
+        """Update the statistics of this receiver's subscription in the segment."""
+        index = self.segment.reader_index
+        readers = self.segment.readers
+        if index is None or frame_number <= int(readers["cursor"][index]):
+            return  # No subscription, or a frame that was already delivered.
+        cursor = int(readers["cursor"][index])
+        if cursor > 0:
+            missed_frames = frame_number - cursor - 1
+            # At a target rate, the receiver is expected to leave out the frames in between on purpose.
+            expected_skips = max(round(self.fps / self.target_fps) - 1, 0) if self.target_fps > 0 else 0
+            skipped_frames = min(missed_frames, expected_skips)
+            readers["skipped"][index] += skipped_frames
+            readers["overwritten"][index] += missed_frames - skipped_frames
+        readers["cursor"][index] = frame_number
+        readers["last_timestamp"][index] = timestamp
+        readers["delivered"][index] += 1
 
-        if self.intrinsics_shm is not None:
-            self.intrinsics_shm.close()
-            self.intrinsics_shm = None  # type: ignore
+    def intrinsics_matrix(self) -> CameraIntrinsicsMatrixType:
+        return self.segment.intrinsics.copy()
 
-        if self.fps_shm is not None:
-            self.fps_shm.close()
-            self.fps_shm = None  # type: ignore
+    def _close_shared_memory(self) -> None:
+        """Signal that the shared memory segment is no longer needed from this process."""
+        print(f"Closing RGB shared memory segment of {self.__class__.__name__}.")
 
-        if self.write_lock_shm is not None:
-            self.write_lock_shm.close()
-            self.write_lock_shm = None  # type: ignore
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
 
-        if self.read_lock_shm is not None:
-            self.read_lock_shm.close()
-            self.read_lock_shm = None  # type: ignore
+        if self.segment is not None:
+            self.frame_ring = None
+            self.segment.close()
+            self.segment = None  # type: ignore
 
     def __del__(self) -> None:
         self._close_shared_memory()
\ No newline at end of file
@@ -1,17 +1,38 @@
 import enum
 import os
 import sys
+from typing import Callable, Dict, Optional, Tuple
 
 import cv2
 import numpy as np
 import pyzed.sl as sl
 from loguru import logger
 
+from rgb_recorder.recording.depth_store import create_depth_writer
+from rgb_recorder.recording.encoders import EncoderSettings, VideoEncoder, create_encoder
+from rgb_recorder.recording.frame_index import FrameIndexWriter, index_filename
+
 
 class OutputMode(enum.Enum):
     RGB_LEFT = 0
     RGB_RIGHT = 1
-    DEPTH_LEFT = 2
+    DEPTH_LEFT = 2  # 8-bit depth visualization, as a video.
+    DEPTH_LEFT_MM = 3  # Metric uint16 depth in millimetres, in a depth store (see depth_store.py).
+
+
+# The view that is retrieved from the SDK for every output mode that is exported to a video.
+OUTPUT_VIEWS = {
+    OutputMode.RGB_LEFT: sl.VIEW.LEFT,
+    OutputMode.RGB_RIGHT: sl.VIEW.RIGHT,
+    OutputMode.DEPTH_LEFT: sl.VIEW.DEPTH,
+}
+
+# The measure that is retrieved from the SDK for every output mode that is exported to a depth store.
+OUTPUT_MEASURES = {
+    OutputMode.DEPTH_LEFT_MM: sl.MEASURE.DEPTH_U16_MM,
+}
+
+DEPTH_OUTPUT_MODES = (OutputMode.DEPTH_LEFT, OutputMode.DEPTH_LEFT_MM)
 
 
 def progress_bar(percent_done, bar_length=50):
@@ -32,11 +53,14 @@ def open_camera(init: sl.InitParameters) -> sl.Camera:
     return zed
 
 
-def initialize_sdk(input_file: str) -> sl.InitParameters:
+def initialize_sdk(input_file: str, compute_depth: bool = True) -> sl.InitParameters:
     init_params = sl.InitParameters()
     init_params.set_from_svo_file(input_file)
     init_params.svo_real_time_mode = False
     init_params.coordinate_units = sl.UNIT.MILLIMETER
+    if not compute_depth:
+        # Depth is computed by default, which is wasted work when we only export RGB views.
+        init_params.depth_mode = sl.DEPTH_MODE.NONE
     return init_params
 
 
@@ -44,66 +68,193 @@ def close_camera(camera: sl.Camera):
     camera.close()
 
 
-def export(input_file: str, output_file: str, output_mode: OutputMode):
+def check_export_files(input_file: str, output_files: Dict[OutputMode, str]):
     if not os.path.isfile(input_file):
         raise IOError("Input file does not exist: " + input_file)
 
-    if os.path.isfile(output_file):
-        raise IOError("Output file already exists: " + output_file)
+    if not output_files:
+        raise ValueError("No output files were requested.")
 
-    init = initialize_sdk(input_file)
-    cam = open_camera(init)
+    for output_mode, output_file in output_files.items():
+        if output_mode not in OUTPUT_VIEWS and output_mode not in OUTPUT_MEASURES:
+            raise ValueError(f"Unsupported output mode: {output_mode}")
+        if os.path.exists(output_file):
+            raise IOError("Output file already exists: " + output_file)
+
+
+def requires_depth(output_modes) -> bool:
+    return any(output_mode in DEPTH_OUTPUT_MODES for output_mode in output_modes)
 
-    # Get camera properties.
+
+def retrieve_output(cam: sl.Camera, image: sl.Mat, output_mode: OutputMode):
+    if output_mode in OUTPUT_MEASURES:
+        cam.retrieve_measure(image, OUTPUT_MEASURES[output_mode])
+    else:
+        cam.retrieve_image(image, OUTPUT_VIEWS[output_mode])
+
+
+def get_video_properties(cam: sl.Camera) -> Tuple[int, int, int]:
+    """Returns the width, height and fps of the videos that are exported from an opened SVO file."""
     image_size = cam.get_camera_information().camera_configuration.resolution
-    width = image_size.width
-    height = image_size.height
     fps = max(cam.get_camera_information().camera_configuration.fps, 25)
+    return image_size.width, image_size.height, fps
+
+
+def create_video_writers(output_files: Dict[OutputMode, str], fps: int, width: int, height: int,
+                         encoder_settings: Optional[EncoderSettings] = None,
+                         max_frames: int = 0) -> Dict[OutputMode, VideoEncoder]:
+    """Create a video encoder for every output that is a video, and a depth store writer (which is preallocated for
+    max_frames frames) for every output that is a measure."""
+    video_writers = {}
+    for output_mode, output_file in output_files.items():
+        try:
+            if output_mode in OUTPUT_MEASURES:
+                video_writers[output_mode] = create_depth_writer(output_file, max_frames, width, height)
+            else:
+                video_writers[output_mode] = create_encoder(output_file, fps, width, height, encoder_settings)
+        except IOError:
+            for opened_writer in video_writers.values():
+                opened_writer.release()
+            raise
+    return video_writers
+
+
+def create_frame_indexes(output_files: Dict[OutputMode, str]) -> Dict[OutputMode, FrameIndexWriter]:
+    return {output_mode: FrameIndexWriter(index_filename(output_file)) for output_mode, output_file in
+            output_files.items()}
 
-    # Prepare side by side image container equivalent to CV_8UC4.
-    svo_image_sbs_rgba = np.zeros((height, width, 4), dtype=np.uint8)
 
-    # Prepare single image containers
-    image = sl.Mat()
+def release_outputs(video_writers: Dict[OutputMode, VideoEncoder],
+                    frame_indexes: Dict[OutputMode, FrameIndexWriter]) -> None:
+    """Release every video writer and close every frame index, even if one of them fails. The first error is raised
+    once all of them are closed."""
+    error: Optional[BaseException] = None
+    for video_writer in video_writers.values():
+        try:
+            video_writer.release()
+        except Exception as e:
+            error = error or e
+    for frame_index in frame_indexes.values():
+        frame_index.close()
+    if error is not None:
+        raise error
 
-    # Create video writer with MPEG-4 part 2 codec
-    video_writer = cv2.VideoWriter(output_file,
-                                   cv2.VideoWriter_fourcc('M', '4', 'S', '2'),
-                                   fps,
-                                   (width, height))
-    if not video_writer.isOpened():
-        raise IOError("Could not open video writer for file: " + output_file)
 
-    rt_param = sl.RuntimeParameters()
+def get_timestamp_ns(cam: sl.Camera) -> int:
+    """The capture timestamp of the last grabbed image. For SVO files, this is the timestamp at recording time."""
+    return cam.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds()
+
+
+def get_frame_range(cam: sl.Camera, frame_range: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """Clip a frame range to the frames in an opened SVO file. None means all frames."""
     nb_frames = cam.get_svo_number_of_frames()
+    if frame_range is None:
+        return 0, nb_frames
+    start_frame, end_frame = frame_range
+    start_frame, end_frame = max(start_frame, 0), min(end_frame, nb_frames)
+    if start_frame >= end_frame:
+        raise ValueError(f"Empty frame range {frame_range} for an SVO file with {nb_frames} frames.")
+    return start_frame, end_frame
 
-    while True:
-        err = cam.grab(rt_param)
-        if err == sl.ERROR_CODE.SUCCESS:
-            svo_position = cam.get_svo_position()
-
-            if output_mode == OutputMode.RGB_LEFT:
-                cam.retrieve_image(image, sl.VIEW.LEFT)
-            elif output_mode == OutputMode.RGB_RIGHT:
-                cam.retrieve_image(image, sl.VIEW.RIGHT)
-            elif output_mode == OutputMode.DEPTH_LEFT:
-                cam.retrieve_image(image, sl.VIEW.DEPTH)
-            else:
-                raise ValueError(f"Unsupported output mode: {output_mode}")
 
-            svo_image_sbs_rgba[0:height, 0:width, :] = image.get_data()
-            ocv_image_sbs_rgb = cv2.cvtColor(svo_image_sbs_rgba, cv2.COLOR_RGBA2RGB)
-            video_writer.write(ocv_image_sbs_rgb)
+def export(input_file: str, output_file: str, output_mode: OutputMode, show_progress: bool = True,
+           zero_copy: bool = True, encoder_settings: Optional[EncoderSettings] = None):
+    export_all(input_file, {output_mode: output_file}, show_progress=show_progress, zero_copy=zero_copy,
+               encoder_settings=encoder_settings)
+
+
+def export_all(input_file: str, output_files: Dict[OutputMode, str], show_progress: bool = True,
+               zero_copy: bool = True, frame_range: Optional[Tuple[int, int]] = None,
+               encoder_settings: Optional[EncoderSettings] = None,
+               progress_fn: Optional[Callable[[int, int], None]] = None):
+    """Export one or more views of an SVO file to video files (or depth stores) in a single pass over the SVO file.
+    Every output gets a frame index next to it (see frame_index.py).
+
+    Every frame is decoded only once and then retrieved for every requested output mode.
+    Depth is only computed if OutputMode.DEPTH_LEFT or OutputMode.DEPTH_LEFT_MM is requested.
+
+    Args:
+        input_file: The SVO file to export.
+        output_files: Maps every output mode that should be exported to its output file.
+        show_progress: Whether to display a progress bar on stdout.
+        zero_copy: If True, convert a view of the SDK image buffer directly into a reused BGR buffer. Otherwise, copy
+            the SDK image into an intermediate buffer first and allocate a new converted image for every frame.
+        frame_range: If given, only export the SVO frames in [start, end), by seeking to start.
+        encoder_settings: The settings of the video encoders. Defaults to OpenCV with the MPEG-4 part 2 codec.
+        progress_fn: Called after every frame with the number of exported frames and the total number of frames.
+    """
+    check_export_files(input_file, output_files)
+
+    compute_depth = requires_depth(output_files)
+    init = initialize_sdk(input_file, compute_depth=compute_depth)
+    cam = open_camera(init)
+    video_writers: Dict[OutputMode, VideoEncoder] = {}
+    frame_indexes: Dict[OutputMode, FrameIndexWriter] = {}
+    try:
+        # Get camera properties.
+        width, height, fps = get_video_properties(cam)
+
+        if zero_copy:
+            # The SDK delivers BGRA images, the video writers expect BGR. These buffers are reused for every frame.
+            bgr_buffers = {output_mode: np.empty((height, width, 3), dtype=np.uint8) for output_mode in output_files}
+        else:
+            # Prepare side by side image container equivalent to CV_8UC4.
+            svo_image_sbs_rgba = np.zeros((height, width, 4), dtype=np.uint8)
+
+        # Prepare single image containers, one per output so that they can be reused for every frame.
+        images = {output_mode: sl.Mat() for output_mode in output_files}
+
+        start_frame, end_frame = get_frame_range(cam, frame_range)
+        nb_frames = end_frame - start_frame
+
+        video_writers = create_video_writers(output_files, fps, width, height, encoder_settings, nb_frames)
+        frame_indexes = create_frame_indexes(output_files)
+
+        rt_param = sl.RuntimeParameters()
+        rt_param.enable_depth = compute_depth
+        if start_frame > 0:
+            cam.set_svo_position(start_frame)
+
+        while True:
+            err = cam.grab(rt_param)
+            if err == sl.ERROR_CODE.SUCCESS:
+                svo_position = cam.get_svo_position()
+                if svo_position >= end_frame:
+                    if show_progress:
+                        progress_bar(100, 30)
+                    logger.info("Reached end of frame range successfully.")
+                    break
+                timestamp_ns = get_timestamp_ns(cam)
 
-            # Display progress
-            progress_bar((svo_position + 1) / nb_frames * 100, 30)
+                for output_mode, video_writer in video_writers.items():
+                    image = images[output_mode]
+                    retrieve_output(cam, image, output_mode)
 
-        if err == sl.ERROR_CODE.END_OF_SVOFILE_REACHED:
-            progress_bar(100, 30)
-            logger.info("Reached end of file successfully.")
-            break
+                    if output_mode in OUTPUT_MEASURES:
+                        video_writer.write(image.get_data(deep_copy=False))
+                    elif zero_copy:
+                        video_writer.write(cv2.cvtColor(image.get_data(deep_copy=False), cv2.COLOR_BGRA2BGR,
+                                                        dst=bgr_buffers[output_mode]))
+                    else:
+                        svo_image_sbs_rgba[0:height, 0:width, :] = image.get_data()
+                        ocv_image_sbs_rgb = cv2.cvtColor(svo_image_sbs_rgba, cv2.COLOR_RGBA2RGB)
+                        video_writer.write(ocv_image_sbs_rgb)
+                    frame_indexes[output_mode].append(timestamp_ns, svo_position, video_writer.last_byte_offset)
 
-    # Close the video writer
-    video_writer.release()
+                # Display progress
+                if show_progress:
+                    progress_bar((svo_position - start_frame + 1) / nb_frames * 100, 30)
+                if progress_fn is not None:
+                    progress_fn(svo_position - start_frame + 1, nb_frames)
 
-    close_camera(cam)
+            if err == sl.ERROR_CODE.END_OF_SVOFILE_REACHED:
+                if show_progress:
+                    progress_bar(100, 30)
+                logger.info("Reached end of file successfully.")
+                break
+    finally:
+        # Close the outputs and the camera, also when the export fails halfway.
+        try:
+            release_outputs(video_writers, frame_indexes)
+        finally:
+            close_camera(cam)
@@ -0,0 +1,287 @@
+"""A persistent queue of export jobs that are run in the background.
+
+Jobs are stored in a JSON file, so that they survive a restart of the application: jobs that were running when the
+application stopped are restarted from scratch (their partial outputs are removed first). The jobs run in a pool of
+worker processes, which report their progress to the queue. The progress, throughput and ETA of every job can be read
+with ExportJobQueue.snapshot(), e.g. periodically from a Tk after() callback.
+"""
+import enum
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from rgb_recorder.recording.encoders import EncoderBackend, EncoderSettings
+from rgb_recorder.recording.frame_index import index_filename
+from rgb_recorder.recording.zed_sdk.export import OutputMode
+from rgb_recorder.recording.zed_sdk.scheduler import ExportJob, run_export_job
+
+# Progress is reported to the queue at most this often per job, in seconds.
+_PROGRESS_INTERVAL = 0.5
+
+
+class JobStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class QueuedExportJob:
+    input_file: str
+    output_files: Dict[str, str]  # OutputMode name -> output file, so that the job can be stored as JSON.
+    pipelined: bool = False
+    frame_range: Optional[List[int]] = None  # [start, end], a list so that it survives a round trip through JSON.
+    encoder_settings: Optional[dict] = None  # EncoderSettings as a dict, with the name of the backend.
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.PENDING
+    frames_done: int = 0
+    frames_total: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @classmethod
+    def from_export_job(cls, job: ExportJob) -> "QueuedExportJob":
+        encoder_settings = None
+        if job.encoder_settings is not None:
+            encoder_settings = asdict(job.encoder_settings)
+            encoder_settings["backend"] = job.encoder_settings.backend.name
+        return cls(job.input_file, {output_mode.name: output_file for output_mode, output_file in
+                                    job.output_files.items()}, job.pipelined,
+                   list(job.frame_range) if job.frame_range is not None else None, encoder_settings)
+
+    def to_export_job(self) -> ExportJob:
+        encoder_settings = None
+        if self.encoder_settings is not None:
+            encoder_settings = EncoderSettings(**{**self.encoder_settings,
+                                                  "backend": EncoderBackend[self.encoder_settings["backend"]]})
+        return ExportJob(self.input_file, {OutputMode[name]: output_file for name, output_file in
+                                           self.output_files.items()}, self.pipelined,
+                         tuple(self.frame_range) if self.frame_range is not None else None, encoder_settings)
+
+    @property
+    def fps(self) -> float:
+        if self.started_at is None or self.frames_done == 0:
+            return 0.0
+        end_time = self.finished_at if self.finished_at is not None else time.time()
+        return self.frames_done / max(end_time - self.started_at, 1e-6)
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated remaining time in seconds, if it can be estimated."""
+        if self.status != JobStatus.RUNNING or self.fps == 0 or self.frames_total == 0:
+            return None
+        return (self.frames_total - self.frames_done) / self.fps
+
+    def describe(self) -> str:
+        name = os.path.basename(self.input_file)
+        if self.status == JobStatus.RUNNING:
+            percent = 100 * self.frames_done / self.frames_total if self.frames_total else 0
+            eta = f", ETA {self.eta:.0f}s" if self.eta is not None else ""
+            return f"{name}: {percent:.0f}% ({self.fps:.1f} frames/s{eta})"
+        if self.status == JobStatus.FAILED:
+            return f"{name}: failed ({self.error})"
+        return f"{name}: {self.status.value}"
+
+
+_progress_queue: Optional[multiprocessing.Queue] = None
+
+
+def _init_worker(progress_queue: multiprocessing.Queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _run_queued_job(job_id: str, job: ExportJob) -> None:
+    last_report_time = 0.0
+
+    def report_progress(frames_done: int, frames_total: int):
+        nonlocal last_report_time
+        now = time.time()
+        if now - last_report_time >= _PROGRESS_INTERVAL or frames_done == frames_total:
+            last_report_time = now
+            _progress_queue.put((job_id, frames_done, frames_total))
+
+    run_export_job(job, progress_fn=report_progress)
+
+
+class ExportJobQueue:
+    """Runs export jobs in the background and persists their state to state_file."""
+
+    def __init__(self, state_file: str, num_workers: int = 2):
+        self.state_file = state_file
+        self.num_workers = num_workers
+        self._jobs: Dict[str, QueuedExportJob] = {}
+        self._lock = threading.Lock()
+        self._wakeup_event = threading.Event()
+        self._shutdown_event = threading.Event()
+        self._dispatcher: Optional[threading.Thread] = None
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.state_file):
+            return
+        with open(self.state_file) as f:
+            for job_dict in json.load(f):
+                job = QueuedExportJob(**job_dict)
+                job.status = JobStatus(job.status)
+                if job.status == JobStatus.RUNNING:
+                    logger.info(f"Restarting interrupted export of {job.input_file}.")
+                    self._remove_outputs(job)
+                    job.status = JobStatus.PENDING
+                    job.frames_done = 0
+                    job.started_at = None
+                self._jobs[job.job_id] = job
+
+    def _save(self):
+        # Must be called with the lock held. Write to a temporary file first, so that a crash never leaves a
+        # truncated state file behind.
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump([asdict(job) for job in self._jobs.values()], f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def _remove_outputs(job: QueuedExportJob):
+        for output_file in job.output_files.values():
+            for file in (output_file, index_filename(output_file)):
+                if os.path.isfile(file):
+                    os.remove(file)
+
+    def enqueue(self, jobs: List[ExportJob]):
+        with self._lock:
+            for job in jobs:
+                queued_job = QueuedExportJob.from_export_job(job)
+                self._jobs[queued_job.job_id] = queued_job
+            self._save()
+        self._wakeup_event.set()
+
+    def snapshot(self) -> List[QueuedExportJob]:
+        """A copy of all jobs, in the order in which they were enqueued."""
+        with self._lock:
+            return [QueuedExportJob(**asdict(job)) for job in self._jobs.values()]
+
+    def clear_finished(self):
+        """Remove the jobs that are done or failed."""
+        with self._lock:
+            self._jobs = {job_id: job for job_id, job in self._jobs.items()
+                          if job.status in (JobStatus.PENDING, JobStatus.RUNNING)}
+            self._save()
+
+    @property
+    def busy(self) -> bool:
+        with self._lock:
+            return any(job.status in (JobStatus.PENDING, JobStatus.RUNNING) for job in self._jobs.values())
+
+    def start(self):
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def stop(self):
+        """Stop after the running jobs have finished. Pending jobs stay in the queue for the next start."""
+        self._shutdown_event.set()
+        self._wakeup_event.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+            self._dispatcher = None
+
+    def _next_pending_job(self) -> Optional[QueuedExportJob]:
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == JobStatus.PENDING:
+                    job.status = JobStatus.RUNNING
+                    job.started_at = time.time()
+                    self._save()
+                    return job
+        return None
+
+    def _update_progress(self, progress_queue: multiprocessing.Queue):
+        while True:
+            try:
+                job_id, frames_done, frames_total = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job.frames_done = frames_done
+                    job.frames_total = frames_total
+
+    def _finish_job(self, job: QueuedExportJob, future: Future):
+        exception = future.exception()
+        with self._lock:
+            job.finished_at = time.time()
+            if exception is None:
+                job.status = JobStatus.DONE
+                logger.info(f"Exported {job.input_file} in {job.finished_at - job.started_at:.1f}s.")
+            else:
+                job.status = JobStatus.FAILED
+                job.error = repr(exception)
+                logger.error(f"Failed to export {job.input_file}: {job.error}")
+            self._save()
+
+    def _create_executor(self, context, progress_queue: multiprocessing.Queue) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.num_workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(progress_queue,))
+
+    def _restart_executor(self, executor: ProcessPoolExecutor, running: Dict[Future, QueuedExportJob], context,
+                          progress_queue: multiprocessing.Queue, reason: str) -> ProcessPoolExecutor:
+        """Fail the jobs that were running and replace the executor, so that the remaining jobs still run."""
+        logger.error(f"Restarting the export workers: {reason}")
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == JobStatus.RUNNING:
+                    job.status = JobStatus.FAILED
+                    job.finished_at = time.time()
+                    job.error = reason
+            try:
+                self._save()
+            except OSError as e:
+                logger.error(f"Could not save the export jobs to {self.state_file}: {e!r}")
+        running.clear()
+        executor.shutdown(wait=False, cancel_futures=True)
+        return self._create_executor(context, progress_queue)
+
+    def _dispatch(self):
+        # Spawn instead of fork, to avoid issues with the CUDA context of the ZED SDK.
+        context = multiprocessing.get_context("spawn")
+        progress_queue = context.Queue()
+        running: Dict[Future, QueuedExportJob] = {}
+        executor = self._create_executor(context, progress_queue)
+        try:
+            while not self._shutdown_event.is_set() or running:
+                try:
+                    while not self._shutdown_event.is_set() and len(running) < self.num_workers:
+                        job = self._next_pending_job()
+                        if job is None:
+                            break
+                        logger.info(f"Exporting {job.input_file} in the background...")
+                        running[executor.submit(_run_queued_job, job.job_id, job.to_export_job())] = job
+
+                    if running:
+                        done, _ = wait(running, timeout=_PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                        self._update_progress(progress_queue)
+                        for future in done:
+                            self._finish_job(running.pop(future), future)
+                        # A worker process died, e.g. because it ran out of memory, which takes down the executor.
+                        if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                            executor = self._restart_executor(executor, running, context, progress_queue,
+                                                              "a worker process died unexpectedly")
+                    else:
+                        self._wakeup_event.wait(timeout=_PROGRESS_INTERVAL)
+                        self._wakeup_event.clear()
+                except Exception as e:
+                    executor = self._restart_executor(executor, running, context, progress_queue, repr(e))
+        finally:
+            executor.shutdown()
@@ -0,0 +1,245 @@
+import collections
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pyzed.sl as sl
+from loguru import logger
+
+from rgb_recorder.recording.encoders import EncoderSettings, VideoEncoder
+
+from rgb_recorder.recording.frame_index import FrameIndexWriter, index_filename
+from rgb_recorder.recording.zed_sdk.export import OutputMode, OUTPUT_VIEWS, create_frame_indexes, \
+    create_video_writers, get_timestamp_ns, get_video_properties
+
+_END_OF_STREAM = None
+
+# The outputs that are exported live by default. Retrieving the depth view would also render it on the recording
+# thread, so it is exported from the SVO file after recording.
+LIVE_OUTPUT_MODES = (OutputMode.RGB_LEFT, OutputMode.RGB_RIGHT)
+
+
+class LiveExporter:
+    """Exports the frames of a camera to video files while the camera is still recording to an SVO file, so that the
+    videos are ready (almost) as soon as the recording stops.
+
+    The recording thread hands over every grabbed frame with offer(). The SDK only keeps the images of the last grab,
+    so they are retrieved there, but into one of max_pending_frames preallocated images, which the encoder thread hands
+    back after encoding, so that they are never copied. Retrieving still takes time from the recording thread, so it
+    is budgeted: on average, retrieving may take at most max_grab_share of the time of the recording thread, and a
+    frame is skipped when its retrieval would exceed the budget. Encoding happens in a background thread with a
+    lowered scheduling priority, and the recording thread never waits for it: when all images are waiting to be
+    encoded, the frame is skipped as well.
+
+    The encoder repeats the previous frame in place of a skipped frame, to keep the videos in sync with the SVO file.
+    When more than max_repeated_share of the frames of the last window seconds had to be repeated, the live export
+    gives up and stops retrieving images, so that it no longer costs the recording anything. In that case, or after an
+    error, complete is False after finish() and the SVO file should be exported as usual.
+    """
+
+    def __init__(self, output_files: Dict[OutputMode, str], max_pending_frames: int = 30,
+                 encoder_settings: Optional[EncoderSettings] = None, max_grab_share: float = 0.2,
+                 max_repeated_share: float = 0.1, window: float = 10.0):
+        """
+        Args:
+            output_files: Maps every output mode that should be exported to its output file.
+            max_pending_frames: The maximum number of frames that can wait to be encoded.
+            encoder_settings: The settings of the video encoders.
+            max_grab_share: The share of the time of the recording thread that retrieving images may take.
+            max_repeated_share: The share of repeated frames in a window above which the live export gives up.
+            window: The duration of that window, in seconds.
+        """
+        for output_mode, output_file in output_files.items():
+            if output_mode not in OUTPUT_VIEWS:
+                raise ValueError(f"Unsupported output mode: {output_mode}")
+            if os.path.isfile(output_file):
+                raise IOError("Output file already exists: " + output_file)
+
+        self.output_files = output_files
+        self.encoder_settings = encoder_settings
+        self.max_grab_share = max_grab_share
+        self.max_repeated_share = max_repeated_share
+        self.window = window
+        # Whether each of the frames in the window was repeated (set to the number of frames in start()).
+        self._repeated_in_window: Deque[bool] = collections.deque()
+        self._frame_period = 0.0
+        # The time that retrieving may still take, and the average time it takes, in seconds.
+        self._retrieve_budget = 0.0
+        self._retrieve_time = 0.0
+        self._last_offer_time: Optional[float] = None
+        self._frame_queue: queue.Queue = queue.Queue()
+        # The images that are free to retrieve a frame into.
+        self._free_images: queue.Queue = queue.Queue()
+        for _ in range(max_pending_frames):
+            self._free_images.put({output_mode: sl.Mat() for output_mode in output_files})
+        # The timestamps and SVO positions of the frames that were dropped since the last frame that was handed over.
+        self._dropped_frames: List[Tuple[int, int]] = []
+        self._video_writers: Dict[OutputMode, VideoEncoder] = {}
+        self._frame_indexes: Dict[OutputMode, FrameIndexWriter] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self._gave_up = False
+        self._finished = False
+        self.frames_offered = 0
+        self.frames_encoded = 0
+        self.frames_repeated = 0
+
+    @property
+    def complete(self) -> bool:
+        """Whether the live export has finished and every frame that was offered has been encoded, or repeated."""
+        return (self._finished and not self._gave_up and self._error is None
+                and self.frames_encoded == self.frames_offered)
+
+    def start(self, cam: sl.Camera):
+        """Open the video writers for an opened camera and start the encoder thread."""
+        width, height, fps = get_video_properties(cam)
+        self._frame_period = 1 / fps
+        self._repeated_in_window = collections.deque(maxlen=max(int(self.window * fps), 1))
+        self._video_writers = create_video_writers(self.output_files, fps, width, height, self.encoder_settings)
+        self._frame_indexes = create_frame_indexes(self.output_files)
+        self._thread = threading.Thread(target=self._encode, daemon=True)
+        self._thread.start()
+
+    def offer(self, cam: sl.Camera):
+        """Hand over the frame that was just grabbed by the recording thread. This never blocks."""
+        self.frames_offered += 1
+        if self._gave_up or self._error is not None:
+            return
+
+        # The frames are recorded to the SVO file in the order in which they are grabbed.
+        svo_position = self.frames_offered - 1
+        now = time.perf_counter()
+        if self._last_offer_time is not None:
+            # The budget grows with the time of the recording thread, so that retrievals never come in bursts.
+            self._retrieve_budget = min(self._retrieve_budget + self.max_grab_share * (now - self._last_offer_time),
+                                        self._retrieve_time + self.max_grab_share * self._frame_period)
+        self._last_offer_time = now
+
+        images = None
+        if self._retrieve_budget >= self._retrieve_time:
+            try:
+                images = self._free_images.get_nowait()
+            except queue.Empty:
+                pass
+        if images is None:
+            self._skip(cam, svo_position)
+            return
+
+        for output_mode, image in images.items():
+            cam.retrieve_image(image, OUTPUT_VIEWS[output_mode])
+        retrieve_time = time.perf_counter() - now
+        self._retrieve_budget -= retrieve_time
+        self._retrieve_time = retrieve_time if self._retrieve_time == 0 else \
+            0.9 * self._retrieve_time + 0.1 * retrieve_time
+        self._frame_queue.put_nowait((images, get_timestamp_ns(cam), svo_position, self._dropped_frames))
+        self.frames_repeated += len(self._dropped_frames)
+        self._dropped_frames = []
+        self._repeated_in_window.append(False)
+
+    def _skip(self, cam: sl.Camera, svo_position: int):
+        """Skip the frame that was just grabbed, so that the encoder repeats the previous frame in its place."""
+        if self.frames_repeated == 0 and not self._dropped_frames:
+            logger.warning(f"Live export of {', '.join(self.output_files.values())} cannot keep up with the "
+                           f"recording, repeating frames.")
+        self._dropped_frames.append((get_timestamp_ns(cam), svo_position))
+        self._repeated_in_window.append(True)
+        window = self._repeated_in_window
+        if len(window) == window.maxlen and sum(window) > self.max_repeated_share * len(window):
+            logger.warning(f"Live export of {', '.join(self.output_files.values())} repeated more than "
+                           f"{self.max_repeated_share:.0%} of the frames of the last {self.window:.0f} s, the SVO "
+                           f"file will be exported after recording instead.")
+            self._gave_up = True
+
+    def finish(self) -> bool:
+        """Encode the remaining frames and close the video files. Incomplete video files are removed.
+
+        Returns:
+            Whether the live export is complete.
+        """
+        if self._thread is not None:
+            if self._gave_up:
+                self._drain()
+            elif self._dropped_frames:
+                # Repeat the last frame in place of the frames that were dropped at the end.
+                self._frame_queue.put(({}, None, None, self._dropped_frames))
+                self.frames_repeated += len(self._dropped_frames)
+                self._dropped_frames = []
+            self._frame_queue.put(_END_OF_STREAM)
+            self._thread.join()
+            self._thread = None
+            self._finished = True
+            if self.frames_repeated > 0 and not self._gave_up:
+                logger.info(f"Live export of {', '.join(self.output_files.values())} repeated "
+                            f"{self.frames_repeated} of {self.frames_offered} frames.")
+
+        for output_mode, video_writer in self._video_writers.items():
+            try:
+                video_writer.release()
+            except IOError as e:
+                logger.error(f"Live export of {self.output_files[output_mode]} failed: {e!r}")
+                self._error = e
+        self._video_writers = {}
+        for frame_index in self._frame_indexes.values():
+            frame_index.close()
+        self._frame_indexes = {}
+
+        complete = self.complete
+        if not complete:
+            for output_file in self.output_files.values():
+                for file in (output_file, index_filename(output_file)):
+                    if os.path.isfile(file):
+                        os.remove(file)
+        return complete
+
+    def _drain(self):
+        # The output is discarded anyway, so there is no need to encode what is still waiting.
+        while True:
+            try:
+                self._frame_queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def _encode(self):
+        # Encoding competes with the recording threads for CPU time, so give them precedence (Linux only: on other
+        # platforms this would lower the priority of the whole process).
+        if sys.platform.startswith("linux"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+            except OSError:
+                pass
+
+        # The previous frame of every output, which is repeated in place of dropped frames.
+        bgr_buffers: Dict[OutputMode, np.ndarray] = {}
+        while True:
+            item = self._frame_queue.get()
+            if item is _END_OF_STREAM:
+                break
+            if self._error is not None or self._gave_up:
+                continue
+            images, timestamp_ns, svo_position, dropped_frames = item
+            try:
+                # Frames that were skipped before the first frame cannot be repeated, and leave the export incomplete.
+                for output_mode, bgr_buffer in bgr_buffers.items():
+                    for dropped_timestamp_ns, dropped_svo_position in dropped_frames:
+                        self._video_writers[output_mode].write(bgr_buffer)
+                        self._frame_indexes[output_mode].append(dropped_timestamp_ns, dropped_svo_position)
+                if bgr_buffers:
+                    self.frames_encoded += len(dropped_frames)
+                for output_mode, image in images.items():
+                    bgr_buffers[output_mode] = cv2.cvtColor(image.get_data(deep_copy=False), cv2.COLOR_BGRA2BGR,
+                                                            dst=bgr_buffers.get(output_mode))
+                    self._video_writers[output_mode].write(bgr_buffers[output_mode])
+                    self._frame_indexes[output_mode].append(timestamp_ns, svo_position)
+                if images:
+                    self.frames_encoded += 1
+            except Exception as e:
+                logger.error(f"Live export of {', '.join(self.output_files.values())} failed, the SVO file will be "
+                             f"exported after recording instead: {e!r}")
+                self._error = e
+            if images:
+                self._free_images.put(images)
@@ -0,0 +1,242 @@
+"""Pipelined variant of export.export_all().
+
+Decoding the SVO file, converting the images and encoding them run in separate threads that are connected by bounded
+queues, so that the CPU-heavy encoding overlaps with decoding in the ZED SDK. OpenCV and the ZED SDK release the GIL
+while they work, so threads are sufficient here.
+
+    decode (grab + retrieve) --> convert (RGBA -> RGB) --> encode (one thread per output)
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import pyzed.sl as sl
+from loguru import logger
+
+from rgb_recorder.recording.encoders import EncoderSettings, VideoEncoder
+from rgb_recorder.recording.frame_index import FrameIndexWriter
+
+from rgb_recorder.recording.zed_sdk.export import OutputMode, OUTPUT_MEASURES, check_export_files, close_camera, \
+    create_video_writers, get_frame_range, get_video_properties, initialize_sdk, open_camera, progress_bar, \
+    create_frame_indexes, get_timestamp_ns, release_outputs, requires_depth, retrieve_output
+
+_END_OF_STREAM = None
+
+
+@dataclass
+class StageStats:
+    """Throughput of a single pipeline stage.
+
+    busy_time is the time spent doing actual work, input_wait_time the time spent waiting for the previous stage and
+    output_wait_time the time spent waiting for the next stage. The stage with the lowest fps limits the pipeline."""
+    name: str
+    frames: int = 0
+    busy_time: float = 0.0
+    input_wait_time: float = 0.0
+    output_wait_time: float = 0.0
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.busy_time if self.busy_time > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.name}: {self.frames} frames, {self.fps:.1f} fps when busy, "
+                f"busy {self.busy_time:.1f}s, waiting for input {self.input_wait_time:.1f}s, "
+                f"waiting for output {self.output_wait_time:.1f}s")
+
+
+class _PipelineAborted(Exception):
+    pass
+
+
+class _Pipeline:
+    """Shared state of the stages: the abort flag and the first error raised by any stage."""
+
+    def __init__(self):
+        self.abort_event = threading.Event()
+        self.error: Optional[BaseException] = None
+
+    def put(self, q: queue.Queue, item, stats: StageStats):
+        start_time = time.perf_counter()
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self.abort_event.is_set():
+                    raise _PipelineAborted()
+        stats.output_wait_time += time.perf_counter() - start_time
+
+    def get(self, q: queue.Queue, stats: StageStats):
+        start_time = time.perf_counter()
+        while True:
+            try:
+                item = q.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.abort_event.is_set():
+                    raise _PipelineAborted()
+        stats.input_wait_time += time.perf_counter() - start_time
+        return item
+
+    def run_stage(self, stage_fn: Callable[[], None]) -> threading.Thread:
+        def run():
+            try:
+                stage_fn()
+            except _PipelineAborted:
+                pass
+            except BaseException as e:
+                if self.error is None:
+                    self.error = e
+                self.abort_event.set()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+def export_pipelined(input_file: str, output_files: Dict[OutputMode, str], decode_queue_depth: int = 4,
+                     encode_queue_depth: int = 4, show_progress: bool = True,
+                     frame_range: Optional[Tuple[int, int]] = None,
+                     encoder_settings: Optional[EncoderSettings] = None,
+                     progress_fn: Optional[Callable[[int, int], None]] = None) -> List[StageStats]:
+    """Export one or more views of an SVO file like export_all(), but with decoding, color conversion and encoding
+    running concurrently.
+
+    Args:
+        input_file: The SVO file to export.
+        output_files: Maps every output mode that should be exported to its output file.
+        decode_queue_depth: The number of decoded frames that can wait for color conversion.
+        encode_queue_depth: The number of converted frames that can wait for encoding, per output.
+        show_progress: Whether to display a progress bar on stdout.
+        frame_range: If given, only export the SVO frames in [start, end), by seeking to start.
+        encoder_settings: The settings of the video encoders. Defaults to OpenCV with the MPEG-4 part 2 codec.
+        progress_fn: Called after every decoded frame with the number of decoded frames and the total number of frames.
+
+    Returns:
+        The throughput of every stage.
+    """
+    check_export_files(input_file, output_files)
+
+    compute_depth = requires_depth(output_files)
+    init = initialize_sdk(input_file, compute_depth=compute_depth)
+    cam = open_camera(init)
+    video_writers: Dict[OutputMode, VideoEncoder] = {}
+    frame_indexes: Dict[OutputMode, FrameIndexWriter] = {}
+    pipeline = _Pipeline()
+    threads: List[threading.Thread] = []
+    try:
+        width, height, fps = get_video_properties(cam)
+        start_frame, end_frame = get_frame_range(cam, frame_range)
+        nb_frames = end_frame - start_frame
+
+        video_writers = create_video_writers(output_files, fps, width, height, encoder_settings, nb_frames)
+        frame_indexes = create_frame_indexes(output_files)
+
+        decode_queue: queue.Queue = queue.Queue(maxsize=decode_queue_depth)
+        encode_queues: Dict[OutputMode, queue.Queue] = {output_mode: queue.Queue(maxsize=encode_queue_depth)
+                                                        for output_mode in output_files}
+
+        decode_stats = StageStats("decode")
+        convert_stats = StageStats("convert")
+        encode_stats = {output_mode: StageStats(f"encode {output_mode.name}") for output_mode in output_files}
+
+        def decode():
+            images = {output_mode: sl.Mat() for output_mode in output_files}
+            rt_param = sl.RuntimeParameters()
+            rt_param.enable_depth = compute_depth
+            if start_frame > 0:
+                cam.set_svo_position(start_frame)
+
+            while not pipeline.abort_event.is_set():
+                start_time = time.perf_counter()
+                err = cam.grab(rt_param)
+                if err == sl.ERROR_CODE.SUCCESS:
+                    svo_position = cam.get_svo_position()
+                    if svo_position >= end_frame:
+                        if show_progress:
+                            progress_bar(100, 30)
+                        logger.info("Reached end of frame range successfully.")
+                        break
+                    timestamp_ns = get_timestamp_ns(cam)
+                    frames = {}
+                    for output_mode, image in images.items():
+                        retrieve_output(cam, image, output_mode)
+                        # The sl.Mat is reused for the next frame, so the data must be copied before handing it over.
+                        frames[output_mode] = image.get_data(deep_copy=True)
+                    decode_stats.frames += 1
+                    decode_stats.busy_time += time.perf_counter() - start_time
+                    pipeline.put(decode_queue, (frames, timestamp_ns, svo_position), decode_stats)
+
+                    if show_progress:
+                        progress_bar((svo_position - start_frame + 1) / nb_frames * 100, 30)
+                    if progress_fn is not None:
+                        progress_fn(svo_position - start_frame + 1, nb_frames)
+
+                if err == sl.ERROR_CODE.END_OF_SVOFILE_REACHED:
+                    if show_progress:
+                        progress_bar(100, 30)
+                    logger.info("Reached end of file successfully.")
+                    break
+
+            pipeline.put(decode_queue, _END_OF_STREAM, decode_stats)
+
+        def convert():
+            while True:
+                item = pipeline.get(decode_queue, convert_stats)
+                if item is _END_OF_STREAM:
+                    break
+                frames, timestamp_ns, svo_position = item
+                start_time = time.perf_counter()
+                # Measures are written to depth stores as they are, only images are converted.
+                converted_frames = {output_mode: frame if output_mode in OUTPUT_MEASURES
+                                    else cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
+                                    for output_mode, frame in frames.items()}
+                convert_stats.frames += 1
+                convert_stats.busy_time += time.perf_counter() - start_time
+                for output_mode, frame in converted_frames.items():
+                    pipeline.put(encode_queues[output_mode], (frame, timestamp_ns, svo_position), convert_stats)
+
+            for encode_queue in encode_queues.values():
+                pipeline.put(encode_queue, _END_OF_STREAM, convert_stats)
+
+        def encode(output_mode: OutputMode):
+            video_writer = video_writers[output_mode]
+            frame_index = frame_indexes[output_mode]
+            stats = encode_stats[output_mode]
+            while True:
+                item = pipeline.get(encode_queues[output_mode], stats)
+                if item is _END_OF_STREAM:
+                    break
+                frame, timestamp_ns, svo_position = item
+                start_time = time.perf_counter()
+                video_writer.write(frame)
+                frame_index.append(timestamp_ns, svo_position, video_writer.last_byte_offset)
+                stats.frames += 1
+                stats.busy_time += time.perf_counter() - start_time
+
+        threads.extend([pipeline.run_stage(decode), pipeline.run_stage(convert)])
+        threads.extend(pipeline.run_stage(lambda output_mode=output_mode: encode(output_mode))
+                       for output_mode in output_files)
+        for thread in threads:
+            thread.join()
+        if pipeline.error is not None:
+            raise pipeline.error
+    finally:
+        # The stages use the outputs and the camera, so they are stopped before these are closed, also when the
+        # export fails halfway.
+        pipeline.abort_event.set()
+        for thread in threads:
+            thread.join()
+        try:
+            release_outputs(video_writers, frame_indexes)
+        finally:
+            close_camera(cam)
+
+    stats = [decode_stats, convert_stats, *encode_stats.values()]
+    for stage_stats in stats:
+        logger.info(str(stage_stats))
+    return stats
@@ -1,9 +1,12 @@
 from threading import Barrier
-from typing import Callable
+from typing import Callable, Optional
 
 import pyzed.sl as sl
 from loguru import logger
 
+from rgb_recorder.recording.frame_index import FrameIndexWriter, index_filename
+from rgb_recorder.recording.zed_sdk.live_export import LiveExporter
+
 
 class Camera:
     def __init__(self, camera: sl.Camera):
@@ -42,7 +45,8 @@ def close_camera(camera: sl.Camera):
     camera.close()
 
 
-def record_video(camera_serial_number: str, filename: str, should_stop_fn: Callable[[], bool], start_barrier: Barrier):
+def record_video(camera_serial_number: str, filename: str, should_stop_fn: Callable[[], bool], start_barrier: Barrier,
+                 live_exporter: Optional[LiveExporter] = None):
     if not filename.endswith(".svo") and not filename.endswith(".svo2"):
         raise ValueError("Filename should be a .svo file but is not : ", filename)
 
@@ -51,14 +55,26 @@ def record_video(camera_serial_number: str, filename: str, should_stop_fn: Calla
     cam = open_camera(init, filename)
 
     camera = Camera(cam)
+    frame_index = FrameIndexWriter(index_filename(filename))
+    if live_exporter is not None:
+        live_exporter.start(cam)
 
     logger.info("Waiting for other cameras to get ready...")
     start_barrier.wait()  # Wait until all cameras are ready to start recording.
     logger.info("All cameras are ready, starting recording...")
     while not should_stop_fn():
         if camera.grab():
+            # Frames are appended to the SVO file in the order in which they are grabbed.
+            frame_index.append(cam.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds(), camera.frames_recorded)
             camera.frames_recorded += 1
+            if live_exporter is not None:
+                live_exporter.offer(cam)
             print("Frame count: " + str(camera.frames_recorded), end="\r")
 
     logger.info(f"Recording stopped, closing camera with SN={camera_serial_number}...")
     close_camera(cam)
+    frame_index.close()
+
+    if live_exporter is not None:
+        logger.info(f"Finishing live export of camera with SN={camera_serial_number}...")
+        live_exporter.finish()
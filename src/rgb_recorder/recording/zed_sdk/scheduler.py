@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from rgb_recorder.recording.encoders import EncoderSettings
+from rgb_recorder.recording.zed_sdk.export import OutputMode, export_all
+from rgb_recorder.recording.zed_sdk.pipeline import export_pipelined
+
+# Suffix that replaces the extension of the SVO file for every output mode.
+OUTPUT_SUFFIXES = {
+    OutputMode.RGB_LEFT: "_rgb_left.mp4",
+    OutputMode.RGB_RIGHT: "_rgb_right.mp4",
+    OutputMode.DEPTH_LEFT: "_depth.mp4",
+    OutputMode.DEPTH_LEFT_MM: "_depth_mm.npy",
+}
+
+# Metric depth is large when stored uncompressed, so it is only exported on request.
+DEFAULT_OUTPUT_MODES = (OutputMode.RGB_LEFT, OutputMode.RGB_RIGHT, OutputMode.DEPTH_LEFT)
+
+
+@dataclass
+class ExportJob:
+    """A single export of (a frame range of) one SVO file to one or more output files."""
+    input_file: str
+    output_files: Dict[OutputMode, str]
+    pipelined: bool = False
+    frame_range: Optional[Tuple[int, int]] = None
+    encoder_settings: Optional[EncoderSettings] = None
+
+
+@dataclass
+class ExportResult:
+    """The outcome of an ExportJob. If the job failed, error contains a description of the exception."""
+    job: ExportJob
+    duration: float
+    error: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def output_files_for(svo_filename: str, output_modes: Iterable[OutputMode]) -> Dict[OutputMode, str]:
+    _, ext = os.path.splitext(svo_filename)
+    return {output_mode: svo_filename.replace(ext, OUTPUT_SUFFIXES[output_mode]) for output_mode in output_modes}
+
+
+def create_export_jobs(svo_filenames: Iterable[str],
+                       output_modes: Iterable[OutputMode] = DEFAULT_OUTPUT_MODES,
+                       split_outputs: bool = False,
+                       pipelined: bool = False,
+                       encoder_settings: Optional[EncoderSettings] = None) -> List[ExportJob]:
+    """Create the export jobs for a list of SVO files.
+
+    Args:
+        svo_filenames: The SVO files to export.
+        output_modes: The outputs to create for every SVO file.
+        split_outputs: If True, create one job per output instead of one job per SVO file. This allows the outputs of
+            a single SVO file to be exported in parallel, at the cost of decoding the SVO file once per output.
+        pipelined: If True, use export_pipelined() instead of export_all().
+        encoder_settings: The settings of the video encoders.
+    """
+    output_modes = list(output_modes)
+    jobs = []
+    for svo_filename in svo_filenames:
+        output_files = output_files_for(svo_filename, output_modes)
+        if split_outputs:
+            jobs.extend(ExportJob(svo_filename, {output_mode: output_file}, pipelined,
+                                  encoder_settings=encoder_settings)
+                        for output_mode, output_file in output_files.items())
+        else:
+            jobs.append(ExportJob(svo_filename, output_files, pipelined, encoder_settings=encoder_settings))
+    return jobs
+
+
+def run_export_job(job: ExportJob, progress_fn: Optional[Callable[[int, int], None]] = None) -> float:
+    """Run an export job in the current process and return how long it took."""
+    start_time = time.time()
+    if job.pipelined:
+        export_pipelined(job.input_file, job.output_files, show_progress=False, frame_range=job.frame_range,
+                         encoder_settings=job.encoder_settings, progress_fn=progress_fn)
+    else:
+        export_all(job.input_file, job.output_files, show_progress=False, frame_range=job.frame_range,
+                   encoder_settings=job.encoder_settings, progress_fn=progress_fn)
+    return time.time() - start_time
+
+
+class ExportScheduler:
+    """Runs export jobs in a pool of worker processes.
+
+    The ZED SDK and the disk can saturate before all cores are in use, so next to the size of the pool, the number of
+    jobs that run at the same time can be limited separately."""
+
+    def __init__(self, num_workers: Optional[int] = None, max_concurrent_jobs: Optional[int] = None):
+        """
+        Args:
+            num_workers: The number of worker processes. Defaults to the number of CPUs.
+            max_concurrent_jobs: The maximum number of jobs that run at the same time. Defaults to num_workers.
+        """
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.max_concurrent_jobs = min(max_concurrent_jobs or self.num_workers, self.num_workers)
+
+    def run(self, jobs: List[ExportJob],
+            result_fn: Optional[Callable[[ExportResult], None]] = None) -> List[ExportResult]:
+        """Run all jobs and block until they are finished.
+
+        A failing job does not stop the other jobs: its exception is reported in its ExportResult.
+
+        Args:
+            jobs: The jobs to run.
+            result_fn: Called in the calling process with the result of every job, as soon as that job is finished.
+
+        Returns:
+            The results, in the same order as the jobs.
+        """
+        results: List[Optional[ExportResult]] = [None] * len(jobs)
+        start_times: Dict[int, float] = {}
+        pending_jobs = list(enumerate(jobs))
+        running: Dict[Future, int] = {}
+
+        logger.info(f"Exporting {len(jobs)} jobs with {self.num_workers} workers "
+                    f"({self.max_concurrent_jobs} concurrent jobs).")
+
+        # Spawn instead of fork, to avoid issues with the CUDA context of the ZED SDK.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.num_workers, mp_context=context) as executor:
+            while pending_jobs or running:
+                while pending_jobs and len(running) < self.max_concurrent_jobs:
+                    job_index, job = pending_jobs.pop(0)
+                    logger.info(f"Exporting {job.input_file} to {', '.join(job.output_files.values())}...")
+                    start_times[job_index] = time.time()
+                    running[executor.submit(run_export_job, job)] = job_index
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_index = running.pop(future)
+                    job = jobs[job_index]
+                    exception = future.exception()
+                    if exception is None:
+                        result = ExportResult(job, future.result())
+                        logger.info(f"Exported {job.input_file} in {result.duration:.1f}s.")
+                    else:
+                        result = ExportResult(job, time.time() - start_times[job_index], error=repr(exception))
+                        logger.error(f"Failed to export {job.input_file}: {result.error}")
+                    results[job_index] = result
+                    if result_fn is not None:
+                        result_fn(result)
+
+        return results  # type: ignore[return-value]
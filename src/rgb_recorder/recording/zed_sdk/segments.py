@@ -0,0 +1,107 @@
+"""Export a single SVO file with several workers, by splitting it into frame ranges.
+
+Every worker seeks to the start of its frame range and exports it to separate segment files. Every segment file starts
+with a key frame, so the segments can then be joined by FFmpeg's concat demuxer without re-encoding. FFmpeg must be
+available on the PATH.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from rgb_recorder.recording.encoders import EncoderSettings
+from rgb_recorder.recording.frame_index import concatenate_indexes, index_filename
+from rgb_recorder.recording.zed_sdk.export import OutputMode, OUTPUT_VIEWS, check_export_files, close_camera, \
+    initialize_sdk, open_camera
+from rgb_recorder.recording.zed_sdk.scheduler import ExportJob, ExportScheduler
+
+
+def get_number_of_frames(input_file: str) -> int:
+    cam = open_camera(initialize_sdk(input_file, compute_depth=False))
+    nb_frames = cam.get_svo_number_of_frames()
+    close_camera(cam)
+    return nb_frames
+
+
+def split_frames(nb_frames: int, num_segments: int) -> List[Tuple[int, int]]:
+    """Split [0, nb_frames) into at most num_segments contiguous, (almost) equally sized frame ranges."""
+    num_segments = max(1, min(num_segments, nb_frames))
+    bounds = [round(i * nb_frames / num_segments) for i in range(num_segments + 1)]
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def segment_filename(output_file: str, segment_index: int) -> str:
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.part{segment_index:03d}{ext}"
+
+
+def concatenate_videos(segment_files: List[str], output_file: str):
+    """Join video files with identical encoding parameters into one file, without re-encoding."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("FFmpeg is required to concatenate video segments, but it was not found on the PATH.")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        list_file = os.path.join(tmp_dir, "segments.txt")
+        with open(list_file, "w") as f:
+            for segment_file in segment_files:
+                escaped_path = os.path.abspath(segment_file).replace("'", "'\\''")
+                f.write(f"file '{escaped_path}'\n")
+        subprocess.run([ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file,
+                        "-c", "copy", output_file], check=True)
+
+
+def export_segmented(input_file: str, output_files: Dict[OutputMode, str], num_segments: int,
+                     scheduler: Optional[ExportScheduler] = None, pipelined: bool = False,
+                     encoder_settings: Optional[EncoderSettings] = None):
+    """Export one or more views of an SVO file like export_all(), but split into num_segments frame ranges that are
+    exported in parallel.
+
+    Args:
+        input_file: The SVO file to export.
+        output_files: Maps every output mode that should be exported to its output file.
+        num_segments: The number of frame ranges to split the SVO file into.
+        scheduler: The scheduler that runs the segment exports. Defaults to one worker per segment.
+        pipelined: If True, use export_pipelined() for every segment.
+        encoder_settings: The settings of the video encoders.
+    """
+    check_export_files(input_file, output_files)
+    for output_mode in output_files:
+        if output_mode not in OUTPUT_VIEWS:
+            raise ValueError(f"Only video outputs can be exported in segments, not {output_mode}.")
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("FFmpeg is required to concatenate video segments, but it was not found on the PATH.")
+
+    frame_ranges = split_frames(get_number_of_frames(input_file), num_segments)
+    logger.info(f"Exporting {input_file} in {len(frame_ranges)} segments: {frame_ranges}.")
+
+    segment_files = {output_mode: [segment_filename(output_file, i) for i in range(len(frame_ranges))]
+                     for output_mode, output_file in output_files.items()}
+    jobs = [ExportJob(input_file, {output_mode: files[i] for output_mode, files in segment_files.items()},
+                      pipelined, frame_range, encoder_settings)
+            for i, frame_range in enumerate(frame_ranges)]
+
+    if scheduler is None:
+        scheduler = ExportScheduler(num_workers=len(jobs))
+
+    try:
+        results = scheduler.run(jobs)
+        failed = [result for result in results if not result.succeeded]
+        if failed:
+            raise RuntimeError(f"Could not export {len(failed)} segments of {input_file}: "
+                               + ", ".join(result.error for result in failed))
+
+        for output_mode, output_file in output_files.items():
+            logger.info(f"Concatenating {len(frame_ranges)} segments into {output_file}.")
+            concatenate_videos(segment_files[output_mode], output_file)
+            concatenate_indexes([index_filename(segment_file) for segment_file in segment_files[output_mode]],
+                                index_filename(output_file))
+    finally:
+        for files in segment_files.values():
+            for segment_file in files:
+                for file in (segment_file, index_filename(segment_file)):
+                    if os.path.isfile(file):
+                        os.remove(file)
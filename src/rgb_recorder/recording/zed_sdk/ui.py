@@ -11,23 +11,29 @@ from tkinter import messagebox
 
 from loguru import logger
 
-from rgb_recorder.recording.zed_sdk.export import export, OutputMode
+from rgb_recorder.recording.zed_sdk.jobs import ExportJobQueue, JobStatus
+from rgb_recorder.recording.zed_sdk.live_export import LIVE_OUTPUT_MODES, LiveExporter
 from rgb_recorder.recording.zed_sdk.record import record_video
+from rgb_recorder.recording.zed_sdk.scheduler import DEFAULT_OUTPUT_MODES, create_export_jobs, output_files_for
 
 config = configparser.ConfigParser()
 config_file = os.path.join(os.getcwd(), "svo_config.ini")
+export_jobs_file = os.path.join(os.getcwd(), "svo_export_jobs.json")
 
 
 def load_config():
     if config.read(config_file):
         serial_numbers_entry.insert(0, config.get('Settings', 'serial_numbers', fallback=''))
         output_dir_entry.insert(0, config.get('Settings', 'output_dir', fallback='output'))
+        live_export_var.set(config.getboolean('Settings', 'live_export', fallback=True))
 
 
 def save_config():
     config['Settings'] = {
         'serial_numbers': serial_numbers_entry.get(),
-        'output_dir': output_dir_entry.get()
+        'output_dir': output_dir_entry.get(),
+        'live_export': str(live_export_var.get()),
+        'export_workers': str(export_queue.num_workers)
     }
     with open(config_file, 'w') as configfile:
         config.write(configfile)
@@ -36,8 +42,13 @@ def save_config():
 start_button = None
 stop_button = None
 status_label = None
+export_status_label = None
+export_queue = None
 should_stop = Event()
+recording_stopped = Event()
 svo_filenames = []
+recording_threads = []
+live_exporters = []
 
 
 def should_stop_fn() -> bool:
@@ -59,9 +70,13 @@ def start():
     global status_label
     global should_stop
     global svo_filenames
+    global recording_threads
+    global live_exporters
 
     should_stop.clear()
+    recording_stopped.clear()
     svo_filenames = []
+    live_exporters = []
 
     serial_numbers = serial_numbers_entry.get().split()
     output_dir = output_dir_entry.get()
@@ -74,15 +89,21 @@ def start():
         return
 
     logger.info(f"Starting {len(serial_numbers)} recording threads...")
-    threads = []
+    recording_threads = []
     recording_barrier = Barrier(len(serial_numbers))
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     for serial_number in serial_numbers:
         video_path = create_output_file(output_dir, serial_number, timestamp)
         svo_filenames.append(video_path)
-        t = Thread(target=record_video, args=(serial_number, video_path, should_stop_fn, recording_barrier))
+        # Export the views while recording, so that only the last few frames remain to be exported when recording
+        # stops. This takes some time from the recording threads, so it can be turned off.
+        live_exporter = LiveExporter(output_files_for(video_path, LIVE_OUTPUT_MODES)) if live_export_var.get() \
+            else None
+        live_exporters.append(live_exporter)
+        t = Thread(target=record_video,
+                   args=(serial_number, video_path, should_stop_fn, recording_barrier, live_exporter))
         t.start()
-        threads.append(t)
+        recording_threads.append(t)
 
     # Disable start_button, enable stop_button
     start_button.config(state=tk.DISABLED)
@@ -92,38 +113,81 @@ def start():
     status_label.config(text="Recording... Do not close this window. Click 'Stop' to save recording.")
 
 
+def finish_recording(threads, filenames, exporters):
+    """Runs in a background thread, so that the UI stays responsive while the cameras are closed."""
+    global export_queue
+
+    # The SVO files are only complete once the cameras are closed.
+    for t in threads:
+        t.join()
+
+    # The outputs that were not exported live are exported from the SVO files, all of them if the live export could
+    # not keep up.
+    jobs = []
+    for svo_filename, live_exporter in zip(filenames, exporters):
+        if live_exporter is not None and live_exporter.complete:
+            output_modes = [output_mode for output_mode in DEFAULT_OUTPUT_MODES
+                            if output_mode not in live_exporter.output_files]
+        else:
+            output_modes = list(DEFAULT_OUTPUT_MODES)
+        if output_modes:
+            jobs.extend(create_export_jobs([svo_filename], output_modes))
+    if jobs:
+        logger.info(f"Queueing the export of {len(jobs)} SVO files...")
+        export_queue.enqueue(jobs)
+
+    recording_stopped.set()
+
+
 def stop():
-    global start_button
     global stop_button
     global status_label
     global should_stop
     global svo_filenames
+    global recording_threads
+    global live_exporters
 
     stop_button.config(state=tk.DISABLED)
 
     logger.info("Stop button clicked. Stopping all camera recordings...")
     should_stop.set()
+    status_label.config(text="Stopping recording... Do not close this window.")
 
-    start_button.config(state=tk.NORMAL)
+    Thread(target=finish_recording, args=(recording_threads, svo_filenames, live_exporters), daemon=True).start()
 
-    logger.info("Exporting video data...")
-    status_label.config(text="Exporting... Do not close this window.")
+    save_config()
 
-    for svo_filename in svo_filenames:
-        # Get extension.
-        _, ext = os.path.splitext(svo_filename)
 
-        logger.info(f"Exporting SVO file {svo_filename} to RGB videos... (1/2)")
-        export(svo_filename, svo_filename.replace(ext, "_rgb_left.mp4"), OutputMode.RGB_LEFT)
-        logger.info(f"Exporting SVO file {svo_filename} to RGB videos... (2/2)")
-        export(svo_filename, svo_filename.replace(ext, "_rgb_right.mp4"), OutputMode.RGB_RIGHT)
-        logger.info(f"Exporting SVO file {svo_filename} to depth video... (1/1)")
-        export(svo_filename, svo_filename.replace(ext, "_depth.mp4"), OutputMode.DEPTH_LEFT)
+def update_status():
+    """Periodically shows the state of the export jobs, and allows a new recording once the cameras are closed."""
+    global start_button
+    global status_label
+    global export_status_label
+    global export_queue
 
-    logger.info("Ready to record.")
-    status_label.config(text="Ready to record.")
+    if recording_stopped.is_set():
+        recording_stopped.clear()
+        start_button.config(state=tk.NORMAL)
+        logger.info("Ready to record.")
+        status_label.config(text="Ready to record.")
+
+    jobs = [job for job in export_queue.snapshot() if job.status != JobStatus.DONE]
+    if jobs:
+        export_status_label.config(text="Exports:\n" + "\n".join(job.describe() for job in jobs))
+    else:
+        export_status_label.config(text="No exports running.")
+
+    app.after(500, update_status)
 
-    save_config()
+
+def close():
+    global export_queue
+
+    if export_queue.busy:
+        logger.info("Waiting for running exports to finish. Pending exports will continue when the application is "
+                    "started again.")
+    app.destroy()
+    export_queue.stop()
 
 
 if __name__ == '__main__':
@@ -140,15 +204,33 @@ if __name__ == '__main__':
     output_dir_entry = tk.Entry(app, width=50)
     output_dir_entry.grid(row=1, column=1)
 
+    live_export_var = tk.BooleanVar(app, value=True)
+    tk.Checkbutton(app, text="Export the RGB views while recording", variable=live_export_var).grid(
+        row=2, column=0, columnspan=2, sticky=tk.W)
+
     start_button = tk.Button(app, text="Start", command=start)
-    start_button.grid(row=2, column=0, columnspan=1)
+    start_button.grid(row=3, column=0, columnspan=1)
     stop_button = tk.Button(app, text="Stop and export", command=stop)
-    stop_button.grid(row=2, column=1, columnspan=1)
+    stop_button.grid(row=3, column=1, columnspan=1)
     stop_button.config(state=tk.DISABLED)
 
     status_label = tk.Label(app, text="")
-    status_label.grid(row=3, column=0, columnspan=2)
+    status_label.grid(row=4, column=0, columnspan=2)
     status_label.config(text="Ready to record.")
 
+    export_status_label = tk.Label(app, text="", justify=tk.LEFT)
+    export_status_label.grid(row=5, column=0, columnspan=2, sticky=tk.W)
+    tk.Button(app, text="Clear finished exports", command=lambda: export_queue.clear_finished()).grid(
+        row=6, column=0, columnspan=2)
+
     load_config()
+    # Exports that were still queued or running when the application was closed are resumed, the finished ones of
+    # earlier sessions are forgotten.
+    export_queue = ExportJobQueue(export_jobs_file, num_workers=config.getint('Settings', 'export_workers',
+                                                                              fallback=2))
+    export_queue.clear_finished()
+    export_queue.start()
+
+    app.protocol("WM_DELETE_WINDOW", close)
+    app.after(500, update_status)
     app.mainloop()